@@ -1,8 +1,10 @@
 from django.contrib import admin
+from django.contrib.admin.actions import delete_selected
 
 from .models import (
-    Feed, FeedEntry, FeedEnclosure, FeedContent, KeywordFilter
+    CrawlRequest, Feed, FeedEntry, FeedEnclosure, FeedContent, KeywordFilter
 )
+from .utils import invalidate_feeds
 
 
 class FeedAdmin(admin.ModelAdmin):
@@ -13,9 +15,17 @@ class FeedAdmin(admin.ModelAdmin):
     list_filter = ('updated', 'active', 'error_state')
 
     readonly_fields = (
-        'updated', 'error_state', 'error_description', 'error_date'
+        'updated', 'error_state', 'error_description', 'error_date',
+        'last_crawl', 'next_crawl', 'crawl_interval',
+        'claimed_by', 'claimed_until'
     )
 
+    def save_model(self, request, obj, form, change):
+        super(FeedAdmin, self).save_model(request, obj, form, change)
+
+        # Activation and feed titles affect the aggregated output
+        invalidate_feeds()
+
 
 class FeedEnclosureInline(admin.StackedInline):
     model = FeedEnclosure
@@ -34,16 +44,55 @@ class FeedEntryAdmin(admin.ModelAdmin):
     search_fields = ('title', 'author', 'summary')
 
     readonly_fields = (
-        'entry_id',
+        'entry_id', 'extracted', 'duplicate_of'
     )
 
     inlines = (FeedEnclosureInline, FeedContentInline)
 
+    actions = ('delete_entries', )
+
+    def save_related(self, request, form, formsets, change):
+        super(FeedEntryAdmin, self).save_related(
+            request, form, formsets, change
+        )
+
+        # Entries, their content and enclosures are in the output feeds
+        invalidate_feeds()
+
+    def delete_model(self, request, obj):
+        super(FeedEntryAdmin, self).delete_model(request, obj)
+
+        invalidate_feeds()
+
+    def get_actions(self, request):
+        actions = super(FeedEntryAdmin, self).get_actions(request)
+
+        # Replaced by delete_entries, which invalidates the output feeds
+        actions.pop('delete_selected', None)
+
+        return actions
+
+    def delete_entries(self, request, queryset):
+        response = delete_selected(self, request, queryset)
+
+        # Without a response, the entries have been deleted
+        if response is None:
+            invalidate_feeds()
+
+        return response
+
+    delete_entries.short_description = delete_selected.short_description
+
 
 class KeywordFilterAdmin(admin.ModelAdmin):
     pass
 
 
+class CrawlRequestAdmin(admin.ModelAdmin):
+    list_display = ('feed', 'queued')
+
+
 admin.site.register(Feed, FeedAdmin)
 admin.site.register(FeedEntry, FeedEntryAdmin)
 admin.site.register(KeywordFilter, KeywordFilterAdmin)
+admin.site.register(CrawlRequest, CrawlRequestAdmin)
@@ -0,0 +1,336 @@
+import logging
+logger = logging.getLogger(__name__)
+
+import json
+import os
+import sys
+import time
+
+from contextlib import contextmanager
+
+import eventlet
+import eventlet.wsgi
+import feedparser
+
+from lxml import html
+
+from django.conf import settings
+from django.core.urlresolvers import reverse
+from django.test.client import Client
+from django.utils.datastructures import SortedDict
+
+from .crawler import extract_xpath, filter_entry, update_feeds
+from .fetching import host_limiter, page_cache
+from .metrics import metrics
+from .models import Feed, FeedEntry, KeywordFilter
+from .utils import (
+    get_simhash, invalidate_feeds, keywords_to_regex, parse_url
+)
+
+
+# Recorded feed and page, with placeholders for the local server
+FIXTURE_ROOT = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+FEED_FIXTURE = os.path.join(FIXTURE_ROOT, 'benchmark_feed.rss')
+PAGE_FIXTURE = os.path.join(FIXTURE_ROOT, 'benchmark_page.html')
+
+# Keywords for the filter applied to all feeds
+FILTER_KEYWORDS = u'telecom*, privacy, bewaar*, cyber*, internet'
+
+# One in this many feeds uses XPath extraction
+XPATH_FEED_INTERVAL = 10
+
+# Results more than this fraction slower than the baseline are regressions
+DEFAULT_THRESHOLD = 0.1
+
+
+class FixtureServer(object):
+    """
+    WSGI application serving the recorded feed and page for any number of
+    feeds from a local green thread: /feeds/<n>.rss and /feeds/<n>/<i>.html.
+    """
+
+    def __init__(self):
+        self.feed = open(FEED_FIXTURE).read()
+        self.page = open(PAGE_FIXTURE).read()
+
+        sock = eventlet.listen(('127.0.0.1', 0))
+        self.base_url = 'http://127.0.0.1:%d' % sock.getsockname()[1]
+
+        self.server = eventlet.spawn(
+            eventlet.wsgi.server, sock, self, log=open(os.devnull, 'w')
+        )
+
+    def __call__(self, environ, start_response):
+        path = environ['PATH_INFO']
+
+        if path.startswith('/feeds/') and path.endswith('.rss'):
+            feed = path[len('/feeds/'):-len('.rss')]
+
+            start_response('200 OK', [
+                ('Content-Type', 'application/rss+xml; charset=utf-8')
+            ])
+
+            return [self.feed.replace('{base_url}', self.base_url).replace(
+                '{feed}', feed
+            )]
+
+        if path.startswith('/feeds/') and path.endswith('.html'):
+            start_response('200 OK', [
+                ('Content-Type', 'text/html; charset=utf-8')
+            ])
+
+            return [self.page]
+
+        start_response('404 Not Found', [])
+
+        return ['']
+
+    def get_feed_url(self, number):
+        return '%s/feeds/%d.rss' % (self.base_url, number)
+
+    def stop(self):
+        self.server.kill()
+
+
+@contextmanager
+def local_crawling():
+    """
+    Disable politeness limits and the page cache, as all feeds are served
+    by the local server, and duplicate detection, as all feeds are the same.
+    """
+    limits = (host_limiter.connections, host_limiter.delay)
+    host_connections = settings.NEWSPEAK_HOST_CONNECTIONS
+    duplicate_distance = settings.NEWSPEAK_DUPLICATE_DISTANCE
+    cache_directory = page_cache.directory
+
+    host_limiter.connections = settings.NEWSPEAK_THREADS
+    host_limiter.delay = 0
+    settings.NEWSPEAK_HOST_CONNECTIONS = settings.NEWSPEAK_THREADS
+    settings.NEWSPEAK_DUPLICATE_DISTANCE = 0
+    page_cache.directory = None
+
+    try:
+        yield
+
+    finally:
+        host_limiter.connections, host_limiter.delay = limits
+        settings.NEWSPEAK_HOST_CONNECTIONS = host_connections
+        settings.NEWSPEAK_DUPLICATE_DISTANCE = duplicate_distance
+        page_cache.directory = cache_directory
+
+
+def time_call(function, number, repeat=3):
+    """
+    Return the time per call for the fastest of `repeat` series of `number`
+    calls to the function.
+    """
+    timings = []
+
+    for series in range(repeat):
+        start = time.time()
+
+        for call in range(number):
+            function()
+
+        timings.append((time.time() - start) / number)
+
+    return min(timings)
+
+
+class Benchmark(object):
+    """
+    Times the crawler's hot paths against recorded fixtures served from a
+    local server, so results are reproducible without network access.
+
+    Crawling and rendering are timed for each number of feeds in `sizes`,
+    other functions are timed once. Meant to be run against a test
+    database, as all feeds and entries are replaced.
+    """
+
+    def __init__(self, sizes):
+        self.sizes = sizes
+        self.results = SortedDict()
+
+    def run(self):
+        """ Run all benchmarks and return the results, in seconds. """
+        self.server = FixtureServer()
+
+        try:
+            with local_crawling():
+                self.run_functions()
+
+                for size in self.sizes:
+                    self.run_size(size)
+
+        finally:
+            self.server.stop()
+
+        return self.results
+
+    def add_result(self, name, seconds):
+        logger.info(u'%s: %.6f s', name, seconds)
+
+        self.results[name] = seconds
+
+    def create_feeds(self, count):
+        """ Replace all feeds with `count` feeds served locally. """
+        FeedEntry.objects.all().delete()
+        Feed.objects.all().delete()
+        KeywordFilter.objects.all().delete()
+
+        keyword_filter = KeywordFilter.objects.create(
+            name=u'Benchmark', keywords=FILTER_KEYWORDS
+        )
+
+        feeds = []
+
+        for number in range(count):
+            feed = Feed(url=self.server.get_feed_url(number))
+
+            if number % XPATH_FEED_INTERVAL == 0:
+                feed.content_xpath = u'//div[@id="content"]'
+                feed.content_mime_type = u'text/html'
+                feed.enclosure_xpath = u'//a[@class="download"]/@href'
+                feed.enclosure_mime_type = u'application/pdf'
+
+            feeds.append(feed)
+
+        # Created in bulk, as saving would crawl each feed
+        Feed.objects.bulk_create(feeds)
+
+        through = Feed.filters.through
+
+        through.objects.bulk_create([
+            through(feed_id=feed_pk, keywordfilter_id=keyword_filter.pk)
+            for feed_pk in Feed.objects.values_list('pk', flat=True)
+        ])
+
+    def run_functions(self):
+        """ Time functions independent of the number of feeds. """
+        feed_data = open(FEED_FIXTURE).read().replace(
+            '{base_url}', self.server.base_url
+        ).replace('{feed}', '0')
+        page_data = open(PAGE_FIXTURE).read()
+
+        entries = feedparser.parse(feed_data).entries
+
+        self.add_result('parse_feed', time_call(
+            lambda: feedparser.parse(feed_data), 10
+        ))
+
+        def regex_uncached():
+            keywords_to_regex.cache.clear()
+            keywords_to_regex(FILTER_KEYWORDS)
+
+        self.add_result('keywords_to_regex', time_call(regex_uncached, 100))
+        self.add_result('keywords_to_regex[cached]', time_call(
+            lambda: keywords_to_regex(FILTER_KEYWORDS), 1000
+        ))
+
+        self.create_feeds(1)
+        feed = Feed.objects.get()
+
+        def filter_entries():
+            for entry in entries:
+                filter_entry(feed, entry)
+
+        self.add_result('filter_entry', time_call(filter_entries, 10) /
+            len(entries)
+        )
+
+        def simhash_entries():
+            for entry in entries:
+                get_simhash(u'%s %s' % (entry.title, entry.summary))
+
+        self.add_result('get_simhash', time_call(simhash_entries, 10) /
+            len(entries)
+        )
+
+        parsed = html.fromstring(page_data)
+
+        self.add_result('extract_xpath', time_call(
+            lambda: extract_xpath(parsed, u'//div[@id="content"]'), 100
+        ))
+
+        page_url = self.server.base_url + '/feeds/0/0.html'
+
+        self.add_result('parse_url', time_call(
+            lambda: parse_url(page_url), 10
+        ))
+
+    def run_size(self, size):
+        """ Time crawling and rendering for a number of feeds. """
+        self.create_feeds(size)
+
+        metrics.reset()
+
+        start = time.time()
+        update_feeds(force=True)
+        self.add_result('update_feeds[%d]' % size, time.time() - start)
+
+        # Time spent per crawl stage
+        for stage, seconds in sorted(metrics.seconds.items()):
+            self.add_result('update_feeds[%d].%s' % (size, stage), seconds)
+
+        client = Client()
+
+        def render(url):
+            # Render the feed rather than serve it from the cache
+            invalidate_feeds()
+
+            client.get(url)
+
+        for name in ('rss_all', 'atom_all'):
+            url = reverse(name)
+
+            self.add_result('render[%s][%d]' % (name, size),
+                time_call(lambda: render(url), 3)
+            )
+
+
+def get_report(results, sizes):
+    """ Return benchmark results in a comparable, JSON-serializable form. """
+    return {
+        'python': sys.version.split()[0],
+        'time': time.time(),
+        'sizes': sizes,
+        'results': results,
+    }
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    Compare results to a baseline report, returning a list of tuples with
+    name, baseline and current time, relative change and whether it is a
+    regression, for all benchmarks in both.
+    """
+    comparison = []
+
+    for name, seconds in results.items():
+        if name not in baseline['results']:
+            continue
+
+        baseline_seconds = baseline['results'][name]
+
+        if baseline_seconds:
+            change = (seconds - baseline_seconds) / baseline_seconds
+        else:
+            change = 0
+
+        comparison.append(
+            (name, baseline_seconds, seconds, change, change > threshold)
+        )
+
+    return comparison
+
+
+def load_report(path):
+    """ Load a report written by a previous run. """
+    return json.load(open(path))
+
+
+def write_report(report, path):
+    """ Write a report to a file, for later comparison. """
+    with open(path, 'w') as report_file:
+        json.dump(report, report_file, indent=2, sort_keys=True)
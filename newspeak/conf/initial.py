@@ -34,7 +34,9 @@ ALLOWED_HOSTS = ['127.0.0.1', 'localhost']
 # LANGUAGE_CODE = 'nl-nl'
 
 # If you're expecting any kind of real traffic on newspeak, we highly
-# recommend configuring memcached.
+# recommend configuring memcached. Rendered feeds are cached, and invalidated
+# when crawling changes entries only when the cache is shared between the
+# crawler and the web server, as memcached is.
 
 # CACHES = {
 #     'default': {
@@ -63,3 +65,63 @@ ALLOWED_HOSTS = ['127.0.0.1', 'localhost']
 #
 # Perform case sensitive matching on keywords
 # NEWSPEAK_CASE_SENSITIVE = True
+#
+# Maximum number of compiled keyword regular expressions kept in memory
+# NEWSPEAK_REGEX_CACHE_SIZE = 1024
+#
+# Queue new feeds for a background crawl instead of fetching them while saving,
+# requires running `newspeak update_feeds --queued` frequently
+# NEWSPEAK_QUEUE_NEW_FEEDS = True
+#
+# Feeds are crawled at an interval adapted to how often they change, bounded
+# by these values in seconds, backing off for unchanged or failing feeds
+# NEWSPEAK_CRAWL_INTERVAL_MIN = 5 * 60
+# NEWSPEAK_CRAWL_INTERVAL_MAX = 24 * 60 * 60
+# NEWSPEAK_CRAWL_BACKOFF = 1.5
+# NEWSPEAK_ERROR_BACKOFF = 2
+#
+# Crawlers claim due feeds in batches, so several crawlers (on one or more
+# machines) can run at once. Claims expire after the duration in seconds
+# unless renewed by a running crawler, so feeds of crawlers which died are
+# crawled again
+# NEWSPEAK_CLAIM_BATCH_SIZE = 500
+# NEWSPEAK_CLAIM_DURATION = 30 * 60
+#
+# Maximum time in seconds `newspeak crawld` sleeps before checking for queued
+# or due feeds
+# NEWSPEAK_DAEMON_INTERVAL = 60
+#
+# Number of pages fetched concurrently for XPath extraction, per feed
+# NEWSPEAK_PAGE_THREADS = 8
+#
+# Politeness towards feed hosts: concurrent requests per host and minimum
+# delay between requests to the same host, in seconds
+# NEWSPEAK_HOST_CONNECTIONS = 2
+# NEWSPEAK_HOST_DELAY = 0.25
+#
+# HTTP request timeout and keep-alive connection pooling: idle connections
+# kept per host and the time after which idle connections are closed
+# NEWSPEAK_HTTP_TIMEOUT = 30
+# NEWSPEAK_POOL_CONNECTIONS = 4
+# NEWSPEAK_POOL_IDLE_TIMEOUT = 60
+#
+# Cache fetched pages on disk, so unchanged pages are revalidated rather than
+# downloaded again, with the maximum size of the cache in bytes
+# NEWSPEAK_PAGE_CACHE_DIR = os.path.join(CONF_ROOT, 'page_cache')
+# NEWSPEAK_PAGE_CACHE_SIZE = 100 * 1024 * 1024
+#
+# Write crawl metrics (counters and time spent per crawl stage) to a file in
+# Prometheus text format, or JSON for file names ending in `.json`
+# NEWSPEAK_METRICS_FILE = os.path.join(CONF_ROOT, 'metrics.prom')
+#
+# Maximum time in seconds rendered feeds are cached
+# NEWSPEAK_FEED_CACHE_TIMEOUT = 10 * 60
+#
+# New entries with (nearly) the same title and summary as an entry in another
+# feed are stored as duplicates, which are not shown in aggregated feeds.
+# Maximum number of bits in which their fingerprints differ, 0 disables this.
+# NEWSPEAK_DUPLICATE_DISTANCE = 3
+#
+# Days to keep entries after publication, unless set per feed. Entries are
+# deleted by `newspeak prune_entries`.
+# NEWSPEAK_RETENTION_DAYS = 365
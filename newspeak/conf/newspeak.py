@@ -14,3 +14,72 @@ NEWSPEAK_METADATA = {
 }
 
 NEWSPEAK_CASE_SENSITIVE = False
+
+# Maximum number of compiled keyword regular expressions to cache
+NEWSPEAK_REGEX_CACHE_SIZE = 1024
+
+# Queue new feeds for crawling by `update_feeds --queued` rather than
+# crawling them while saving
+NEWSPEAK_QUEUE_NEW_FEEDS = False
+
+# Bounds for the adaptive interval between crawls of a feed, in seconds
+NEWSPEAK_CRAWL_INTERVAL_MIN = 5 * 60
+NEWSPEAK_CRAWL_INTERVAL_MAX = 24 * 60 * 60
+
+# Factor by which to increase the interval for unchanged or failing feeds
+NEWSPEAK_CRAWL_BACKOFF = 1.5
+NEWSPEAK_ERROR_BACKOFF = 2
+
+# Number of due feeds claimed at once by a crawler and the time in seconds
+# after which claims expire, so concurrent crawlers do not duplicate work
+NEWSPEAK_CLAIM_BATCH_SIZE = 500
+NEWSPEAK_CLAIM_DURATION = 30 * 60
+
+# Maximum time in seconds the crawler daemon sleeps before checking for
+# queued or due feeds
+NEWSPEAK_DAEMON_INTERVAL = 60
+
+# Maximum number of pages fetched concurrently for XPath extraction per feed
+NEWSPEAK_PAGE_THREADS = 8
+
+# Maximum number of concurrent requests (and feeds being crawled) per host,
+# not limited when 0 or None
+NEWSPEAK_HOST_CONNECTIONS = 2
+
+# Minimum delay in seconds between the start of requests to the same host
+NEWSPEAK_HOST_DELAY = 0.25
+
+# Timeout in seconds for HTTP requests
+NEWSPEAK_HTTP_TIMEOUT = 30
+
+# Maximum number of idle keep-alive connections kept per host and the time
+# in seconds after which idle connections are closed
+NEWSPEAK_POOL_CONNECTIONS = 4
+NEWSPEAK_POOL_IDLE_TIMEOUT = 60
+
+# Directory for caching fetched pages, disabled when None, and the maximum
+# size of the cache in bytes
+NEWSPEAK_PAGE_CACHE_DIR = None
+NEWSPEAK_PAGE_CACHE_SIZE = 100 * 1024 * 1024
+
+# Time in seconds rendered feeds are cached. Rendered feeds are invalidated
+# when crawling changes entries, which requires a cache shared by crawler and
+# web server processes, like memcached.
+NEWSPEAK_FEED_CACHE_TIMEOUT = 10 * 60
+
+# File to write crawl metrics to after crawling, in JSON format for files
+# ending in `.json` and Prometheus text format otherwise, disabled when None
+NEWSPEAK_METRICS_FILE = None
+
+# Maximum number of bits in which the SimHash fingerprints of the title and
+# summary of entries in different feeds differ for them to be considered
+# duplicates, at most 3 and disabled when 0
+NEWSPEAK_DUPLICATE_DISTANCE = 3
+
+# Days to keep entries after publication, unless set per feed, forever when
+# None, and the number of entries deleted per transaction by `prune_entries`
+NEWSPEAK_RETENTION_DAYS = None
+NEWSPEAK_PRUNE_BATCH_SIZE = 500
+
+# User agent used for HTTP requests
+NEWSPEAK_USER_AGENT = 'Newspeak/0.1 +https://github.com/bitsoffreedom/newspeak'
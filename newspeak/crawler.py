@@ -1,23 +1,57 @@
 import logging
 logger = logging.getLogger(__name__)
 
+import hashlib
+import multiprocessing
+import os
+import Queue
+import socket
+import time
+import uuid
+
+from datetime import timedelta
 from urlparse import urljoin
 
+from cStringIO import StringIO
+
 import eventlet
+from eventlet.queue import LightQueue
 
-# Use Eventlet for parallel processing of HTTP requests
-feedparser = eventlet.import_patched('feedparser')
+# Feeds are fetched over pooled (green) connections, feedparser only parses
+import feedparser
 
 from lxml import html
 
 from django.conf import settings
+from django.db import close_connection, transaction
+from django.db.models import Min, Q
+from django.utils.datastructures import SortedDict
 from django.utils.timezone import now
 from django.utils.translation import ugettext_lazy as _
 from django.core.exceptions import ValidationError
 
-from .models import Feed, FeedEntry, FeedContent, FeedEnclosure
+from .models import (
+    CrawlRequest, EntryFingerprint, Feed, FeedEntry, FeedContent,
+    FeedEnclosure
+)
+from .fetching import connection_pool, get_host, host_limiter
+from .filters import FilterChain, FilterChainCache
+from .metrics import metrics
 from .utils import (
-    datetime_from_struct, get_or_create_object, keywords_to_regex, parse_url
+    SIMHASH_BANDS, chunked, datetime_from_struct, fetch_response,
+    get_hamming_distance, get_link_hash, get_simhash, get_simhash_bands,
+    invalidate_feeds, keywords_to_regex, parse_html, total_seconds
+)
+
+
+# Maximum number of values in a single `__in` lookup, SQLite allows no more
+# than 999 parameters per query.
+QUERY_BATCH_SIZE = 500
+
+# FeedEntry fields set from parsed entries, used to detect changes
+ENTRY_FIELDS = (
+    'title', 'link', 'link_hash', 'summary', 'author', 'published', 'updated',
+    'extracted', 'extraction_key', 'page_etag', 'page_modified'
 )
 
 
@@ -79,250 +113,921 @@ def filter_entry(feed, entry):
     Return the result of applying filters to a feed entry. True when entry
     is to be included, False if the entry is to be discarded.
     """
-    for feed_filter in feed.filters.filter(active=True):
-        logger.debug(u'Applying filter %s to entry %s',
-            feed_filter, entry.title
+    return FilterChain.for_feed(feed).filter(entry)
+
+
+def get_entry_key(entry):
+    """
+    Return the key used to match a parsed entry to a FeedEntry: the entry ID
+    when available, the link otherwise.
+    """
+    if 'id' in entry:
+        return ('id', entry.id)
+
+    if 'link' in entry:
+        return ('link', entry.link)
+
+    raise Exception('Could not identify entry by link or ID.')
+
+
+def get_db_entry_key(db_entry):
+    """ Return the key for a FeedEntry, matching `get_entry_key`. """
+
+    if db_entry.entry_id is not None:
+        return ('id', db_entry.entry_id)
+
+    return ('link', db_entry.link)
+
+
+def match_entries(feed, keys):
+    """
+    Return a dictionary mapping the specified entry keys to the existing
+    FeedEntry objects of the feed. All keys are resolved in a single query
+    (per batch of `QUERY_BATCH_SIZE` keys) rather than a query per entry.
+    """
+    matched = {}
+
+    for batch in chunked(keys, QUERY_BATCH_SIZE):
+        entry_ids = [value for (kind, value) in batch if kind == 'id']
+        links = [value for (kind, value) in batch if kind == 'link']
+
+        entry_qs = feed.entries.filter(
+            Q(entry_id__in=entry_ids) | Q(entry_id=None, link__in=links)
         )
 
-        pattern = keywords_to_regex(feed_filter.keywords)
+        for db_entry in entry_qs:
+            matched[get_db_entry_key(db_entry)] = db_entry
 
-        if feed_filter.filter_inclusive:
-            # Keep only matched entries
+    return matched
 
-            if feed_filter.filter_title and \
-                pattern.search(entry.title):
 
-                # Pass: process next filter
-                break
+def link_duplicates(db_entries):
+    """
+    Link new entries to the entry stored earliest for the same page, by the
+    hash of their canonical link, such that only the latter is shown. Only
+    entries of active feeds which are no duplicates themselves are linked to.
 
-            if feed_filter.filter_summary and \
-                pattern.search(entry.summary):
+    Returns the number of duplicates.
+    """
+    originals = {}
+    link_hashes = set(db_entry.link_hash for db_entry in db_entries)
 
-                # Pass: process next filter
-                break
+    for batch in chunked(link_hashes, QUERY_BATCH_SIZE):
+        entry_qs = FeedEntry.objects.filter(
+            link_hash__in=batch, duplicate_of=None, feed__active=True
+        )
+
+        # Descending, such that the earliest entry is kept
+        for link_hash, pk in entry_qs.order_by('-pk').values_list(
+                'link_hash', 'pk'):
+            originals[link_hash] = pk
+
+    duplicates = 0
+
+    for db_entry in db_entries:
+        original = originals.get(db_entry.link_hash)
+
+        if original:
+            logger.debug(u'Entry %s duplicates entry %d', db_entry, original)
+
+            db_entry.duplicate_of_id = original
+            duplicates += 1
+
+    return duplicates
+
+
+def get_batch_duplicates(keyed_db_entries):
+    """
+    Return a dictionary of the keys of new entries for the same page as an
+    earlier entry in the batch, not linked to a stored entry already, to the
+    key of the earlier entry. Takes a list of (key, entry) tuples.
+    """
+    first_keys = {}
+    batch_duplicates = {}
+
+    for key, db_entry in keyed_db_entries:
+        if db_entry.duplicate_of_id:
+            continue
+
+        first_key = first_keys.setdefault(db_entry.link_hash, key)
+
+        if first_key != key:
+            logger.debug(u'Entry %s duplicates an entry in the same batch',
+                db_entry
+            )
+
+            batch_duplicates[key] = first_key
+
+    return batch_duplicates
+
+
+def get_entry_simhash(db_entry):
+    """ Return the SimHash of an entry's title and summary, if any. """
+    return get_simhash(u'%s %s' % (db_entry.title, db_entry.summary))
+
+
+def link_near_duplicates(feed, fingerprints):
+    """
+    Link new entries to the earliest entry in another active feed with a
+    SimHash differing in at most `NEWSPEAK_DUPLICATE_DISTANCE` bits. Takes
+    a list of (db_entry, simhash) tuples, candidates are found through the
+    indexed bands of their fingerprints.
+
+    Returns the number of duplicates.
+    """
+    distance = settings.NEWSPEAK_DUPLICATE_DISTANCE
+    duplicates = 0
+
+    # Every fingerprint adds a parameter per band
+    for batch in chunked(fingerprints, QUERY_BATCH_SIZE / SIMHASH_BANDS):
+        bands = [get_simhash_bands(simhash) for (db_entry, simhash) in batch]
+
+        query = Q()
+        for band in range(SIMHASH_BANDS):
+            query |= Q(**{
+                'band_%d__in' % band: set(values[band] for values in bands)
+            })
+
+        fingerprint_qs = EntryFingerprint.objects.filter(query,
+            entry__duplicate_of=None, entry__feed__active=True
+        ).exclude(entry__feed=feed)
+
+        candidates = [
+            (entry_pk, int(simhash, 16)) for (entry_pk, simhash) in
+            fingerprint_qs.order_by('entry').values_list('entry', 'simhash')
+        ]
+
+        for db_entry, simhash in batch:
+            for entry_pk, candidate_simhash in candidates:
+                if get_hamming_distance(simhash, candidate_simhash) <= \
+                        distance:
+
+                    logger.debug(u'Entry %s nearly duplicates entry %d',
+                        db_entry, entry_pk
+                    )
+
+                    db_entry.duplicate_of_id = entry_pk
+                    duplicates += 1
+
+                    break
+
+    return duplicates
+
+
+def save_fingerprints(fingerprints):
+    """ Store fingerprints, given a list of (db_entry, simhash) tuples. """
+    new_fingerprints = []
+
+    for db_entry, simhash in fingerprints:
+        fingerprint = EntryFingerprint(
+            entry=db_entry, simhash='%016x' % simhash
+        )
+
+        for band, value in enumerate(get_simhash_bands(simhash)):
+            setattr(fingerprint, 'band_%d' % band, value)
+
+        new_fingerprints.append(fingerprint)
 
-            # No match: discard entry
-            return False
+    EntryFingerprint.objects.bulk_create(new_fingerprints)
+
+
+def get_entry_values(db_entry):
+    """ Return the values of the fields copied from a feed entry. """
+    return [getattr(db_entry, field) for field in ENTRY_FIELDS]
+
+
+def get_changed_values(old_values, db_entry):
+    """
+    Return a dictionary of the fields copied from a feed entry which changed
+    since `old_values` were taken, with their new values.
+    """
+    return dict(
+        (field, value) for (field, old_value, value)
+        in zip(ENTRY_FIELDS, old_values, get_entry_values(db_entry))
+        if value != old_value
+    )
+
+
+def get_extraction_key(feed, link):
+    """
+    Return a hash of the link and the feed's XPath settings, used to
+    determine whether earlier extraction results for an entry still apply.
+    """
+    values = (
+        link,
+        feed.summary_xpath, feed.summary_override,
+        feed.content_xpath, feed.content_mime_type, feed.content_language,
+        feed.enclosure_xpath, feed.enclosure_mime_type,
+    )
+
+    return hashlib.sha1(
+        repr(tuple(unicode(value) for value in values))
+    ).hexdigest()
+
+
+class Extraction(object):
+    """
+    XPath extraction from the page an entry links to, split in stages so the
+    pages for all entries of a feed can be fetched concurrently: `fetch()`
+    retrieves the page, `extract()` parses it and applies the results.
+
+    Pages are only fetched for new or changed entries, or when the link or
+    XPath settings have changed since the last extraction. Pages are requested
+    conditionally, using the validators returned the previous time. When
+    neither entry nor page has changed, earlier results are kept.
+    """
+
+    def __init__(self, feed, entry, db_entry, unchanged, previous_summary):
+        self.feed = feed
+        self.entry = entry
+        self.db_entry = db_entry
+        self.previous_summary = previous_summary
+
+        self.extraction_key = get_extraction_key(feed, entry.link)
+
+        self.extract_summary = feed.summary_xpath and \
+            (not db_entry.summary or feed.summary_override)
+
+        self.extracted_before = db_entry.extracted and \
+            db_entry.extraction_key == self.extraction_key
+
+        # Whether the page is to be fetched at all
+        self.required = not (self.extracted_before and unchanged)
+
+        self.headers = {}
+
+        if self.extracted_before:
+            if db_entry.page_etag:
+                self.headers['If-None-Match'] = db_entry.page_etag
+            if db_entry.page_modified:
+                self.headers['If-Modified-Since'] = db_entry.page_modified
+
+    def keep(self):
+        """ Keep the results of the previous extraction. """
+        if self.extract_summary:
+            self.db_entry.summary = self.previous_summary
+
+        return None, None
+
+    def fetch(self):
+        """ Fetch the page, returning the response or None on errors. """
+        return fetch_response(self.entry.link, self.headers)
+
+    def extract(self, response):
+        """
+        Perform extraction on a fetched page, returning a tuple with the
+        extracted content and enclosure href, if any.
+        """
+        feed = self.feed
+        entry = self.entry
+        db_entry = self.db_entry
+
+        if response is None:
+            if self.extracted_before:
+                # Try again later, without discarding what we have
+                return self.keep()
+
+            parsed = None
+
+        elif response.status == 304:
+            logger.debug(u'Page %s not modified since extraction.', entry.link)
+
+            return self.keep()
 
         else:
-            # Exclusive filtering - discard matching entries
-            if feed_filter.filter_title and \
-                pattern.search(entry.title):
+            parsed = parse_html(response.body, entry.link) \
+                if response.body else None
 
-                # Match: discard this entry
-                return False
+            # Record extraction, so unchanged pages are not fetched again
+            db_entry.extracted = now()
+            db_entry.extraction_key = self.extraction_key
+            db_entry.page_etag = response.headers.get('etag', '')[:255]
+            db_entry.page_modified = \
+                response.headers.get('last-modified', '')[:255]
 
-            if feed_filter.filter_summary and \
-                pattern.search(entry.summary):
+        extracted_content = None
+        extracted_href = None
 
-                # Match: discard this entry
-                return False
+        # Extraction of summary
+        if self.extract_summary:
+            extracted_summary = extract_xpath(parsed, feed.summary_xpath)
 
-    # By default, include all entries
-    return True
+            if extracted_summary:
+                # Some value was found, add it to the entry
+                db_entry.summary = extracted_summary
 
+                logger.debug(u'Extracted summary for %s from %s',
+                    db_entry, entry.link
+                )
 
-def update_entry(feed, entry):
-    """ Update a specified entry for the feed. """
+        # Extraction of content and enclosures, stored after saving the entry
+        if feed.content_xpath:
+            extracted_content = extract_xpath(parsed, feed.content_xpath)
 
-    # Consider whether or not to discard the item
-    if not filter_entry(feed, entry):
-        # Entry to be discarded - stop further processing
-        logger.debug(u'Discarding entry %s', entry.title)
+        if feed.enclosure_xpath:
+            extracted_href = extract_xpath(parsed, feed.enclosure_xpath)
 
-        # Possible problem: we might want to delete existing entries now
-        # that they are filtered. Then again: we might not.
-        return
+        return extracted_content, extracted_href
 
-    if 'id' in entry:
-        logger.debug(u'Attempt matching by entry ID %s', entry.id)
 
-        db_entry = get_or_create_object(
-            FeedEntry, feed=feed, entry_id=entry.id)
+def perform_extractions(extractions):
+    """
+    Fetch the pages for a dictionary of extractions concurrently, at most
+    `NEWSPEAK_PAGE_THREADS` at a time, parsing and extracting pages as they
+    come in.
+
+    Returns a dictionary with the extracted content and enclosure href for
+    each key.
+    """
+    pool = eventlet.GreenPool(settings.NEWSPEAK_PAGE_THREADS)
+
+    def fetch(key):
+        with metrics.timer('page_fetch'):
+            return key, extractions[key].fetch()
+
+    pending = extractions.keys()
+    running = 0
+
+    # Fetches in the order they finish
+    finished = LightQueue()
+
+    extracted = {}
+
+    while pending or running:
+        while pending and pool.free():
+            pool.spawn(fetch, pending.pop(0)).link(finished.put)
+            running += 1
 
-    elif 'link' in entry:
-        logger.debug(u'Attempt matching by entry link %s', entry.link)
+        # Raises any exception from fetching
+        key, response = finished.get().wait()
+        running -= 1
 
-        db_entry = get_or_create_object(
-            FeedEntry, feed=feed, entry_id=None, link=entry.link)
+        with metrics.timer('extraction'):
+            extracted[key] = extractions[key].extract(response)
 
+    return extracted
+
+
+def copy_entry(feed, entry, db_entry):
+    """
+    Copy entry information from the parsed entry onto the FeedEntry.
+
+    Returns the `Extraction` to perform for the entry, or None when no page
+    is to be fetched.
+    """
+
+    published = datetime_from_struct(entry.published_parsed)
+
+    # Only set updated when available - do not assume it to be there
+    if 'updated_parsed' in entry:
+        updated = datetime_from_struct(entry.updated_parsed)
     else:
-        raise Exception('Could not identify entry by link or ID.')
+        updated = db_entry.updated
+
+    # Whether the entry, as published in the feed, is the same as before
+    unchanged = bool(db_entry.pk) and (
+        db_entry.title, db_entry.link, db_entry.published, db_entry.updated
+    ) == (entry.title, entry.link, published, updated)
+
+    previous_summary = db_entry.summary
 
-    # Copy entry information
     db_entry.title = entry.title
     db_entry.link = entry.link
+    db_entry.link_hash = get_link_hash(entry.link)
     db_entry.summary = entry.summary
 
-    db_entry.author = getattr(db_entry, 'author', None)
+    # The author field is not nullable, use an empty string when missing
+    db_entry.author = getattr(entry, 'author', u'')
 
-    db_entry.published = datetime_from_struct(entry.published_parsed)
-
-    # Only set updated when available - do not assume it to be there
-    if 'updated_parsed' in entry:
-        db_entry.updated = datetime_from_struct(entry.updated_parsed)
+    db_entry.published = published
+    db_entry.updated = updated
 
     # Determine whether to perform extraction and if so: only perform it once
     if feed.summary_xpath or feed.enclosure_xpath or feed.content_xpath:
-        parsed = parse_url(entry.link)
+        extraction = Extraction(
+            feed, entry, db_entry, unchanged, previous_summary
+        )
 
-    # Extraction of summary
-    if feed.summary_xpath and (not db_entry.summary or feed.summary_override):
-        extracted_summary = extract_xpath(parsed, feed.summary_xpath)
+        if extraction.required:
+            return extraction
+
+        logger.debug(u'Entry %s unchanged since extraction, not fetching %s',
+            db_entry, entry.link
+        )
+
+        extraction.keep()
+
+    return None
 
-        if extracted_summary:
-            # Some value was found, add it to the entry
-            db_entry.summary = extracted_summary
 
-            logger.debug(u'Extracted summary for %s from %s',
-                db_entry, entry.link
+def update_related(feed, related):
+    """
+    Update content and enclosures for saved entries in batch.
+
+    Takes a list of (entry, db_entry, extracted_content, extracted_href)
+    tuples. Existing enclosure hrefs and content are loaded for all entries
+    at once, missing ones are created with `bulk_create` and changed content
+    is updated within a single transaction.
+
+    Returns the number of contents and enclosures created or changed.
+    """
+
+    entry_pks = [db_entry.pk for (entry, db_entry, c, h) in related]
+
+    # Preload existing enclosure hrefs and content, keyed by entry
+    enclosure_keys = set()
+    contents = {}
+
+    for batch in chunked(entry_pks, QUERY_BATCH_SIZE):
+        enclosure_keys.update(FeedEnclosure.objects.filter(
+            entry__in=batch).values_list('entry', 'href')
+        )
+
+        for db_content in FeedContent.objects.filter(entry__in=batch):
+            content_key = (
+                db_content.entry_id, db_content.mime_type, db_content.language
             )
+            contents[content_key] = db_content
 
-    # Save it to the database
-    # (Required before being able to link stuff like content/enclosures)
-    db_entry.save()
-
-    # Feed existing content
-    if 'content' in entry:
-        for entry_content in entry.content:
-            # Only add if content with the same mime type and
-            # language does not already exist. If it does, update if it differs.
-            db_content = get_or_create_object(FeedContent,
-                entry=db_entry,
-                mime_type=entry_content.type or '',
-                language=entry_content.language or ''
+    new_enclosures = []
+    new_contents = []
+    changed_contents = []
+
+    def add_enclosure(db_enclosure, validate=False):
+        """ Add an enclosure unless one with the same href already exists. """
+        enclosure_key = (db_enclosure.entry_id, db_enclosure.href)
+
+        if enclosure_key in enclosure_keys:
+            logger.debug(
+                u'Enclosure with href \'%s\' already exists, not saving.',
+                db_enclosure.href
             )
 
-            # Update existing content, if differs
-            if db_content.value != entry_content.value:
-                db_content.value = entry_content.value
-                db_content.save()
-
-        logger.debug(u'%d contents added to entry %s',
-            len(entry.content), db_entry)
-
-    # Copy existing feed enclosures
-    if 'enclosures' in entry:
-        for entry_enclosure in entry.enclosures:
-            # Only add if an enclosure with the same URL does not
-            # already exist
-            if FeedEnclosure.objects.filter(
-                entry=db_entry, href=entry_enclosure.href).exists():
-                logger.debug(
-                    u'Enclosure with href \'%s\' already exists, not saving.',
-                    entry_enclosure.href
+            return
+
+        if validate:
+            # Validate the results - the URL might be invalid
+            try:
+                db_enclosure.full_clean(exclude=['entry'])
+
+            except ValidationError:
+                # Log the exception, don't save
+                logger.exception(u'Error validating enclosure data.')
+
+                return
+
+        enclosure_keys.add(enclosure_key)
+        new_enclosures.append(db_enclosure)
+
+    def set_content(db_entry, mime_type, language, value, validate=False):
+        """
+        Only add if content with the same mime type and language does not
+        already exist. If it does, update if it differs.
+        """
+        content_key = (db_entry.pk, mime_type, language)
+
+        db_content = contents.get(content_key)
+
+        if db_content is None:
+            db_content = FeedContent(
+                entry=db_entry, mime_type=mime_type, language=language
+            )
+
+        elif db_content.value == value:
+            return
+
+        old_value = db_content.value
+        db_content.value = value
+
+        if validate:
+            try:
+                db_content.full_clean(exclude=['entry'])
+
+            except ValidationError:
+                # Log the exception, don't save
+                logger.exception(u'Error validating content data.')
+
+                db_content.value = old_value
+
+                return
+
+        if db_content.pk:
+            if db_content not in changed_contents:
+                changed_contents.append(db_content)
+
+        elif content_key not in contents:
+            new_contents.append(db_content)
+
+        contents[content_key] = db_content
+
+    for entry, db_entry, extracted_content, extracted_href in related:
+        # Feed existing content
+        if 'content' in entry:
+            for entry_content in entry.content:
+                set_content(db_entry,
+                    entry_content.type or '',
+                    entry_content.language or '',
+                    entry_content.value
                 )
 
-            else:
+        # Copy existing feed enclosures
+        if 'enclosures' in entry:
+            for entry_enclosure in entry.enclosures:
                 # Even though standards require length and mimetype to be set,
                 # we are going to assume only href is set - the absolute minimum.
-                db_enclosure = FeedEnclosure(
+                add_enclosure(FeedEnclosure(
                     entry=db_entry,
                     href=entry_enclosure.href,
                     length=entry_enclosure.length or 0,
                     mime_type=entry_enclosure.type or ''
+                ))
+
+        # Extraction of content
+        if extracted_content:
+            set_content(db_entry,
+                feed.content_mime_type,
+                feed.content_language,
+                extracted_content,
+                validate=True
+            )
+
+        # Extraction of enclosures
+        if extracted_href:
+            # Make the resulting URL absolute
+            extracted_href = urljoin(entry.link, extracted_href)
+
+            add_enclosure(FeedEnclosure(
+                entry=db_entry,
+                href=extracted_href,
+                length=0,
+                mime_type=feed.enclosure_mime_type
+            ), validate=True)
+
+    with metrics.timer('db_write'):
+        with transaction.commit_on_success():
+            FeedContent.objects.bulk_create(new_contents)
+            FeedEnclosure.objects.bulk_create(new_enclosures)
+
+            # A single UPDATE per content, without checking for existence
+            for db_content in changed_contents:
+                FeedContent.objects.filter(pk=db_content.pk).update(
+                    value=db_content.value
                 )
-                db_enclosure.save()
 
-        logger.debug(u'%d enclosures added to entry %s',
-            len(entry.enclosures), db_entry)
+    logger.debug(
+        u'Created %d and updated %d contents, created %d enclosures for %s',
+        len(new_contents), len(changed_contents), len(new_enclosures), feed
+    )
 
-    # Extraction of content
-    if feed.content_xpath:
-        extracted_content = extract_xpath(parsed, feed.content_xpath)
+    return len(new_contents) + len(changed_contents) + len(new_enclosures)
 
-        if extracted_content:
 
-            # Only add if content with the same mime type and
-            # language does not already exist. If it does, update if it differs.
-            db_content = get_or_create_object(FeedContent,
-                entry=db_entry,
-                mime_type=feed.content_mime_type,
-                language=feed.content_language
-            )
+def update_entries(feed, entries, filter_chain=None):
+    """
+    Update the specified entries for the feed.
 
-            # Update existing content, if differs
-            if db_content.value != extracted_content:
-                db_content.value = extracted_content
+    Entries are processed in stages: entry data is copied first, then the
+    pages required for XPath extraction are fetched concurrently and parsed
+    as they arrive, after which all results are stored.
 
-                try:
-                    db_content.full_clean()
+    Existing entries are matched in a single query, new entries are written
+    with `bulk_create` and only the changed fields of existing entries are
+    updated, all within a single transaction.
 
-                except ValidationError:
-                    # Log the exception, don't save
-                    logger.exception(u'Error validating enclosure data.')
+    When no precompiled filter chain is given, one is built for the feed.
 
-                else:
-                    # All went fine, saving
-                    db_content.save()
+    Returns the number of newly created entries.
+    """
 
-                    logger.debug(u'Saved extracted content %s for %s from %s',
-                        db_content, db_entry, entry.link
-                    )
+    if filter_chain is None:
+        filter_chain = FilterChain.for_feed(feed)
 
-    # Extraction of enclosures
-    if feed.enclosure_xpath:
-        extracted_href = extract_xpath(parsed, feed.enclosure_xpath)
+    # Key the entries to be included, later duplicates override earlier ones
+    keyed_entries = SortedDict()
 
-        if extracted_href:
+    with metrics.timer('filter'):
+        for entry in entries:
+            # Consider whether or not to discard the item
+            if not filter_chain.filter(entry):
+                # Entry to be discarded - stop further processing
+                logger.debug(u'Discarding entry %s', entry.title)
+                metrics.increment('entries_filtered')
 
-            # Make the resulting URL absolute
-            extracted_href = urljoin(entry.link, extracted_href)
+                # Possible problem: we might want to delete existing entries
+                # now that they are filtered. Then again: we might not.
+                continue
 
-            # Only add if an enclosure with the same URL does not
-            # already exist
-            if FeedEnclosure.objects.filter(
-                entry=db_entry, href=extracted_href).exists():
+            keyed_entries[get_entry_key(entry)] = entry
 
-                logger.debug(
-                    u'Extracted enclosure with href \'%s\' already exists, not saving.',
-                    extracted_href
-                )
+    if not keyed_entries:
+        return 0
+
+    existing = match_entries(feed, keyed_entries.keys())
+
+    old_values = {}
+    extractions = {}
 
+    # Copy entry data, determining which pages to fetch
+    for key, entry in keyed_entries.items():
+        db_entry = existing.get(key)
+
+        if db_entry:
+            logger.debug(u'Updating existing entry %s', db_entry)
+
+            old_values[key] = get_entry_values(db_entry)
+
+        else:
+            kind, value = key
+
+            if kind == 'id':
+                db_entry = FeedEntry(feed=feed, entry_id=value)
             else:
-                db_enclosure = FeedEnclosure(
-                    entry=db_entry,
-                    href=extracted_href,
-                    length=0,
-                    mime_type=feed.enclosure_mime_type
+                db_entry = FeedEntry(feed=feed, entry_id=None, link=value)
+
+            logger.debug(u'Creating new entry %s', entry.title)
+
+        extraction = copy_entry(feed, entry, db_entry)
+
+        if extraction:
+            extractions[key] = extraction
+
+        existing[key] = db_entry
+
+    # Link new entries for pages already stored, or with (nearly) the same
+    # title and summary as entries in other feeds
+    new_keys = [key for key in keyed_entries.keys() if key not in old_values]
+    simhashes = {}
+    batch_duplicates = {}
+
+    if new_keys:
+        duplicates = link_duplicates([existing[key] for key in new_keys])
+
+        # Entries for the same page within the batch are linked to the first
+        # of them once it has been stored
+        batch_duplicates = get_batch_duplicates(
+            [(key, existing[key]) for key in new_keys]
+        )
+        duplicates += len(batch_duplicates)
+
+        if settings.NEWSPEAK_DUPLICATE_DISTANCE:
+            for key in new_keys:
+                if not existing[key].duplicate_of_id and \
+                        key not in batch_duplicates:
+                    simhash = get_entry_simhash(existing[key])
+
+                    if simhash is not None:
+                        simhashes[key] = simhash
+
+            duplicates += link_near_duplicates(feed, [
+                (existing[key], simhash)
+                for (key, simhash) in simhashes.items()
+            ])
+
+        metrics.increment('entries_duplicate', duplicates)
+
+        # Duplicates are not shown, so do not fetch their pages
+        for key in new_keys:
+            if existing[key].duplicate_of_id or key in batch_duplicates:
+                extractions.pop(key, None)
+
+    # Fetch pages concurrently and extract from them
+    extracted = perform_extractions(extractions)
+
+    new_entries = [existing[key] for key in new_keys]
+    changed_entries = []
+
+    for key in keyed_entries.keys():
+        if key in old_values:
+            changed_values = get_changed_values(old_values[key], existing[key])
+
+            if changed_values:
+                changed_entries.append((existing[key], changed_values))
+
+    # Save to the database
+    # (Required before being able to link stuff like content/enclosures)
+    with metrics.timer('db_write'):
+        with transaction.commit_on_success():
+            FeedEntry.objects.bulk_create([
+                existing[key] for key in new_keys
+                if key not in batch_duplicates
+            ])
+
+            if batch_duplicates:
+                # Link to the entries just stored, then store the duplicates
+                originals = match_entries(feed, set(batch_duplicates.values()))
+
+                for key, original_key in batch_duplicates.items():
+                    if original_key in originals:
+                        existing[key].duplicate_of_id = \
+                            originals[original_key].pk
+
+                FeedEntry.objects.bulk_create(
+                    [existing[key] for key in batch_duplicates]
                 )
 
-                # Validate the results - the URL might be invalid
-                try:
-                    db_enclosure.full_clean()
+            # Only write the changed fields, in a single UPDATE per entry
+            for db_entry, changed_values in changed_entries:
+                FeedEntry.objects.filter(pk=db_entry.pk).update(
+                    **changed_values
+                )
 
-                except ValidationError:
-                    # Log the exception, don't save
-                    logger.exception(u'Error validating enclosure data.')
+    logger.debug(u'Created %d and updated %d entries for %s',
+        len(new_entries), len(changed_entries), feed
+    )
 
-                else:
-                    # All went fine, saving
-                    db_enclosure.save()
+    metrics.increment('entries_created', len(new_entries))
+    metrics.increment('entries_updated', len(changed_entries))
 
-                    logger.debug(u'Saved extracted enclosure %s for %s from %s',
-                        db_enclosure, db_entry, entry.link
-                    )
+    # bulk_create() does not set primary keys, fetch the new entries again
+    if new_entries:
+        existing.update(match_entries(
+            feed, [get_db_entry_key(db_entry) for db_entry in new_entries]
+        ))
+
+    # Fingerprint new entries, to find their duplicates in other feeds later
+    save_fingerprints([
+        (existing[key], simhash) for (key, simhash) in simhashes.items()
+        if existing[key].pk and not existing[key].duplicate_of_id
+    ])
+
+    related = []
+    for key, entry in keyed_entries.items():
+        db_entry = existing[key]
+
+        if not db_entry.pk:
+            # The key of the saved entry differs, i.e. due to truncation
+            logger.warning(u'Could not find saved entry %s', db_entry)
+
+            continue
+
+        extracted_content, extracted_href = extracted.get(key, (None, None))
+        related.append(
+            (entry, db_entry, extracted_content, extracted_href)
+        )
+
+    related_changes = update_related(feed, related)
+
+    # Register the changes once for all entries
+    if new_entries or changed_entries or related_changes:
+        invalidate_feeds()
+
+    return len(new_entries)
+
+
+def update_entry(feed, entry):
+    """ Update a specified entry for the feed. """
+    update_entries(feed, [entry])
+
+
+def schedule_feed(feed, new_entries=0, error=False, previous_updated=None):
+    """
+    Schedule the next crawl of a feed, adapting the interval between crawls
+    to the observed frequency of changes.
+
+    When the feed changed, the interval moves towards the observed interval
+    between changes; the time between updated timestamps of the feed or,
+    lacking these, the time since the last crawl per new entry. Unchanged
+    and failing feeds back off exponentially.
+    """
+
+    current = now()
+    interval = feed.crawl_interval or settings.NEWSPEAK_CRAWL_INTERVAL_MIN
+
+    if error:
+        interval *= settings.NEWSPEAK_ERROR_BACKOFF
+
+    elif not feed.crawl_interval:
+        # First crawl, start at the minimal interval
+        pass
+
+    elif new_entries:
+        if previous_updated and feed.updated and \
+            feed.updated > previous_updated:
+
+            observed = total_seconds(feed.updated - previous_updated)
+
+        elif feed.last_crawl:
+            observed = total_seconds(current - feed.last_crawl)
+
+        else:
+            observed = interval
+
+        observed /= new_entries
+
+        # Average with the current interval to smooth out bursts
+        interval = (interval + observed) / 2
+
+    else:
+        interval *= settings.NEWSPEAK_CRAWL_BACKOFF
 
+    interval = int(min(
+        max(interval, settings.NEWSPEAK_CRAWL_INTERVAL_MIN),
+        settings.NEWSPEAK_CRAWL_INTERVAL_MAX
+    ))
 
-def update_feed(feed):
-    """ Update a single feed. """
+    feed.last_crawl = current
+    feed.next_crawl = current + timedelta(seconds=interval)
+    feed.crawl_interval = interval
+
+    logger.debug(u'Scheduled next crawl of feed %s at %s, interval %d s',
+        feed, feed.next_crawl, interval
+    )
+
+    # Release the claim on the feed, unless taken over by another crawler
+    claimed_by = feed.claimed_by
+
+    feed.claimed_by = ''
+    feed.claimed_until = None
+
+    # Only update scheduling fields
+    Feed.objects.filter(pk=feed.pk, claimed_by=claimed_by).update(
+        last_crawl=feed.last_crawl,
+        next_crawl=feed.next_crawl,
+        crawl_interval=feed.crawl_interval,
+        claimed_by=feed.claimed_by,
+        claimed_until=feed.claimed_until
+    )
+
+
+def save_feed(feed):
+    """
+    Save a crawled feed, leaving out the claim on it which may have been
+    taken over by another crawler meanwhile.
+    """
+
+    feed.save(update_fields=[
+        field.name for field in Feed._meta.fields
+        if not field.primary_key and
+            field.name not in ('claimed_by', 'claimed_until')
+    ])
+
+
+def fetch_feed(feed):
+    """
+    Fetch a feed over a pooled connection and parse it.
+
+    The feed's etag and modified values trigger a conditional GET. Returns
+    a tuple of the `Response` and the parsed feed, which is None when the
+    feed has not been modified.
+    """
+
+    headers = {'Accept': feedparser.ACCEPT_HEADER}
+
+    if feed.etag:
+        headers['If-None-Match'] = feed.etag
+
+    if feed.modified:
+        headers['If-Modified-Since'] = feed.modified
+
+    with metrics.timer('feed_fetch'):
+        with host_limiter.limit(feed.url):
+            response = connection_pool.request(feed.url, headers)
+
+    if response.status == 304:
+        metrics.increment('feeds_not_modified')
+
+        return response, None
+
+    # Resolve relative links against the final URL
+    response_headers = dict(response.headers)
+    response_headers.setdefault('content-location', response.url)
+
+    # Pass a stream, feedparser would try to open strings as URL or file
+    with metrics.timer('feed_parse'):
+        parsed = feedparser.parse(
+            StringIO(response.body), response_headers=response_headers
+        )
+
+    return response, parsed
+
+
+def update_feed(feed, filter_chains=None):
+    """
+    Update a single feed, optionally using the filter chains cached for
+    the current crawl.
+    """
 
     logger.info(u'Updating feed %s', feed)
 
+    # Keep track of changes for scheduling the next crawl
+    previous_updated = feed.updated
+    new_entries = 0
+    error = False
+
+    start = time.time()
+
     try:
         # Fetch and parse the feed
-        # etag and modified parameters will trigger a conditional GET
-        parsed = feedparser.parse(feed.url,\
-            etag=feed.etag, modified=feed.modified)
+        response, parsed = fetch_feed(feed)
 
         # Data not changed
-        if parsed.status == 304:
+        if response.status == 304:
             logger.debug(u'Feed %s not changed, aborting', feed)
 
             return feed
 
         # Feed gone, disable crawling
-        if parsed.status == 410:
+        if response.status == 410:
             logger.error(u'Feed %s gone, disabling', feed)
 
             feed.error_state = True
@@ -330,17 +1035,17 @@ def update_feed(feed):
                 'Feed returns 410: Gone. Crawling deactivated.'
             )
             feed.active = False
-            feed.save()
+            save_feed(feed)
 
             return feed
 
         # Permanent redirect, update URL
-        if parsed.status == 301:
+        if response.permanent_redirect:
             logger.warning(
                 u'Feed %s has permanent redirect, updating URL to %s',
-                feed, parsed.href)
+                feed, response.url)
 
-            feed.url = parsed.href
+            feed.url = response.url
 
         # Check for well-formedness
         if parsed.bozo:
@@ -366,7 +1071,8 @@ def update_feed(feed):
         if update:
             logger.debug(u'Updating feed %s', feed)
 
-            # Update all entries
+            # Collect the entries to update
+            entries = []
             for entry in parsed.entries:
                 # Only update posts which are changed after the latest feed
                 # update - this saves a lot of effort in the filtering
@@ -382,10 +1088,18 @@ def update_feed(feed):
 
                 if entry_update:
                     logger.debug(u'Updating %s', entry.title)
-                    update_entry(feed, entry)
+                    entries.append(entry)
                 else:
                     logger.debug(u'Not updating %s', entry.title)
 
+            # Update all entries in batch
+            if filter_chains is not None:
+                filter_chain = filter_chains.get(feed)
+            else:
+                filter_chain = None
+
+            new_entries = update_entries(feed, entries, filter_chain)
+
             # Make sure the feed ID is synchronized
             # feed.feed_id = parsed.id
 
@@ -420,10 +1134,10 @@ def update_feed(feed):
             feed.error_state = False
 
             # Store last modified and etag
-            feed.etag = getattr(parsed, 'etag', '')
-            feed.modified = getattr(parsed, 'modified', '')
+            feed.etag = response.headers.get('etag', '')
+            feed.modified = response.headers.get('last-modified', '')
 
-            feed.save()
+            save_feed(feed)
 
         else:
             logger.debug(u'Not updating feed %s', feed)
@@ -433,39 +1147,568 @@ def update_feed(feed):
         feed.error_state = True
         feed.error_description = unicode(e)
         feed.error_date = now()
-        feed.save()
+        save_feed(feed)
 
         logger.exception(u'Exception while updating feed %s', feed)
+        metrics.increment('feed_errors')
+
+        error = True
 
     finally:
+        schedule_feed(feed, new_entries, error, previous_updated)
+
+        duration = time.time() - start
+
+        metrics.increment('feeds_crawled')
+        metrics.add_time('feed', duration)
+
+        logger.info(u'Crawled feed %s in %.2f s: %s, %d new entries',
+            feed, duration, 'error' if error else 'ok', new_entries
+        )
+
         return feed
 
 
-def update_feeds():
-    """ Update all feeds. """
+def get_claim_batches(feeds):
+    """
+    Return a list of tuples of a crawler id and a batch of primary keys of
+    the feeds it claimed. Unclaimed feeds are left out.
+    """
+    claims = SortedDict()
 
-    logger.info(u'Updating all feeds')
+    for feed in feeds:
+        if feed.claimed_by:
+            claims.setdefault(feed.claimed_by, []).append(feed.pk)
+
+    return [
+        (crawler, batch) for crawler, pks in claims.items()
+        for batch in chunked(pks, QUERY_BATCH_SIZE)
+    ]
+
+
+def renew_claims(feeds):
+    """
+    Extend the claims on feeds which have not been crawled yet, such that
+    they do not expire while a large batch is in progress. Claims taken
+    over by another crawler are left alone.
+    """
+    claimed_until = now() + timedelta(
+        seconds=settings.NEWSPEAK_CLAIM_DURATION
+    )
+
+    renewed = 0
+    for crawler, batch in get_claim_batches(feeds):
+        renewed += Feed.objects.filter(
+            pk__in=batch, claimed_by=crawler
+        ).update(claimed_until=claimed_until)
+
+    logger.debug(u'Renewed claims on %d feeds', renewed)
+
+
+def release_claims(feeds):
+    """
+    Release the claims on feeds which have not been crawled. Claims taken
+    over by another crawler are left alone.
+    """
+    for crawler, batch in get_claim_batches(feeds):
+        Feed.objects.filter(pk__in=batch, claimed_by=crawler).update(
+            claimed_by='', claimed_until=None
+        )
+
+
+def crawl_feeds(feeds, feed_total, progress=None, stopping=None):
+    """
+    Update the specified feeds in parallel.
 
-    # List all active feeds, randomized ordering for greater concurrency
-    feed_qs = Feed.objects.filter(active=True).order_by('?')
+    Feeds are dispatched to the pool taking turns between hosts, with no
+    more than `NEWSPEAK_HOST_CONNECTIONS` feeds of a single host in progress
+    at any time, so a slow host cannot occupy all threads. Hosts are not
+    limited when the setting is 0 or None.
+
+    When specified, `progress` is called with every feed finished. Once
+    `stopping` returns True no more feeds are dispatched, feeds in progress
+    are finished and claims on the others are released.
+
+    Claims on feeds not yet crawled are renewed every half
+    `NEWSPEAK_CLAIM_DURATION`, so they do not expire before their turn.
+    """
 
     threads = settings.NEWSPEAK_THREADS
+    host_connections = settings.NEWSPEAK_HOST_CONNECTIONS
 
     # Create a pool for workers to swim in
     pool = eventlet.GreenPool(size=threads)
 
-    feed_total = feed_qs.count()
     feed_count = 0
     logger.debug(u'Crawling %d feeds with %d lightweight threads.', feed_total, threads)
 
-    for feed in pool.imap(update_feed, feed_qs):
+    # Compile filters once for all feeds
+    filter_chains = FilterChainCache()
+
+    # Feeds waiting to be crawled and the number in progress, per host
+    pending = SortedDict()
+    for feed in feeds:
+        pending.setdefault(get_host(feed.url), []).append(feed)
+
+    in_progress = dict((host, 0) for host in pending.keys())
+    running = 0
+
+    # Feeds not crawled yet, of which the claims are renewed periodically
+    unfinished = set(feeds)
+    renew_interval = settings.NEWSPEAK_CLAIM_DURATION / 2.0
+    renew_at = time.time() + renew_interval
+
+    finished = LightQueue()
+
+    def worker(host, feed):
+        try:
+            update_feed(feed, filter_chains=filter_chains)
+        finally:
+            finished.put((host, feed))
+
+    while pending or running:
+        if pending and stopping and stopping():
+            remaining = [feed for host in pending.values() for feed in host]
+
+            logger.info(u'Stopping, leaving %d feeds uncrawled.',
+                len(remaining)
+            )
+
+            release_claims(remaining)
+            unfinished.difference_update(remaining)
+            pending.clear()
+
+            continue
+
+        if time.time() >= renew_at:
+            renew_claims(unfinished)
+            renew_at = time.time() + renew_interval
+
+        # Dispatch feeds for hosts with capacity to spare, in turns
+        dispatched = True
+        while dispatched and pending and pool.free():
+            dispatched = False
+
+            for host in pending.keys():
+                if not pool.free():
+                    break
+
+                if host_connections and \
+                        in_progress[host] >= host_connections:
+                    continue
+
+                feed = pending[host].pop(0)
+                if not pending[host]:
+                    del pending[host]
+
+                in_progress[host] += 1
+                running += 1
+
+                pool.spawn_n(worker, host, feed)
+                dispatched = True
+
+        # Wait for a feed to finish, or until claims are to be renewed
+        try:
+            host, feed = finished.get(timeout=max(renew_at - time.time(), 0))
+        except Queue.Empty:
+            continue
+
+        in_progress[host] -= 1
+        running -= 1
+        unfinished.discard(feed)
+
         feed_count += 1
         logger.debug(u'Finished processing feed %s (%d/%d)',
         feed, feed_count, feed_total)
 
+        if progress:
+            progress(feed)
+
     logger.debug(u'Finished crawling succesfully. %d feeds updated',
         feed_total
     )
 
+    logger.debug(
+        u'Keyword regex cache: %(hits)d hits, %(misses)d misses, '
+        u'%(size)d/%(maxsize)d items', keywords_to_regex.cache.info()
+    )
+
     # Wait untill all threads are done
     pool.waitall()
+
+
+def spread_by_host(feeds):
+    """
+    Return feeds reordered such that consecutive feeds are hosted on
+    different hosts where possible, by taking feeds from each host in turn.
+    The order of feeds within each host is retained.
+    """
+    hosts = SortedDict()
+
+    for feed in feeds:
+        hosts.setdefault(get_host(feed.url), []).append(feed)
+
+    queues = [list(reversed(host_feeds)) for host_feeds in hosts.values()]
+
+    spread = []
+    while queues:
+        for queue in queues:
+            spread.append(queue.pop())
+
+        queues = [queue for queue in queues if queue]
+
+    return spread
+
+
+def shard_by_host(feeds, count):
+    """
+    Divide feeds into at most `count` shards of similar size. All feeds of a
+    host end up in the same shard, so per-host limits still apply.
+    """
+    hosts = SortedDict()
+
+    for feed in feeds:
+        hosts.setdefault(get_host(feed.url), []).append(feed)
+
+    shards = [[] for shard in range(count)]
+
+    # Hosts with most feeds first, each to the smallest shard
+    for host_feeds in sorted(hosts.values(), key=len, reverse=True):
+        min(shards, key=len).extend(host_feeds)
+
+    return [spread_by_host(shard) for shard in shards if shard]
+
+
+def crawl_shard(feeds, progress_queue, stopping=None):
+    """
+    Crawl a shard of feeds in a worker process, reporting finished feeds and
+    finally the metrics for the shard on the progress queue.
+    """
+
+    # Do not reuse connections opened before forking
+    connection_pool.clear()
+
+    # Only report metrics for this shard, the parent keeps the totals
+    metrics.reset()
+
+    def progress(feed):
+        progress_queue.put(('feed', unicode(feed)))
+
+    try:
+        crawl_feeds(feeds, len(feeds), progress=progress, stopping=stopping)
+    finally:
+        close_connection()
+
+        progress_queue.put(('metrics', metrics.snapshot()))
+
+
+def crawl_feeds_processes(feeds, processes, stopping=None):
+    """
+    Update the specified feeds using multiple worker processes, each with
+    its own pool of green threads, so parsing uses multiple CPU cores.
+
+    Feeds are sharded by host, progress of all workers is reported here.
+    Only this process checks `stopping`, workers are told to stop through
+    a shared event, as signals received here are not seen by them.
+    """
+
+    shards = shard_by_host(feeds, processes)
+    feed_total = len(feeds)
+
+    logger.debug(u'Crawling %d feeds in %d processes.',
+        feed_total, len(shards)
+    )
+
+    # Workers open their own database connections, never share ours
+    close_connection()
+    connection_pool.clear()
+
+    progress_queue = multiprocessing.Queue()
+    stop_event = multiprocessing.Event()
+
+    workers = [
+        multiprocessing.Process(
+            target=crawl_shard, args=(shard, progress_queue, stop_event.is_set)
+        ) for shard in shards
+    ]
+
+    for worker in workers:
+        worker.start()
+
+    feed_count = 0
+    finished_workers = 0
+
+    while finished_workers < len(workers):
+        if stopping and stopping() and not stop_event.is_set():
+            logger.info(u'Stopping %d crawler processes.', len(workers))
+            stop_event.set()
+
+        try:
+            message, value = progress_queue.get(timeout=1)
+
+        except Queue.Empty:
+            if not any(worker.is_alive() for worker in workers):
+                break
+
+            continue
+
+        if message == 'metrics':
+            metrics.merge(value)
+            finished_workers += 1
+
+            continue
+
+        feed_count += 1
+        logger.debug(u'Finished processing feed %s (%d/%d)',
+            value, feed_count, feed_total
+        )
+
+    for worker in workers:
+        worker.join()
+
+        if worker.exitcode:
+            logger.error(u'Crawler process %d exited with code %d',
+                worker.pid, worker.exitcode
+            )
+
+    logger.info(u'Finished crawling in %d processes, %d/%d feeds updated',
+        len(workers), feed_count, feed_total
+    )
+
+
+def get_due_queryset(force=False):
+    """
+    Return a queryset of active, unclaimed feeds due for crawling, or of all
+    active, unclaimed feeds when forced, most overdue first.
+    """
+    current = now()
+
+    feed_qs = Feed.objects.filter(
+        Q(claimed_until__isnull=True) | Q(claimed_until__lte=current),
+        active=True
+    ).order_by('next_crawl')
+
+    if not force:
+        feed_qs = feed_qs.filter(
+            Q(next_crawl__isnull=True) | Q(next_crawl__lte=current)
+        )
+
+    return feed_qs
+
+
+def get_due_feeds(force=False):
+    """
+    Return a list of active feeds due for crawling, or all active feeds when
+    forced, most overdue first.
+
+    Selection uses the index on `next_crawl` rather than a random ordering
+    in the database, feeds are spread across hosts in Python.
+    """
+    return spread_by_host(get_due_queryset(force))
+
+
+def get_crawler_id():
+    """ Return a unique identifier for the claims of a crawler. """
+    return u'%s:%d:%s' % (
+        socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8]
+    )
+
+
+def claim_candidates(candidates, crawler):
+    """
+    Claim the active feeds with the given primary keys which are not claimed
+    by another crawler, returning the number of feeds claimed.
+
+    Claims are leases recorded on the feeds with a single conditional UPDATE,
+    such that concurrent crawlers, on this or other machines, claim disjoint
+    sets of feeds.
+    """
+    current = now()
+
+    return Feed.objects.filter(
+        Q(claimed_until__isnull=True) | Q(claimed_until__lte=current),
+        pk__in=candidates, active=True
+    ).update(
+        claimed_by=crawler,
+        claimed_until=current + timedelta(
+            seconds=settings.NEWSPEAK_CLAIM_DURATION
+        )
+    )
+
+
+def claim_feeds(started=None, force=False, batch_size=None):
+    """
+    Claim a batch of feeds due for crawling, or of all active feeds when
+    forced, and return them spread by host. Feeds crawled since `started`
+    are not claimed again.
+
+    Concurrent crawlers claim disjoint batches, see `claim_candidates()`.
+    Claims expire after `NEWSPEAK_CLAIM_DURATION` seconds, so feeds claimed
+    by crawlers that died are eventually crawled again.
+    """
+    if batch_size is None:
+        batch_size = settings.NEWSPEAK_CLAIM_BATCH_SIZE
+
+    crawler = get_crawler_id()
+
+    while True:
+        feed_qs = get_due_queryset(force)
+
+        if started:
+            feed_qs = feed_qs.filter(
+                Q(last_crawl__isnull=True) | Q(last_crawl__lt=started)
+            )
+
+        candidates = list(feed_qs.values_list('pk', flat=True)[:batch_size])
+
+        if not candidates:
+            return []
+
+        # Only claim feeds which have not been claimed meanwhile
+        claimed = claim_candidates(candidates, crawler)
+
+        if claimed:
+            break
+
+        logger.debug(u'Feeds claimed by another crawler, retrying.')
+
+    logger.debug(u'Claimed %d feeds as %s', claimed, crawler)
+
+    return spread_by_host(
+        Feed.objects.filter(claimed_by=crawler).order_by('next_crawl')
+    )
+
+
+def update_feeds(force=False, processes=1, stopping=None):
+    """
+    Update all feeds due for crawling, or all feeds when forced, optionally
+    using multiple processes.
+
+    Feeds are claimed and crawled in batches until none are left, allowing
+    several crawlers to run at once. Crawling ends early once `stopping`
+    returns True.
+    """
+
+    logger.info(u'Updating all feeds')
+
+    started = now()
+
+    while not (stopping and stopping()):
+        feeds = claim_feeds(started, force)
+
+        if not feeds:
+            break
+
+        if processes > 1 and len(feeds) > 1:
+            crawl_feeds_processes(feeds, processes, stopping=stopping)
+        else:
+            crawl_feeds(feeds, len(feeds), stopping=stopping)
+
+    metrics.report()
+
+
+def process_queue(stopping=None):
+    """
+    Update all feeds queued for crawling.
+
+    Queued feeds are claimed like due feeds, skipping those claimed by
+    another crawler, which remain queued. Requests for inactive feeds are
+    dropped.
+    """
+
+    logger.info(u'Updating queued feeds')
+
+    crawl_requests = list(CrawlRequest.objects.all())
+
+    if not crawl_requests:
+        logger.debug(u'No feeds queued for crawling.')
+
+        return
+
+    crawler = get_crawler_id()
+
+    for batch in chunked(crawl_requests, QUERY_BATCH_SIZE):
+        claim_candidates(
+            [crawl_request.feed_id for crawl_request in batch], crawler
+        )
+
+    CrawlRequest.objects.filter(feed__active=False).delete()
+
+    feeds = spread_by_host(Feed.objects.filter(claimed_by=crawler))
+
+    logger.debug(u'Claimed %d of %d queued feeds as %s',
+        len(feeds), len(crawl_requests), crawler
+    )
+
+    crawled = set()
+
+    def progress(feed):
+        crawled.add(feed.pk)
+
+    crawl_feeds(feeds, len(feeds), progress=progress, stopping=stopping)
+
+    # Remove processed requests only, feeds might have been queued meanwhile
+    CrawlRequest.objects.filter(pk__in=[
+        crawl_request.pk for crawl_request in crawl_requests
+        if crawl_request.feed_id in crawled
+    ]).delete()
+
+    metrics.report()
+
+
+def get_crawl_delay(maximum):
+    """
+    Return the number of seconds until the next unclaimed feed is due for
+    crawling, at most `maximum`.
+    """
+    next_crawl = get_due_queryset(force=True).aggregate(
+        Min('next_crawl')
+    )['next_crawl__min']
+
+    if next_crawl is None:
+        return maximum
+
+    return min(max(total_seconds(next_crawl - now()), 0), maximum)
+
+
+def crawl_continuously(processes=1, stopping=None, interval=None):
+    """
+    Keep crawling queued and due feeds until `stopping` returns True,
+    sleeping until the next feed is due in between, but no longer than
+    `interval` seconds (`NEWSPEAK_DAEMON_INTERVAL` by default) as to pick
+    up newly queued feeds.
+
+    Connection pools and caches are kept between crawls, errors are logged
+    and crawling is retried later.
+    """
+    if interval is None:
+        interval = settings.NEWSPEAK_DAEMON_INTERVAL
+
+    if stopping is None:
+        stopping = lambda: False
+
+    logger.info(u'Crawling continuously')
+
+    while not stopping():
+        try:
+            process_queue(stopping=stopping)
+            update_feeds(processes=processes, stopping=stopping)
+
+            delay = get_crawl_delay(interval)
+
+        except Exception:
+            logger.exception(u'Error while crawling, retrying later.')
+
+            delay = interval
+
+        finally:
+            # Do not keep idle database connections open while sleeping
+            close_connection()
+
+        logger.debug(u'Sleeping for %.1f s', delay)
+
+        deadline = time.time() + delay
+        while not stopping() and time.time() < deadline:
+            time.sleep(max(min(1, deadline - time.time()), 0))
+
+    logger.info(u'Stopped crawling')
@@ -1,39 +1,367 @@
+import logging
+logger = logging.getLogger(__name__)
+
+import hashlib
+import re
+import time
+import urllib
+
+from datetime import datetime, timedelta
+
 from django.contrib.syndication.views import Feed
+from django.core.cache import cache
+from django.core.exceptions import ObjectDoesNotExist
+from django.db.models import Q
+from django.http import (
+    Http404, HttpResponse, HttpResponseBadRequest, HttpResponseNotModified
+)
+from django.utils import timezone
 from django.utils.feedgenerator import Atom1Feed, Rss201rev2Feed
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
 
 from django.conf import settings
 
-from .models import FeedEntry
+from .models import Feed as SourceFeed, FeedEntry, KeywordFilter
+from .utils import get_feed_generation, get_feeds_modified
+
+
+# Cursors are the publication time, in microseconds since the epoch (negative
+# before 1970), and id
+CURSOR_REGEX = re.compile(r'^(-?\d+)-(\d+)$')
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# Largest id stored in a signed 64 bit integer column
+MAX_ID = 2 ** 63 - 1
+
+
+def get_cursor(entry):
+    """ Return the cursor pointing at an entry, for paging feeds. """
+    delta = entry.published - EPOCH
+
+    microseconds = (delta.days * 86400 + delta.seconds) * 1000000 + \
+        delta.microseconds
+
+    return '%d-%d' % (microseconds, entry.pk)
+
+
+def parse_cursor(cursor):
+    """
+    Return the publication time and id for a cursor, raising ValueError
+    when it is invalid.
+    """
+    match = CURSOR_REGEX.match(cursor)
+
+    if not match:
+        raise ValueError('Invalid cursor.')
+
+    try:
+        published = EPOCH + timedelta(microseconds=int(match.group(1)))
+    except OverflowError:
+        raise ValueError('Cursor out of range.')
+
+    pk = int(match.group(2))
+
+    if pk > MAX_ID:
+        raise ValueError('Cursor out of range.')
+
+    return published, pk
+
+
+class FeedScope(object):
+    """
+    The entries shown in a feed: all of them or only those of a source feed,
+    a keyword filter or a time window, newest first.
+
+    Pages are selected with the `before` and `since` cursors, comparing on
+    (published, id) rather than using an offset, so pages stay consistent
+    while entries are added and deep pages are as fast as the first.
+    """
+
+    def __init__(self, feed=None, keyword_filter=None, start=None, end=None,
+            before=None, since=None):
+        self.feed = feed
+        self.keyword_filter = keyword_filter
+        self.start = start
+        self.end = end
+        self.before = before
+        self.since = since
+
+        # Entries on the page, set by `get_entries()`
+        self.entries = None
+        self.has_more = False
+
+    def get_description(self):
+        """ Describe the selected entries, for the feed's title. """
+        if self.feed:
+            return unicode(self.feed)
+
+        if self.keyword_filter:
+            return unicode(self.keyword_filter)
+
+        if self.start:
+            return u'%s - %s' % (
+                self.start.date(), (self.end - timedelta(days=1)).date()
+            )
+
+        return None
+
+    def get_queryset(self):
+        """ Return a queryset of the selected entries, newest first. """
+        entry_qs = FeedEntry.objects.filter(feed__active=True)
+
+        if self.feed:
+            entry_qs = entry_qs.filter(feed=self.feed)
+
+        if self.keyword_filter:
+            entry_qs = entry_qs.filter(feed__filters=self.keyword_filter)
+
+        if self.start:
+            entry_qs = entry_qs.filter(
+                published__gte=self.start, published__lt=self.end
+            )
+
+        # Show entries for the same page only once when aggregating, hiding
+        # duplicates only when the entry they duplicate is shown instead
+        if not self.feed:
+            if self.keyword_filter or self.start:
+                # Duplicated entries might be out of scope
+                entry_qs = entry_qs.exclude(
+                    duplicate_of__in=entry_qs.values('pk')
+                )
+            else:
+                entry_qs = entry_qs.filter(
+                    Q(duplicate_of=None) | Q(duplicate_of__feed__active=False)
+                )
+
+        if self.before:
+            published, pk = self.before
+
+            entry_qs = entry_qs.filter(
+                Q(published__lt=published) | Q(published=published, pk__lt=pk)
+            )
+
+        if self.since:
+            published, pk = self.since
+
+            entry_qs = entry_qs.filter(
+                Q(published__gt=published) | Q(published=published, pk__gt=pk)
+            )
+
+        # Order descending by publication date, with id as tie breaker
+        return entry_qs.order_by('-published', '-pk')
+
+    def get_entries(self, page_size):
+        """
+        Return the entries on the page, fetching one more to know whether
+        older entries remain.
+        """
+        if self.entries is None:
+            # Fetch feeds, enclosures and content for all items at once
+            entry_qs = self.get_queryset().select_related('feed')
+            entry_qs = entry_qs.prefetch_related('enclosures', 'content')
+
+            entries = list(entry_qs[:page_size + 1])
+
+            self.entries = entries[:page_size]
+            self.has_more = len(entries) > page_size
+
+        return self.entries
 
 
 class NewspeakFeedMixin(object):
     """ Aggregate RSS Feed for Newspeak. """
 
-    # Get feed metadata from Django settings
-    title = settings.NEWSPEAK_METADATA['title']
+    # Get feed metadata from Django settings, see `title()` for the title
     link = settings.NEWSPEAK_METADATA['link']
     description = settings.NEWSPEAK_METADATA['description']
     author_name = settings.NEWSPEAK_METADATA['author_name']
     author_email = settings.NEWSPEAK_METADATA['author_email']
     author_link = settings.NEWSPEAK_METADATA['author_link']
 
-    def items(self):
-        """ Return a queryset of all feed items to display. """
-        feed_qs = FeedEntry.objects.all()
+    # Number of entries per page
+    page_size = 150
+
+    # Query parameters read by the feed, others are ignored
+    query_params = ('before', 'since')
+
+    def __call__(self, request, *args, **kwargs):
+        """
+        Serve the rendered feed from the cache, rendering it only when the
+        entries have changed since or the cached feed has timed out.
+
+        Responses carry an ETag and a Last-Modified header, the time the
+        entries last changed, and conditional requests are answered with
+        304 Not Modified.
+
+        Feeds are cached by path and the query parameters read by the feed,
+        such that arbitrary query strings cannot flood the cache.
+        """
+        generation = get_feed_generation()
+
+        cache_key = 'newspeak:feed:%s' % hashlib.md5(repr((
+            self.__class__.__name__, request.is_secure(), request.get_host(),
+            request.path, self.get_query(request), args, kwargs, generation
+        ))).hexdigest()
+
+        cached = cache.get(cache_key)
+
+        if cached is None:
+            logger.debug(u'Rendering feed %s', request.get_full_path())
+
+            try:
+                scope = self.get_object(request, *args, **kwargs)
+            except ObjectDoesNotExist:
+                raise Http404('Feed object does not exist.')
+            except ValueError, e:
+                # Messages do not contain the request's input
+                return HttpResponseBadRequest(
+                    unicode(e), content_type='text/plain'
+                )
+
+            feedgen = self.get_feed(scope, request)
+
+            content = feedgen.writeString('utf-8')
+            etag = quote_etag(hashlib.md5(content).hexdigest())
+
+            cached = (
+                content, feedgen.mime_type, etag,
+                self.get_links(request, scope)
+            )
+
+            cache.set(
+                cache_key, cached, settings.NEWSPEAK_FEED_CACHE_TIMEOUT
+            )
+
+        content, content_type, etag, links = cached
+        last_modified = int(get_feeds_modified())
+
+        if self.is_not_modified(request, etag, last_modified):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(content, content_type=content_type)
+
+        # Copies served within the second of the last change are dated a
+        # second earlier, as another change might follow within the same
+        # second. They are thus not considered current later on.
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(
+            min(last_modified, int(time.time()) - 1)
+        )
+
+        if links:
+            response['Link'] = ', '.join(
+                '<%s>; rel="%s"' % (url, rel) for (rel, url) in links
+            )
+
+        return response
+
+    def get_object(self, request, feed_id=None, filter_id=None, year=None,
+            month=None, day=None):
+        """
+        Return the scope of the feed from the URL and the `before` and
+        `since` cursors in the query string.
+        """
+        scope = FeedScope()
+
+        if feed_id:
+            scope.feed = SourceFeed.objects.get(pk=feed_id, active=True)
+
+        if filter_id:
+            scope.keyword_filter = KeywordFilter.objects.get(pk=filter_id)
+
+        if year:
+            # Time window of a year, month or day in the current time zone
+            start = datetime(int(year), int(month or 1), int(day or 1))
+
+            if day:
+                end = start + timedelta(days=1)
+            elif month:
+                end = (start + timedelta(days=31)).replace(day=1)
+            else:
+                end = start.replace(year=start.year + 1)
+
+            current_timezone = timezone.get_current_timezone()
+
+            scope.start = timezone.make_aware(start, current_timezone)
+            scope.end = timezone.make_aware(end, current_timezone)
+
+        for name, cursor in self.get_query(request):
+            setattr(scope, name, parse_cursor(cursor))
+
+        return scope
+
+    def get_query(self, request):
+        """
+        Return (name, value) tuples of the query parameters read by the feed
+        which are given in the request.
+        """
+        return [
+            (name, request.GET[name]) for name in self.query_params
+            if request.GET.get(name)
+        ]
+
+    def get_links(self, request, scope):
+        """
+        Return (rel, url) tuples for the Link header: `next` pages to older
+        entries, `previous` polls for entries newer than this page.
+        """
+        links = []
+        entries = scope.get_entries(self.page_size)
+
+        def get_url(**params):
+            query = dict(self.get_query(request))
+
+            for name, value in params.items():
+                if value:
+                    query[name] = value
+                else:
+                    query.pop(name, None)
+
+            return request.build_absolute_uri('%s?%s' % (
+                request.path, urllib.urlencode(sorted(query.items()))
+            ))
+
+        if scope.has_more:
+            links.append(
+                ('next', get_url(before=get_cursor(entries[-1])))
+            )
+
+        if entries:
+            links.append(('previous',
+                get_url(since=get_cursor(entries[0]), before=None)
+            ))
+
+        return links
+
+    def title(self, scope):
+        title = settings.NEWSPEAK_METADATA['title']
+        description = scope.get_description()
+
+        if description:
+            return u'%s: %s' % (title, description)
+
+        return title
+
+    def is_not_modified(self, request, etag, last_modified):
+        """ Whether the client's copy of the feed is still current. """
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
 
-        # Only show active feeds
-        feed_qs = feed_qs.filter(feed__active=True)
+        if if_none_match:
+            # Validators, when given, take precedence over dates
+            etags = [value.strip() for value in if_none_match.split(',')]
 
-        # Make unique by link (post ID is not reliable)
-        feed_qs = feed_qs.distinct()
+            return etag in etags or '*' in etags
 
-        # Order descending by publication date
-        feed_qs = feed_qs.order_by('-published')
+        if_modified_since = parse_http_date_safe(
+            request.META.get('HTTP_IF_MODIFIED_SINCE', '')
+        )
 
-        # Only return latest 150 elements
-        feed_qs = feed_qs[:150]
+        return bool(if_modified_since) and if_modified_since >= last_modified
 
-        return feed_qs
+    def items(self, scope):
+        """ Return the feed items to display on this page. """
+        return scope.get_entries(self.page_size)
 
     def item_title(self, obj):
         return obj.title
@@ -50,24 +378,33 @@ class NewspeakFeedMixin(object):
     def item_pubdate(self, obj):
         return obj.published
 
+    def get_first(self, related):
+        """
+        Return the first of the related objects prefetched by
+        `FeedScope.get_entries()`, or None.
+        """
+        objects = related.all()
+
+        if objects:
+            return objects[0]
+
+        return None
+
     # Enclosures: for now, render just the first enclosure
     def item_enclosure_url(self, obj):
-        try:
-            return obj.enclosures.all()[0].href
-        except IndexError:
-            return None
+        enclosure = self.get_first(obj.enclosures)
+
+        return enclosure and enclosure.href
 
     def item_enclosure_length(self, obj):
-        try:
-            return obj.enclosures.all()[0].length
-        except IndexError:
-            return None
+        enclosure = self.get_first(obj.enclosures)
+
+        return enclosure and enclosure.length
 
     def item_enclosure_mime_type(self, obj):
-        try:
-            return obj.enclosures.all()[0].mime_type
-        except IndexError:
-            return None
+        enclosure = self.get_first(obj.enclosures)
+
+        return enclosure and enclosure.mime_type
 
     # Extra feed items
     def item_extra_kwargs(self, obj):
@@ -82,22 +419,19 @@ class NewspeakFeedMixin(object):
 
     # Content: for now, render just the first content element
     def item_content_value(self, obj):
-        try:
-            return obj.content.all()[0].value
-        except IndexError:
-            return None
+        content = self.get_first(obj.content)
+
+        return content and content.value
 
     def item_content_mime_type(self, obj):
-        try:
-            return obj.content.all()[0].mime_type
-        except IndexError:
-            return None
+        content = self.get_first(obj.content)
+
+        return content and content.mime_type
 
     def item_content_language(self, obj):
-        try:
-            return obj.content.all()[0].language
-        except IndexError:
-            return None
+        content = self.get_first(obj.content)
+
+        return content and content.language
 
     # Source
     def item_source_title(self, obj):
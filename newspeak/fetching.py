@@ -0,0 +1,480 @@
+import logging
+logger = logging.getLogger(__name__)
+
+import cPickle as pickle
+import hashlib
+import os
+import tempfile
+import time
+import zlib
+
+from contextlib import contextmanager
+from urlparse import urljoin, urlparse, urlsplit
+
+import eventlet
+from eventlet.green import httplib, socket
+from eventlet.semaphore import Semaphore
+
+from django.conf import settings
+
+from .metrics import metrics
+
+
+def get_host(url):
+    """ Return the (lowercase) host and port for a URL. """
+    return urlparse(url).netloc.lower()
+
+
+class HostLimiter(object):
+    """
+    Limits the number of concurrent requests per host and enforces a minimum
+    delay between the start of subsequent requests to the same host, for use
+    by (green) threads. Concurrency is not limited when `connections` is 0.
+    """
+
+    def __init__(self, connections=None, delay=None):
+        if connections is None:
+            connections = settings.NEWSPEAK_HOST_CONNECTIONS
+
+        if delay is None:
+            delay = settings.NEWSPEAK_HOST_DELAY
+
+        self.connections = connections
+        self.delay = delay
+
+        self.semaphores = {}
+        self.next_request = {}
+
+    @contextmanager
+    def limit(self, url):
+        """ Context manager around a single request to the URL. """
+        host = get_host(url)
+
+        if not self.connections:
+            self.wait(host)
+
+            yield
+
+            return
+
+        semaphore = self.semaphores.get(host)
+        if semaphore is None:
+            semaphore = self.semaphores[host] = Semaphore(self.connections)
+
+        with semaphore:
+            self.wait(host)
+
+            yield
+
+    def wait(self, host):
+        """ Reserve the next available slot for a host and wait for it. """
+        current = time.time()
+        start = max(current, self.next_request.get(host, 0))
+        self.next_request[host] = start + self.delay
+
+        if start > current:
+            logger.debug(u'Delaying request to %s for %.2f s',
+                host, start - current
+            )
+
+            eventlet.sleep(start - current)
+
+
+# Shared by all requests in this process
+host_limiter = HostLimiter()
+
+
+class Response(object):
+    """ The result of a request through the `ConnectionPool`. """
+
+    def __init__(self, url, status, headers, body, permanent_redirect=False):
+        # Final URL, after following redirects
+        self.url = url
+        self.status = status
+
+        # Dictionary of headers, lowercase names
+        self.headers = headers
+        self.body = body
+
+        # Whether all redirects followed were permanent
+        self.permanent_redirect = permanent_redirect
+
+
+class ConnectionPool(object):
+    """
+    Keeps HTTP connections alive for reuse, shared by green threads and
+    keyed by scheme, host and port.
+
+    At most `maxsize` idle connections are kept per host, connections idle
+    for longer than `idle_timeout` seconds are closed rather than reused.
+    """
+
+    REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+    PERMANENT_REDIRECT_STATUSES = (301, 308)
+
+    MAX_REDIRECTS = 5
+
+    def __init__(self, maxsize=None, idle_timeout=None, timeout=None):
+        if maxsize is None:
+            maxsize = settings.NEWSPEAK_POOL_CONNECTIONS
+
+        if idle_timeout is None:
+            idle_timeout = settings.NEWSPEAK_POOL_IDLE_TIMEOUT
+
+        if timeout is None:
+            timeout = settings.NEWSPEAK_HTTP_TIMEOUT
+
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+
+        # Idle connections with the time they were returned, per host
+        self.idle = {}
+
+    def get_connection(self, scheme, netloc):
+        """
+        Return a tuple of an idle connection for the host, or a new one, and
+        whether or not it is reused.
+        """
+        idle = self.idle.get((scheme, netloc))
+        current = time.time()
+
+        while idle:
+            connection, returned = idle.pop()
+
+            if current - returned < self.idle_timeout:
+                return connection, True
+
+            logger.debug(u'Closing idle connection to %s', netloc)
+            connection.close()
+
+        if scheme == 'https':
+            connection_class = httplib.HTTPSConnection
+        else:
+            connection_class = httplib.HTTPConnection
+
+        logger.debug(u'Opening new connection to %s', netloc)
+
+        return connection_class(netloc, timeout=self.timeout), False
+
+    def put_connection(self, scheme, netloc, connection):
+        """ Return a connection to the pool for reuse. """
+        idle = self.idle.setdefault((scheme, netloc), [])
+
+        if len(idle) >= self.maxsize:
+            connection.close()
+        else:
+            idle.append((connection, time.time()))
+
+    def clear(self):
+        """ Close all idle connections. """
+        idle, self.idle = self.idle, {}
+
+        for connections in idle.values():
+            for connection, returned in connections:
+                connection.close()
+
+    def fetch(self, scheme, netloc, path, headers):
+        """
+        Perform a single GET request over a pooled connection, returning the
+        response and its (decompressed) body. Bodies which cannot be
+        decompressed raise `httplib.HTTPException`.
+        """
+        connection, reused = self.get_connection(scheme, netloc)
+
+        try:
+            connection.request('GET', path, headers=headers)
+            response = connection.getresponse()
+            body = response.read()
+
+        except (httplib.HTTPException, socket.error):
+            connection.close()
+
+            if not reused:
+                raise
+
+            # The server might have closed an idle connection, retry once
+            logger.debug(u'Retrying request on new connection to %s', netloc)
+
+            return self.fetch(scheme, netloc, path, headers)
+
+        if response.will_close:
+            connection.close()
+        else:
+            self.put_connection(scheme, netloc, connection)
+
+        metrics.increment('http_requests')
+        metrics.increment('bytes_downloaded', len(body))
+
+        encoding = response.getheader('content-encoding', '')
+
+        try:
+            if body and 'gzip' in encoding:
+                body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+
+            elif body and 'deflate' in encoding:
+                try:
+                    body = zlib.decompress(body)
+                except zlib.error:
+                    # The data may have no headers and no checksum
+                    body = zlib.decompress(body, -zlib.MAX_WBITS)
+
+        except zlib.error, e:
+            # Corrupt or mislabelled bodies are errors like any other
+            raise httplib.HTTPException(
+                'Invalid %s body from %s: %s' % (encoding, netloc, e)
+            )
+
+        return response, body
+
+    def request(self, url, headers=None):
+        """
+        GET the URL, following redirects, and return a `Response`.
+
+        Raises `socket.error` or `httplib.HTTPException` on network errors.
+        """
+        request_headers = {
+            'User-Agent': settings.NEWSPEAK_USER_AGENT,
+            'Accept-Encoding': 'gzip, deflate',
+        }
+
+        if headers:
+            request_headers.update(headers)
+
+        permanent_redirect = True
+
+        for redirect in range(self.MAX_REDIRECTS + 1):
+            scheme, netloc, path, query, fragment = urlsplit(url)
+            scheme = scheme.lower()
+
+            if scheme not in ('http', 'https'):
+                raise httplib.InvalidURL('Unsupported URL: %s' % url)
+
+            path = path or '/'
+            if query:
+                path += '?' + query
+
+            logger.debug(u'Requesting %s', url)
+
+            response, body = self.fetch(scheme, netloc, path, request_headers)
+
+            location = response.getheader('location')
+
+            if response.status in self.REDIRECT_STATUSES and location:
+                if response.status not in self.PERMANENT_REDIRECT_STATUSES:
+                    permanent_redirect = False
+
+                url = urljoin(url, location)
+
+                continue
+
+            response_headers = dict(response.getheaders())
+
+            # The body has been decoded
+            response_headers.pop('content-encoding', None)
+
+            return Response(
+                url, response.status, response_headers, body,
+                permanent_redirect=redirect > 0 and permanent_redirect
+            )
+
+        raise httplib.HTTPException('Too many redirects for %s' % url)
+
+
+# Shared by all requests in this process
+connection_pool = ConnectionPool()
+
+
+def parse_cache_control(value):
+    """ Return a dictionary of Cache-Control directives, lowercase names. """
+    directives = {}
+
+    for directive in value.split(','):
+        name, separator, argument = directive.strip().partition('=')
+
+        if name:
+            directives[name.lower()] = argument.strip('" ')
+
+    return directives
+
+
+class PageCache(object):
+    """
+    On-disk cache of HTTP responses, keyed by URL, so pages can be
+    revalidated with conditional requests rather than downloaded again.
+
+    Responses are stored with their validators and the time until which they
+    are fresh according to `Cache-Control`. Once the cache grows beyond
+    `max_size` bytes, the least recently used responses are removed.
+
+    The cache is disabled when no directory has been configured.
+    """
+
+    # Fraction of the maximum size to evict down to
+    EVICT_TARGET = 0.9
+
+    def __init__(self, directory=None, max_size=None):
+        if directory is None:
+            directory = settings.NEWSPEAK_PAGE_CACHE_DIR
+
+        if max_size is None:
+            max_size = settings.NEWSPEAK_PAGE_CACHE_SIZE
+
+        self.directory = directory
+        self.max_size = max_size
+
+        # Total size of the cache in bytes, determined on first write
+        self.size = None
+
+    def get_path(self, url):
+        """ Return the file name for a cached URL. """
+        if isinstance(url, unicode):
+            url = url.encode('utf-8')
+
+        return os.path.join(self.directory, hashlib.sha1(url).hexdigest())
+
+    def get(self, url):
+        """
+        Return a tuple of the cached `Response` for the URL and the time
+        until which it is fresh, or (None, None) when not cached.
+        """
+        if not self.directory:
+            return None, None
+
+        path = self.get_path(url)
+
+        try:
+            with open(path, 'rb') as cache_file:
+                cached = pickle.load(cache_file)
+
+        except IOError:
+            return None, None
+
+        except Exception:
+            logger.exception(u'Removing unreadable cache file for %s', url)
+
+            self.remove(path)
+
+            return None, None
+
+        # Mark as recently used
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+        response = Response(
+            cached['url'], cached['status'], cached['headers'], cached['body']
+        )
+
+        return response, cached['expires']
+
+    def set(self, url, response):
+        """ Store a response, as far as `Cache-Control` allows. """
+        if not self.directory:
+            return
+
+        cache_control = parse_cache_control(
+            response.headers.get('cache-control', '')
+        )
+
+        if 'no-store' in cache_control:
+            logger.debug(u'Not caching %s: no-store', url)
+
+            return
+
+        try:
+            max_age = int(cache_control.get('max-age', 0))
+        except ValueError:
+            max_age = 0
+
+        if 'no-cache' in cache_control:
+            max_age = 0
+
+        if not max_age and not (response.headers.get('etag') or
+                response.headers.get('last-modified')):
+            # Nothing to revalidate with, caching is pointless
+            return
+
+        data = pickle.dumps({
+            'url': response.url,
+            'status': response.status,
+            'headers': response.headers,
+            'body': response.body,
+            'expires': time.time() + max_age,
+        }, pickle.HIGHEST_PROTOCOL)
+
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        if self.size is None:
+            self.size = self.get_size()
+
+        path = self.get_path(url)
+
+        try:
+            self.size -= os.path.getsize(path)
+        except OSError:
+            pass
+
+        # Write atomically, concurrent readers never see partial files
+        handle, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+
+        with os.fdopen(handle, 'wb') as cache_file:
+            cache_file.write(data)
+
+        os.rename(temp_path, path)
+
+        self.size += len(data)
+
+        if self.size > self.max_size:
+            self.evict()
+
+    def remove(self, path):
+        """ Remove a cache file, ignoring files already removed. """
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def get_files(self):
+        """ Return (modification time, size, path) for all cache files. """
+        files = []
+
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+
+            files.append((stat.st_mtime, stat.st_size, path))
+
+        return files
+
+    def get_size(self):
+        """ Return the total size of the cache files. """
+        return sum(size for (mtime, size, path) in self.get_files())
+
+    def evict(self):
+        """ Remove least recently used responses to reduce the size. """
+        files = sorted(self.get_files())
+
+        size = sum(size for (mtime, size, path) in files)
+        target = self.max_size * self.EVICT_TARGET
+
+        for mtime, file_size, path in files:
+            if size <= target:
+                break
+
+            self.remove(path)
+            size -= file_size
+
+        logger.debug(u'Evicted cached pages, %d bytes left', size)
+
+        self.size = size
+
+
+# Shared by all requests in this process
+page_cache = PageCache()
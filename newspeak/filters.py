@@ -0,0 +1,304 @@
+import logging
+logger = logging.getLogger(__name__)
+
+import re
+import string
+
+from django.conf import settings
+from django.utils.datastructures import SortedDict
+
+from .models import Feed, KeywordFilter
+from .utils import keywords_to_regex, split_keywords
+
+
+# Keywords containing these are (partial) regular expressions
+REGEX_CHARACTERS = frozenset('.^$+{}[]|()\\')
+
+# Regular expressions fold case for ASCII characters only
+ASCII_LOWERCASE_BYTES = string.maketrans(
+    string.ascii_uppercase, string.ascii_lowercase
+)
+ASCII_LOWERCASE_UNICODE = dict(
+    (ord(upper), ord(lower)) for (upper, lower) in
+    zip(string.ascii_uppercase, string.ascii_lowercase)
+)
+
+
+def ascii_lower(text):
+    """ Lowercase ASCII characters only, like case insensitive regexes. """
+    if isinstance(text, unicode):
+        return text.translate(ASCII_LOWERCASE_UNICODE)
+
+    return text.translate(ASCII_LOWERCASE_BYTES)
+
+
+class AhoCorasick(object):
+    """
+    Aho-Corasick automaton, finding all occurrences of a set of strings in
+    a single scan of a text.
+    """
+
+    def __init__(self, words):
+        """ Build the automaton for a sequence of (word, value) pairs. """
+
+        # Transitions, failure links and output values per state
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+
+        for word, value in words:
+            state = 0
+
+            for character in word:
+                next_state = self.goto[state].get(character)
+
+                if next_state is None:
+                    next_state = len(self.goto)
+
+                    self.goto[state][character] = next_state
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+
+                state = next_state
+
+            self.output[state].append(value)
+
+        # Breadth first construction of failure links
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for character, next_state in self.goto[state].items():
+                queue.append(next_state)
+
+                fail_state = self.fail[state]
+                while fail_state and character not in self.goto[fail_state]:
+                    fail_state = self.fail[fail_state]
+
+                self.fail[next_state] = \
+                    self.goto[fail_state].get(character, 0)
+
+                # Inherit the output of the longest proper suffix
+                self.output[next_state] = \
+                    self.output[next_state] + \
+                    self.output[self.fail[next_state]]
+
+    def search(self, text):
+        """ Return the set of values for all words occurring in text. """
+        goto = self.goto
+        fail = self.fail
+        output = self.output
+
+        found = set()
+        state = 0
+
+        for character in text:
+            while state and character not in goto[state]:
+                state = fail[state]
+
+            state = goto[state].get(character, 0)
+
+            if output[state]:
+                found.update(output[state])
+
+        return found
+
+
+class KeywordMatcher(object):
+    """
+    Match the keywords of many filters against a text at once, returning the
+    filters that match.
+
+    The longest literal part of each keyword is found with a single
+    Aho-Corasick scan of the text. Plain keywords match on their literal,
+    keywords with wildcards are only verified against their own regular
+    expression once their literal has been found. Filters with keywords that
+    contain regular expressions (or no literal at all) fall back to their
+    full regular expression.
+    """
+
+    def __init__(self, filters, case_sensitive=None):
+        if case_sensitive is None:
+            case_sensitive = settings.NEWSPEAK_CASE_SENSITIVE
+
+        self.case_sensitive = case_sensitive
+
+        # Filters to match by their full regular expression
+        self.fallback = []
+
+        # Per keyword: the filter and regex to verify with, if any
+        self.keywords = []
+
+        literals = []
+
+        for feed_filter in filters:
+            keywords = split_keywords(feed_filter.keywords)
+            parts = []
+
+            for keyword in keywords:
+                if REGEX_CHARACTERS.intersection(keyword):
+                    break
+
+                # Longest literal part of the keyword
+                literal = max(re.split(r'[*?]', keyword), key=len)
+
+                if not literal:
+                    break
+
+                if literal != keyword:
+                    verify = keywords_to_regex(keyword)
+                else:
+                    verify = None
+
+                parts.append((literal, verify))
+
+            else:
+                for literal, verify in parts:
+                    if not case_sensitive:
+                        literal = ascii_lower(literal)
+
+                    literals.append((literal, len(self.keywords)))
+                    self.keywords.append((feed_filter, verify))
+
+                continue
+
+            self.fallback.append(
+                (feed_filter, keywords_to_regex(feed_filter.keywords))
+            )
+
+        self.automaton = AhoCorasick(literals)
+
+    def match(self, text):
+        """ Return the set of filters matching the text. """
+
+        if self.case_sensitive:
+            found = self.automaton.search(text)
+        else:
+            found = self.automaton.search(ascii_lower(text))
+
+        matched = set()
+
+        for index in found:
+            feed_filter, verify = self.keywords[index]
+
+            if feed_filter in matched:
+                continue
+
+            if verify is None or verify.search(text):
+                matched.add(feed_filter)
+
+        for feed_filter, pattern in self.fallback:
+            if pattern.search(text):
+                matched.add(feed_filter)
+
+        return matched
+
+
+class FilterChain(object):
+    """
+    The ordered, active keyword filters for a feed with their keywords
+    compiled, evaluating entries without database access.
+
+    Titles and summaries are scanned once for all filters in the chain.
+    """
+
+    def __init__(self, filters):
+        """ Compile the keywords for a sequence of filters. """
+        self.filters = list(filters)
+
+        self.title_matcher = KeywordMatcher(
+            feed_filter for feed_filter in self.filters
+            if feed_filter.filter_title
+        )
+        self.summary_matcher = KeywordMatcher(
+            feed_filter for feed_filter in self.filters
+            if feed_filter.filter_summary
+        )
+
+    @classmethod
+    def for_feed(cls, feed):
+        """ Return a filter chain for the active filters of a feed. """
+        return cls(feed.filters.filter(active=True))
+
+    def __len__(self):
+        return len(self.filters)
+
+    def filter(self, entry):
+        """
+        Return the result of applying filters to a feed entry. True when entry
+        is to be included, False if the entry is to be discarded.
+        """
+        if not self.filters:
+            # By default, include all entries
+            return True
+
+        # Scan the title and summary once for all filters
+        matched = self.title_matcher.match(entry.title)
+        matched.update(self.summary_matcher.match(entry.summary))
+
+        for feed_filter in self.filters:
+            logger.debug(u'Applying filter %s to entry %s',
+                feed_filter, entry.title
+            )
+
+            if feed_filter.filter_inclusive:
+                # Keep only matched entries
+                if feed_filter in matched:
+                    # Pass: process next filter
+                    break
+
+                # No match: discard entry
+                return False
+
+            else:
+                # Exclusive filtering - discard matching entries
+                if feed_filter in matched:
+                    # Match: discard this entry
+                    return False
+
+        # By default, include all entries
+        return True
+
+
+class FilterChainCache(object):
+    """
+    Filter chains for all feeds during a single crawl. All active filters
+    and the filters for each feed are loaded upfront in two queries, feeds
+    sharing the same set of filters share a single chain.
+    """
+
+    def __init__(self):
+        # Active filters in the order they are to be applied
+        self.filters = SortedDict(
+            (feed_filter.pk, feed_filter)
+            for feed_filter in KeywordFilter.objects.filter(active=True)
+        )
+
+        # Active filter primary keys per feed
+        self.feed_filters = {}
+
+        relations = Feed.filters.through.objects.filter(
+            keywordfilter__active=True
+        ).values_list('feed', 'keywordfilter')
+
+        for feed_pk, filter_pk in relations:
+            self.feed_filters.setdefault(feed_pk, set()).add(filter_pk)
+
+        self.chains = {}
+
+    def get(self, feed):
+        """ Return the filter chain for the specified feed. """
+        filter_pks = self.feed_filters.get(feed.pk, ())
+
+        # Key by the filters in the order they are to be applied
+        key = tuple(pk for pk in self.filters.keys() if pk in filter_pks)
+
+        try:
+            return self.chains[key]
+
+        except KeyError:
+            logger.debug(u'Compiling filter chain for filters %s', key)
+
+            chain = FilterChain(self.filters[pk] for pk in key)
+            self.chains[key] = chain
+
+            return chain
@@ -0,0 +1,125 @@
+import logging
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (
+    setup_test_environment, teardown_test_environment
+)
+
+from ...benchmark import (
+    Benchmark, DEFAULT_THRESHOLD, compare, get_report, load_report,
+    write_report
+)
+
+from .update_feeds import Command as UpdateFeedsCommand
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark crawling and rendering against recorded fixtures, served '
+        'locally. Runs against a temporary test database.'
+    )
+    option_list = BaseCommand.option_list + (
+        make_option('--sizes',
+            action='store',
+            dest='sizes',
+            default='10,1000,10000',
+            help='Comma separated numbers of feeds to benchmark crawling and '
+                'rendering with.'
+        ),
+        make_option('--output',
+            action='store',
+            dest='output',
+            default=None,
+            help='Write results to this file, in JSON format.'
+        ),
+        make_option('--compare',
+            action='store',
+            dest='compare',
+            default=None,
+            help='Compare results to those written to this file earlier, '
+                'failing on regressions.'
+        ),
+        make_option('--threshold',
+            action='store',
+            type='float',
+            dest='threshold',
+            default=DEFAULT_THRESHOLD * 100,
+            help='Percentage by which results may be slower than those '
+                'compared to.'
+        ),
+    )
+    can_import_settings = True
+    requires_model_validation = True
+
+    verbosity_loglevel = UpdateFeedsCommand.verbosity_loglevel
+
+    def handle(self, *args, **options):
+        # Setup the log level for root logger
+        loglevel = self.verbosity_loglevel.get(options['verbosity'])
+        logging.getLogger('newspeak').setLevel(loglevel)
+
+        try:
+            sizes = [int(size) for size in options['sizes'].split(',')]
+        except ValueError:
+            raise CommandError('Invalid sizes: %s' % options['sizes'])
+
+        baseline = None
+        if options['compare']:
+            baseline = load_report(options['compare'])
+
+        results = self.run_benchmark(sizes)
+
+        for name, seconds in results.items():
+            self.stdout.write('%-45s %12.6f s' % (name, seconds))
+
+        if options['output']:
+            write_report(get_report(results, sizes), options['output'])
+
+        if baseline:
+            self.compare(results, baseline, options['threshold'] / 100)
+
+    def run_benchmark(self, sizes):
+        """ Run the benchmark against a temporary test database. """
+        try:
+            # Create tables for all apps, rather than running migrations
+            from south.management.commands import patch_for_test_db_setup
+            patch_for_test_db_setup()
+        except ImportError:
+            pass
+
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+
+        try:
+            return Benchmark(sizes).run()
+
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    def compare(self, results, baseline, threshold):
+        """ Report changes compared to a baseline, failing on regressions. """
+        comparison = compare(results, baseline, threshold)
+
+        self.stdout.write('\n%-45s %12s %12s %8s' % (
+            'Compared to baseline', 'baseline', 'current', 'change'
+        ))
+
+        regressions = []
+        for name, baseline_seconds, seconds, change, regression in comparison:
+            self.stdout.write('%-45s %12.6f %12.6f %+7.1f%%%s' % (
+                name, baseline_seconds, seconds, change * 100,
+                ' REGRESSION' if regression else ''
+            ))
+
+            if regression:
+                regressions.append(name)
+
+        if regressions:
+            raise CommandError('%d benchmarks regressed by more than %d%%: %s' % (
+                len(regressions), threshold * 100, ', '.join(regressions)
+            ))
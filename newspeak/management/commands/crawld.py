@@ -0,0 +1,54 @@
+import logging
+logger = logging.getLogger(__name__)
+
+import signal
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from ...crawler import crawl_continuously
+
+from .update_feeds import Command as UpdateFeedsCommand
+
+
+class Command(BaseCommand):
+    help = (
+        'Run the crawler as a daemon, crawling queued and due feeds as they '
+        'come in. Stops after finishing feeds in progress on SIGTERM or '
+        'SIGINT.'
+    )
+    option_list = BaseCommand.option_list + (
+        make_option('--processes',
+            action='store',
+            type='int',
+            dest='processes',
+            default=1,
+            help='Number of worker processes to crawl with, each with its '
+                'own pool of threads.'
+        ),
+    )
+    can_import_settings = True
+    requires_model_validation = True
+
+    verbosity_loglevel = UpdateFeedsCommand.verbosity_loglevel
+
+    def handle(self, *args, **options):
+        # Setup the log level for root logger
+        loglevel = self.verbosity_loglevel.get(options['verbosity'])
+        logging.getLogger('newspeak').setLevel(loglevel)
+
+        # Signals received, set from signal handlers
+        received = []
+
+        def stop(signum, frame):
+            logger.info(u'Received signal %d, stopping.', signum)
+
+            received.append(signum)
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        crawl_continuously(
+            processes=options['processes'], stopping=lambda: bool(received)
+        )
@@ -0,0 +1,45 @@
+import logging
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from ...retention import prune_entries
+
+from .update_feeds import Command as UpdateFeedsCommand
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete entries older than the retention period of their feed, or '
+        'NEWSPEAK_RETENTION_DAYS.'
+    )
+    option_list = BaseCommand.option_list + (
+        make_option('--archive',
+            action='store',
+            dest='archive',
+            default=None,
+            help='Append entries to this gzipped JSON Lines file before '
+                'deleting them.'
+        ),
+        make_option('--batch-size',
+            action='store',
+            type='int',
+            dest='batch_size',
+            default=None,
+            help='Number of entries deleted per transaction.'
+        ),
+    )
+    can_import_settings = True
+    requires_model_validation = True
+
+    verbosity_loglevel = UpdateFeedsCommand.verbosity_loglevel
+
+    def handle(self, *args, **options):
+        # Setup the log level for root logger
+        loglevel = self.verbosity_loglevel.get(options['verbosity'])
+        logging.getLogger('newspeak').setLevel(loglevel)
+
+        prune_entries(
+            archive_path=options['archive'], batch_size=options['batch_size']
+        )
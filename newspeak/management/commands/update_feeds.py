@@ -1,12 +1,36 @@
 import logging
 
+from optparse import make_option
+
 from django.core.management.base import BaseCommand
 
-from ...crawler import update_feeds
+from ...crawler import update_feeds, process_queue
 
 
 class Command(BaseCommand):
     help = 'Fetch updated feed data.'
+    option_list = BaseCommand.option_list + (
+        make_option('--queued',
+            action='store_true',
+            dest='queued',
+            default=False,
+            help='Only update feeds queued for crawling.'
+        ),
+        make_option('--all',
+            action='store_true',
+            dest='all',
+            default=False,
+            help='Update all active feeds, rather than only those due.'
+        ),
+        make_option('--processes',
+            action='store',
+            type='int',
+            dest='processes',
+            default=1,
+            help='Number of worker processes to crawl with, each with its '
+                'own pool of threads.'
+        ),
+    )
     can_import_settings = True
     requires_model_validation = True
 
@@ -30,4 +54,9 @@ class Command(BaseCommand):
         loglevel = self.verbosity_loglevel.get(options['verbosity'])
         logging.getLogger('newspeak').setLevel(loglevel)
 
-        update_feeds()
+        if options['queued']:
+            process_queue()
+        else:
+            update_feeds(
+                force=options['all'], processes=options['processes']
+            )
@@ -0,0 +1,159 @@
+import logging
+logger = logging.getLogger(__name__)
+
+import json
+import os
+import tempfile
+import time
+
+from contextlib import contextmanager
+
+from django.conf import settings
+
+
+class Metrics(object):
+    """
+    Counters and per-stage timers for crawling, kept in memory.
+
+    Timers record wall clock time, which includes time spent waiting for
+    other (green) threads. Metrics are cumulative for the lifetime of the
+    process, as expected for Prometheus counters.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """ Clear all counters and timers. """
+        self.counters = {}
+
+        # Total seconds and number of timings per stage
+        self.seconds = {}
+        self.timings = {}
+
+    def increment(self, name, value=1):
+        """ Increment a counter. """
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def add_time(self, stage, seconds):
+        """ Record the time spent in a single call of a crawl stage. """
+        self.seconds[stage] = self.seconds.get(stage, 0) + seconds
+        self.timings[stage] = self.timings.get(stage, 0) + 1
+
+    @contextmanager
+    def timer(self, stage):
+        """ Context manager timing a crawl stage. """
+        start = time.time()
+
+        try:
+            yield
+
+        finally:
+            self.add_time(stage, time.time() - start)
+
+    def snapshot(self):
+        """ Return all metrics as a dictionary. """
+        return {
+            'counters': dict(self.counters),
+            'stages': dict(
+                (stage, {
+                    'seconds': self.seconds[stage],
+                    'count': self.timings[stage]
+                }) for stage in self.seconds
+            ),
+        }
+
+    def merge(self, snapshot):
+        """ Add the metrics from a snapshot, i.e. from another process. """
+        for name, value in snapshot['counters'].items():
+            self.increment(name, value)
+
+        for stage, timing in snapshot['stages'].items():
+            self.seconds[stage] = \
+                self.seconds.get(stage, 0) + timing['seconds']
+            self.timings[stage] = \
+                self.timings.get(stage, 0) + timing['count']
+
+    def get_summary(self):
+        """ Return a human readable summary of the metrics. """
+        lines = []
+
+        for name in sorted(self.counters):
+            lines.append(u'%s: %d' % (name, self.counters[name]))
+
+        for stage in sorted(self.seconds):
+            lines.append(u'%s: %.2f s in %d calls' % (
+                stage, self.seconds[stage], self.timings[stage]
+            ))
+
+        return u'\n'.join(lines)
+
+    def as_json(self):
+        """ Return the metrics in JSON format. """
+        data = self.snapshot()
+        data['time'] = time.time()
+
+        return json.dumps(data, indent=2, sort_keys=True)
+
+    def as_prometheus(self):
+        """ Return the metrics in the Prometheus text exposition format. """
+        lines = []
+
+        for name in sorted(self.counters):
+            metric = 'newspeak_%s_total' % name
+
+            lines.append('# TYPE %s counter' % metric)
+            lines.append('%s %d' % (metric, self.counters[name]))
+
+        lines.append('# TYPE newspeak_stage_seconds_total counter')
+        for stage in sorted(self.seconds):
+            lines.append('newspeak_stage_seconds_total{stage="%s"} %f' % (
+                stage, self.seconds[stage]
+            ))
+
+        lines.append('# TYPE newspeak_stage_calls_total counter')
+        for stage in sorted(self.timings):
+            lines.append('newspeak_stage_calls_total{stage="%s"} %d' % (
+                stage, self.timings[stage]
+            ))
+
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """
+        Write the metrics to a file, atomically. Files ending in `.json` are
+        written in JSON format, others in Prometheus text format.
+        """
+        if path.endswith('.json'):
+            data = self.as_json()
+        else:
+            data = self.as_prometheus()
+
+        handle, temp_path = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp'
+        )
+
+        with os.fdopen(handle, 'w') as metrics_file:
+            metrics_file.write(data)
+
+        os.rename(temp_path, path)
+
+    def report(self):
+        """
+        Log a summary of the metrics and write them to the file configured
+        in `NEWSPEAK_METRICS_FILE`, if any.
+        """
+        logger.info(u'Crawl metrics:\n%s', self.get_summary())
+
+        if settings.NEWSPEAK_METRICS_FILE:
+            try:
+                self.write(settings.NEWSPEAK_METRICS_FILE)
+
+            except (IOError, OSError):
+                logger.exception(u'Could not write metrics to %s',
+                    settings.NEWSPEAK_METRICS_FILE
+                )
+
+
+# Collected by all crawls in this process
+metrics = Metrics()
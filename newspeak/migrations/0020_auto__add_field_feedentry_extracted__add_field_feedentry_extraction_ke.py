@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding field 'FeedEntry.extracted'
+        db.add_column(u'newspeak_feedentry', 'extracted',
+                      self.gf('django.db.models.fields.DateTimeField')(null=True),
+                      keep_default=False)
+
+        # Adding field 'FeedEntry.extraction_key'
+        db.add_column(u'newspeak_feedentry', 'extraction_key',
+                      self.gf('django.db.models.fields.CharField')(default='', max_length=40, blank=True),
+                      keep_default=False)
+
+        # Adding field 'FeedEntry.page_etag'
+        db.add_column(u'newspeak_feedentry', 'page_etag',
+                      self.gf('django.db.models.fields.CharField')(default='', max_length=255, blank=True),
+                      keep_default=False)
+
+        # Adding field 'FeedEntry.page_modified'
+        db.add_column(u'newspeak_feedentry', 'page_modified',
+                      self.gf('django.db.models.fields.CharField')(default='', max_length=255, blank=True),
+                      keep_default=False)
+
+
+    def backwards(self, orm):
+        # Deleting field 'FeedEntry.extracted'
+        db.delete_column(u'newspeak_feedentry', 'extracted')
+
+        # Deleting field 'FeedEntry.extraction_key'
+        db.delete_column(u'newspeak_feedentry', 'extraction_key')
+
+        # Deleting field 'FeedEntry.page_etag'
+        db.delete_column(u'newspeak_feedentry', 'page_etag')
+
+        # Deleting field 'FeedEntry.page_modified'
+        db.delete_column(u'newspeak_feedentry', 'page_modified')
+
+
+    models = {
+        u'newspeak.crawlrequest': {
+            'Meta': {'ordering': "('queued',)", 'object_name': 'CrawlRequest'},
+            'feed': ('django.db.models.fields.related.OneToOneField', [], {'related_name': "'crawl_request'", 'unique': 'True', 'to': u"orm['newspeak.Feed']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'queued': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'})
+        },
+        u'newspeak.feed': {
+            'Meta': {'object_name': 'Feed'},
+            'active': ('django.db.models.fields.BooleanField', [], {'default': 'True', 'db_index': 'True'}),
+            'content_language': ('django.db.models.fields.CharField', [], {'max_length': '255', 'blank': 'True'}),
+            'content_mime_type': ('django.db.models.fields.CharField', [], {'max_length': '255', 'blank': 'True'}),
+            'content_xpath': ('django.db.models.fields.CharField', [], {'max_length': '1024', 'blank': 'True'}),
+            'crawl_interval': ('django.db.models.fields.PositiveIntegerField', [], {'null': 'True'}),
+            'description': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'enclosure_mime_type': ('django.db.models.fields.CharField', [], {'max_length': '255', 'blank': 'True'}),
+            'enclosure_xpath': ('django.db.models.fields.CharField', [], {'max_length': '1024', 'blank': 'True'}),
+            'error_date': ('django.db.models.fields.DateTimeField', [], {'null': 'True'}),
+            'error_description': ('django.db.models.fields.TextField', [], {}),
+            'error_state': ('django.db.models.fields.BooleanField', [], {'default': 'False', 'db_index': 'True'}),
+            'etag': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'filters': ('django.db.models.fields.related.ManyToManyField', [], {'symmetrical': 'False', 'to': u"orm['newspeak.KeywordFilter']", 'null': 'True', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'last_crawl': ('django.db.models.fields.DateTimeField', [], {'null': 'True'}),
+            'link': ('django.db.models.fields.URLField', [], {'max_length': '330', 'blank': 'True'}),
+            'modified': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'next_crawl': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'db_index': 'True'}),
+            'subtitle': ('django.db.models.fields.CharField', [], {'max_length': '1024', 'blank': 'True'}),
+            'summary_override': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'summary_xpath': ('django.db.models.fields.CharField', [], {'max_length': '1024', 'blank': 'True'}),
+            'title': ('django.db.models.fields.CharField', [], {'max_length': '1024', 'blank': 'True'}),
+            'updated': ('django.db.models.fields.DateTimeField', [], {'null': 'True'}),
+            'url': ('django.db.models.fields.URLField', [], {'max_length': '330'})
+        },
+        u'newspeak.feedcontent': {
+            'Meta': {'object_name': 'FeedContent'},
+            'entry': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'content'", 'to': u"orm['newspeak.FeedEntry']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'language': ('django.db.models.fields.CharField', [], {'max_length': '16', 'blank': 'True'}),
+            'mime_type': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'value': ('django.db.models.fields.TextField', [], {})
+        },
+        u'newspeak.feedenclosure': {
+            'Meta': {'object_name': 'FeedEnclosure'},
+            'entry': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'enclosures'", 'to': u"orm['newspeak.FeedEntry']"}),
+            'href': ('django.db.models.fields.URLField', [], {'max_length': '512'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'length': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'mime_type': ('django.db.models.fields.CharField', [], {'max_length': '255'})
+        },
+        u'newspeak.feedentry': {
+            'Meta': {'ordering': "('-published',)", 'object_name': 'FeedEntry'},
+            'author': ('django.db.models.fields.CharField', [], {'max_length': '255', 'blank': 'True'}),
+            'entry_id': ('django.db.models.fields.CharField', [], {'max_length': '255', 'null': 'True', 'db_index': 'True'}),
+            'extracted': ('django.db.models.fields.DateTimeField', [], {'null': 'True'}),
+            'extraction_key': ('django.db.models.fields.CharField', [], {'max_length': '40', 'blank': 'True'}),
+            'feed': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'entries'", 'to': u"orm['newspeak.Feed']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'link': ('django.db.models.fields.URLField', [], {'max_length': '330', 'db_index': 'True'}),
+            'page_etag': ('django.db.models.fields.CharField', [], {'max_length': '255', 'blank': 'True'}),
+            'page_modified': ('django.db.models.fields.CharField', [], {'max_length': '255', 'blank': 'True'}),
+            'published': ('django.db.models.fields.DateTimeField', [], {}),
+            'summary': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'title': ('django.db.models.fields.CharField', [], {'max_length': '1024'}),
+            'updated': ('django.db.models.fields.DateTimeField', [], {'null': 'True'})
+        },
+        u'newspeak.keywordfilter': {
+            'Meta': {'ordering': "('sort_order',)", 'object_name': 'KeywordFilter'},
+            'active': ('django.db.models.fields.BooleanField', [], {'default': 'True', 'db_index': 'True'}),
+            'filter_inclusive': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'filter_summary': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'filter_title': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'keywords': ('django.db.models.fields.TextField', [], {}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'sort_order': ('django.db.models.fields.PositiveSmallIntegerField', [], {'default': '10', 'unique': 'True'})
+        }
+    }
+
+    complete_apps = ['newspeak']
\ No newline at end of file
@@ -1,12 +1,15 @@
 import logging
 logger = logging.getLogger(__name__)
 
-from django.db import models
+from django.conf import settings
+from django.db import models, IntegrityError
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 from django.utils.translation import ugettext_lazy as _
 
 from django.conf.global_settings import LANGUAGES
 
-from .utils import get_next_ordering
+from .utils import get_next_ordering, invalidate_feeds, keywords_to_regex
 
 
 class KeywordFilter(models.Model):
@@ -75,6 +78,10 @@ class Feed(models.Model):
     description = models.TextField(_('description'), blank=True)
     active = models.BooleanField(_('active'), default=True, db_index=True)
     filters = models.ManyToManyField(KeywordFilter, null=True, blank=True)
+    retention_days = models.PositiveIntegerField(_('retention'), null=True,
+        blank=True, help_text=_('Days to keep entries after publication. '
+                                'Leave blank to use the global setting, 0 '
+                                'keeps entries forever.'))
 
     """ Preserve error state. """
     error_state = models.BooleanField(
@@ -85,6 +92,24 @@ class Feed(models.Model):
     error_date = models.DateTimeField(_('error date'), null=True,
         help_text=_('Latest time when an error was seen.'), editable=False)
 
+    """ Adaptive crawl scheduling. """
+    last_crawl = models.DateTimeField(_('last crawl'), null=True,
+        help_text=_('Latest time the feed was crawled.'), editable=False)
+    next_crawl = models.DateTimeField(_('next crawl'), null=True,
+        help_text=_('Time at which the feed is due to be crawled.'),
+        editable=False, db_index=True)
+    crawl_interval = models.PositiveIntegerField(_('crawl interval'),
+        null=True, help_text=_('Seconds between crawls, adapted to the '
+                               'observed update frequency.'), editable=False)
+
+    """ Leases, so concurrent crawlers claim disjoint sets of feeds. """
+    claimed_by = models.CharField(_('claimed by'), max_length=255,
+        blank=True, help_text=_('Crawler currently claiming the feed.'),
+        editable=False)
+    claimed_until = models.DateTimeField(_('claimed until'), null=True,
+        help_text=_('Time at which the claim on the feed expires.'),
+        editable=False)
+
     """ HTTP 1.1 get optimizations """
     modified = models.CharField(_('HTTP Last Modified header'),
         max_length=255, editable=False)
@@ -137,9 +162,12 @@ class Feed(models.Model):
         # Make sure we save first
         super(Feed, self).save(*args, **kwargs)
 
-        # If new, update the feed
+        # If new, update the feed or queue it for a background crawl
         if new:
-            update_feed(self)
+            if settings.NEWSPEAK_QUEUE_NEW_FEEDS:
+                CrawlRequest.enqueue(self)
+            else:
+                update_feed(self)
 
     def __unicode__(self):
         """
@@ -151,6 +179,36 @@ class Feed(models.Model):
         return self.url
 
 
+class CrawlRequest(models.Model):
+    """
+    A feed queued for crawling by a background process, forming a
+    database-backed job queue.
+    """
+
+    class Meta:
+        verbose_name = _('crawl request')
+        verbose_name_plural = _('crawl requests')
+        ordering = ('queued', )
+
+    feed = models.OneToOneField(Feed, related_name='crawl_request')
+    queued = models.DateTimeField(_('time queued'), auto_now_add=True)
+
+    @classmethod
+    def enqueue(cls, feed):
+        """ Queue a feed for crawling, unless it has been queued already. """
+        logger.debug(u'Queueing feed %s for crawling', feed)
+
+        try:
+            cls.objects.get_or_create(feed=feed)
+
+        except IntegrityError:
+            # Queued concurrently
+            pass
+
+    def __unicode__(self):
+        return unicode(self.feed)
+
+
 class FeedEntry(models.Model):
     """
     Feed entries, largely modelled after feedparser's.
@@ -164,6 +222,9 @@ class FeedEntry(models.Model):
         verbose_name_plural = _('entries')
         ordering = ('-published', )
 
+        # Composite indexes on (published, id), (feed, published, id),
+        # (feed, entry_id) and (feed, link) are created in migration 0022.
+
     feed = models.ForeignKey(Feed, related_name='entries')
 
     title = models.CharField(_('title'), max_length=1024)
@@ -171,6 +232,9 @@ class FeedEntry(models.Model):
 
     link = models.URLField(_('link'), db_index=True, max_length=330)
     # max_length = 330 seems to be the max. length MySQL can handle for index
+    link_hash = models.CharField(_('link hash'), max_length=40,
+        db_index=True, blank=True, editable=False,
+        help_text=_('Hash of the canonical form of the link.'))
     entry_id = models.CharField(_('remote entry id'), null=True,
         db_index=True, editable=False, max_length=255)
 
@@ -179,6 +243,26 @@ class FeedEntry(models.Model):
 
     summary = models.TextField(_('summary'), blank=True)
 
+    """ Incremental XPath extraction. """
+    extracted = models.DateTimeField(_('time extracted'), null=True,
+        help_text=_('Latest time XPath extraction was performed.'),
+        editable=False)
+    extraction_key = models.CharField(_('extraction key'), max_length=40,
+        blank=True, editable=False, help_text=_(
+            'Hash of the link and XPath settings used for extraction.'
+        ))
+    page_etag = models.CharField(_('page HTTP Etag'),
+        max_length=255, blank=True, editable=False)
+    page_modified = models.CharField(_('page HTTP Last Modified header'),
+        max_length=255, blank=True, editable=False)
+
+    """ Deduplication. """
+    duplicate_of = models.ForeignKey('self', null=True, blank=True,
+        related_name='duplicates', on_delete=models.SET_NULL,
+        editable=False, verbose_name=_('duplicate of'), help_text=_(
+            'Entry stored earlier for the same page, shown instead.'
+        ))
+
     def __unicode__(self):
         """
         Unicode representation is title or URL if title has not been set.
@@ -222,6 +306,9 @@ class FeedContent(models.Model):
         verbose_name = _('content')
         verbose_name_plural = _('content')
 
+        # A composite index on (entry, mime_type, language) is created in
+        # migration 0022.
+
     entry = models.ForeignKey(FeedEntry, related_name='content')
 
     value = models.TextField(_('value'))
@@ -232,3 +319,48 @@ class FeedContent(models.Model):
     def __unicode__(self):
         """ Natural representation is mime_type. """
         return self.mime_type
+
+
+class EntryFingerprint(models.Model):
+    """
+    SimHash fingerprint of the title and summary of an entry, used to find
+    duplicates of new entries in other feeds.
+
+    The fingerprint is split in four indexed bands, as fingerprints which
+    differ in at most three bits have at least one band in common.
+    """
+    class Meta:
+        verbose_name = _('fingerprint')
+        verbose_name_plural = _('fingerprints')
+
+    entry = models.OneToOneField(FeedEntry, related_name='fingerprint')
+
+    simhash = models.CharField(_('SimHash'), max_length=16,
+        help_text=_('Hexadecimal SimHash of title and summary.'))
+
+    band_0 = models.PositiveIntegerField(_('band 0'), db_index=True)
+    band_1 = models.PositiveIntegerField(_('band 1'), db_index=True)
+    band_2 = models.PositiveIntegerField(_('band 2'), db_index=True)
+    band_3 = models.PositiveIntegerField(_('band 3'), db_index=True)
+
+    def __unicode__(self):
+        """ Natural representation is the SimHash. """
+        return self.simhash
+
+
+@receiver(post_save, sender=KeywordFilter)
+@receiver(post_delete, sender=KeywordFilter)
+def clear_regex_cache(sender, **kwargs):
+    """ Make sure no regexes for changed keywords linger in the cache. """
+    logger.debug(u'Clearing keyword regex cache')
+
+    keywords_to_regex.cache.clear()
+
+
+@receiver(post_delete, sender=Feed)
+def invalidate_rendered_feeds(sender, **kwargs):
+    """
+    Do not serve cached feeds rendered before the entries of a feed were
+    deleted. Changes to entries are registered per batch by their writers.
+    """
+    invalidate_feeds()
@@ -0,0 +1,135 @@
+import logging
+logger = logging.getLogger(__name__)
+
+import gzip
+import json
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.timezone import now
+
+from .models import Feed, FeedEntry
+from .utils import invalidate_feeds
+
+
+def get_retention_days(feed):
+    """
+    Return the number of days entries of a feed are kept after publication,
+    or None when they are kept forever.
+    """
+    if feed.retention_days is None:
+        return settings.NEWSPEAK_RETENTION_DAYS
+
+    return feed.retention_days or None
+
+
+def serialize_entry(feed, db_entry):
+    """ Return an entry, with its content and enclosures, as a dictionary. """
+
+    def isoformat(value):
+        return value and value.isoformat()
+
+    return {
+        'feed': feed.url,
+        'entry_id': db_entry.entry_id,
+        'title': db_entry.title,
+        'author': db_entry.author,
+        'link': db_entry.link,
+        'published': isoformat(db_entry.published),
+        'updated': isoformat(db_entry.updated),
+        'summary': db_entry.summary,
+        'content': [{
+            'value': content.value,
+            'mime_type': content.mime_type,
+            'language': content.language,
+        } for content in db_entry.content.all()],
+        'enclosures': [{
+            'href': enclosure.href,
+            'length': enclosure.length,
+            'mime_type': enclosure.mime_type,
+        } for enclosure in db_entry.enclosures.all()],
+    }
+
+
+def prune_feed(feed, published_before, batch_size, archive=None):
+    """
+    Delete the entries of a feed published before a time, with their content
+    and enclosures. Entries are deleted in batches of `batch_size`, each in
+    a transaction of its own, such that tables are not locked for long.
+
+    Entries are written to `archive`, a file, in JSON Lines format before
+    they are deleted. Returns the number of deleted entries.
+    """
+    entry_qs = feed.entries.filter(published__lt=published_before)
+    entry_pks = entry_qs.order_by('pk').values_list('pk', flat=True)
+
+    pruned = 0
+
+    while True:
+        batch = list(entry_pks[:batch_size])
+
+        if not batch:
+            break
+
+        if archive:
+            db_entries = FeedEntry.objects.filter(pk__in=batch)
+
+            for db_entry in db_entries.prefetch_related(
+                    'content', 'enclosures'):
+                archive.write(
+                    json.dumps(serialize_entry(feed, db_entry)) + '\n'
+                )
+
+        with transaction.commit_on_success():
+            FeedEntry.objects.filter(pk__in=batch).delete()
+
+        pruned += len(batch)
+
+    return pruned
+
+
+def prune_entries(archive_path=None, batch_size=None):
+    """
+    Delete entries published longer ago than the retention period of their
+    feed, see `get_retention_days()`. Entries are archived to a gzipped
+    JSON Lines file when `archive_path` is given, appending to an existing
+    archive.
+
+    Returns the number of deleted entries.
+    """
+    batch_size = batch_size or settings.NEWSPEAK_PRUNE_BATCH_SIZE
+
+    archive = None
+    if archive_path:
+        archive = gzip.open(archive_path, 'ab')
+
+    total = 0
+
+    try:
+        for feed in Feed.objects.all():
+            retention_days = get_retention_days(feed)
+
+            if not retention_days:
+                continue
+
+            pruned = prune_feed(feed,
+                now() - timedelta(days=retention_days), batch_size, archive
+            )
+
+            if pruned:
+                logger.info(u'Pruned %d entries of %s', pruned, feed)
+
+            total += pruned
+
+    finally:
+        if archive:
+            archive.close()
+
+    logger.info(u'Pruned %d entries in total', total)
+
+    if total:
+        invalidate_feeds()
+
+    return total
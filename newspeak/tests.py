@@ -1,450 +1,2464 @@
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import re
+import time
+from contextlib import closing
+from datetime import datetime, timedelta
 import feedparser
 import urllib2
-from urlparse import urljoin
+from urlparse import urljoin, urlsplit
 
-from mock import Mock
+import eventlet
+import eventlet.wsgi
+from eventlet.green import httplib
+
+from StringIO import StringIO
+
+from mock import Mock, patch
 
 from lxml import html
 
-from django.test import TestCase
+from south.db import db as south_db
+
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import override_settings
 from django.core.urlresolvers import reverse
 
 from django.conf import settings
-
-from .models import Feed, FeedEntry, FeedEnclosure, FeedContent, KeywordFilter
+from django.db import connection
+from django.db.models.signals import post_save
+from django.contrib.sites.models import Site
+from django.contrib.syndication.views import Feed as SyndicationFeed
+from django.core.cache import cache
+from django.core.management import call_command
+from django.utils.http import parse_http_date
+from django.utils.timezone import now, utc
+
+from .models import (
+    CrawlRequest, EntryFingerprint, Feed, FeedEntry, FeedEnclosure,
+    FeedContent, KeywordFilter
+)
 
 from .crawler import (
-    update_feeds, filter_entry, keywords_to_regex, extract_xpath
+    update_feed, update_feeds, update_entries, filter_entry,
+    keywords_to_regex, extract_xpath, perform_extractions, process_queue,
+    schedule_feed, spread_by_host, get_due_feeds, crawl_feeds,
+    crawl_feeds_processes, shard_by_host, claim_feeds, crawl_continuously,
+    get_crawl_delay, renew_claims, release_claims, claim_candidates
 )
 
-from .utils import fetch_url, parse_url
+from .feeds import FeedScope, NewspeakFeedMixin
+from .fetching import HostLimiter, ConnectionPool, PageCache, Response
+from .benchmark import Benchmark, compare, get_report
+from .metrics import metrics
+from .retention import prune_entries
+from .filters import FilterChain, FilterChainCache, KeywordMatcher
+from .utils import (
+    canonicalize_link, fetch_response, fetch_url, get_feed_generation,
+    get_hamming_distance, get_link_hash, get_simhash, get_simhash_bands,
+    invalidate_feeds, parse_url, LRUCache
+)
 
 
-class FetchTests(TestCase):
-    """ Tests relating to fetching and parsing of feeds. """
+RSS_TEMPLATE = """<?xml version="1.0" encoding="utf-8"?>
+<rss version="2.0">
+<channel>
+<title>Local feed</title>
+<link>http://127.0.0.1/</link>
+<description>Feed served locally.</description>
+%s
+</channel>
+</rss>
+"""
+
+RSS_ITEM_TEMPLATE = """<item>
+<title>Entry %(number)d</title>
+<link>%(base_url)s/entry/%(number)d.html</link>
+<guid>urn:entry:%(number)d</guid>
+<description>Summary of entry %(number)d</description>
+<pubDate>Mon, 15 Oct 2012 12:%(number)02d:00 +0000</pubDate>
+</item>"""
+
+
+def serve(application):
+    """
+    Serve a WSGI application from a local green thread, returning the base
+    URL and the server's green thread.
+    """
+    sock = eventlet.listen(('127.0.0.1', 0))
+    server = eventlet.spawn(
+        eventlet.wsgi.server, sock, application, log=StringIO()
+    )
+
+    return 'http://127.0.0.1:%d' % sock.getsockname()[1], server
+
+
+class LocalFeedServer(object):
+    """ WSGI application serving a feed and its entries' pages. """
+
+    def __init__(self, entries=3):
+        self.entries = entries
+        self.requests = []
+        self.not_modified = 0
+
+        # Time in seconds taken to serve entry pages
+        self.page_delay = 0
+
+        self.base_url, self.server = serve(self)
+
+    def __call__(self, environ, start_response):
+        path = environ['PATH_INFO']
+        self.requests.append((path, environ['REMOTE_PORT']))
+
+        if path == '/old.rss':
+            start_response('301 Moved Permanently', [
+                ('Location', self.base_url + '/feed.rss')
+            ])
+
+            return ['']
+
+        if path == '/feed.rss':
+            if environ.get('HTTP_IF_NONE_MATCH') == '"feed"':
+                start_response('304 Not Modified', [])
+
+                return ['']
+
+            start_response('200 OK', [
+                ('Content-Type', 'application/rss+xml; charset=utf-8'),
+                ('ETag', '"feed"')
+            ])
+
+            return [RSS_TEMPLATE % '\n'.join(
+                RSS_ITEM_TEMPLATE % {
+                    'number': number, 'base_url': self.base_url
+                } for number in range(self.entries)
+            )]
+
+        if path == '/fresh.html':
+            start_response('200 OK', [
+                ('Content-Type', 'text/html; charset=utf-8'),
+                ('Cache-Control', 'max-age=3600')
+            ])
+
+            return ['<html><body>Fresh page</body></html>']
+
+        if path in ('/gzip.html', '/truncated.html'):
+            body = StringIO()
+
+            with closing(gzip.GzipFile(fileobj=body, mode='wb')) as gzipped:
+                gzipped.write('<html><body>Compressed page</body></html>')
+
+            body = body.getvalue()
+
+            if path == '/truncated.html':
+                body = body[:len(body) / 2]
+
+            start_response('200 OK', [
+                ('Content-Type', 'text/html; charset=utf-8'),
+                ('Content-Encoding', 'gzip')
+            ])
+
+            return [body]
+
+        if path == '/no-store.html':
+            start_response('200 OK', [
+                ('Content-Type', 'text/html; charset=utf-8'),
+                ('Cache-Control', 'no-store'),
+                ('ETag', '"page"')
+            ])
+
+            return ['<html><body>Uncached page</body></html>']
+
+        if path.startswith('/entry/'):
+            eventlet.sleep(self.page_delay)
+
+            if environ.get('HTTP_IF_NONE_MATCH') == '"page"':
+                self.not_modified += 1
+                start_response('304 Not Modified', [])
+
+                return ['']
+
+            start_response('200 OK', [
+                ('Content-Type', 'text/html; charset=utf-8'),
+                ('ETag', '"page"')
+            ])
+
+            return [
+                '<html><body><div id="content"><p>Content of %s</p>'
+                '<a class="download" href="%s.pdf">PDF</a></div>'
+                '</body></html>' % (path, path[:-len('.html')])
+            ]
+
+        start_response('404 Not Found', [])
+
+        return ['']
+
+    def stop(self):
+        self.server.kill()
+
+
+class LocalFetchTests(TestCase):
+    """ Test fetching feeds and pages from a local server. """
 
     def setUp(self):
-        self.rss_url = reverse('rss_all')
-        self.atom_url = reverse('atom_all')
+        self.server = LocalFeedServer()
 
-    def test_rijksoverheid(self):
-        """ Test feed from Rijksoverheid. """
+    def tearDown(self):
+        self.server.stop()
 
-        # Test one feed
-        feed = Feed(
-            url='http://feeds.rijksoverheid.nl/onderwerpen/telecomgegevens-'
-                'voor-opsporing/documenten-en-publicaties.rss')
+    def test_connection_reuse(self):
+        """ Subsequent requests to a host reuse the connection. """
 
-        # Save and fetch
-        feed.save()
+        pool = ConnectionPool()
 
-        # Assert entries are present
-        self.assertTrue(feed.entries.exists())
+        response = pool.request(self.server.base_url + '/entry/1.html')
+        self.assertEquals(response.status, 200)
+        self.assertIn('Content of /entry/1.html', response.body)
 
-        # Test requesting the aggregate RSS and Atom feed
-        response = self.client.get(self.rss_url)
-        parsed = feedparser.parse(response.content)
-        self.assertEquals(feed.entries.count(), len(parsed.entries))
+        response = pool.request(self.server.base_url + '/entry/2.html')
+        self.assertEquals(response.status, 200)
 
-        response = self.client.get(self.atom_url)
-        parsed = feedparser.parse(response.content)
-        self.assertEquals(feed.entries.count(), len(parsed.entries))
+        self.assertEquals(len(set(
+            port for (path, port) in self.server.requests
+        )), 1)
 
-    def test_nrc(self):
-        """ Test feed for NRC Handelsblad. """
+        # Idle connections expire
+        pool.idle_timeout = 0
+        pool.request(self.server.base_url + '/entry/3.html')
 
-        # Test one feed
-        feed = Feed(url='http://www.nrc.nl/rss.php')
+        self.assertEquals(len(set(
+            port for (path, port) in self.server.requests
+        )), 2)
 
-        # Save and fetch
-        feed.save()
+        pool.clear()
 
-        # Assert entries are present
-        self.assertTrue(feed.entries.exists())
+    def test_fetch_url(self):
+        """ Test fetching pages, errors yield None. """
 
-        # Assert some author is present
-        self.assertTrue(feed.entries.exclude(author=None).exists())
+        self.assertTrue(fetch_url(self.server.base_url + '/entry/1.html'))
+        self.assertEquals(fetch_url(self.server.base_url + '/missing'), None)
 
-        # Asssert some content is present
-        self.assertTrue(feed.entries.filter(content__isnull=False).exists())
+    def test_compressed(self):
+        """ Compressed pages are decompressed, corrupt ones are errors. """
 
-        # Asssert some enclosures are present
-        self.assertTrue(feed.entries.filter(enclosures__isnull=False).exists())
+        pool = ConnectionPool()
 
-        # Test requesting the aggregate RSS and Atom feed
-        response = self.client.get(self.rss_url)
-        parsed = feedparser.parse(response.content)
-        self.assertEquals(feed.entries.count(), len(parsed.entries))
+        response = pool.request(self.server.base_url + '/gzip.html')
+        self.assertIn('Compressed page', response.body)
 
-        response = self.client.get(self.atom_url)
-        parsed = feedparser.parse(response.content)
-        self.assertEquals(feed.entries.count(), len(parsed.entries))
+        self.assertRaises(httplib.HTTPException,
+            pool.request, self.server.base_url + '/truncated.html'
+        )
 
-        # Assert some enclosure is found
-        enclosure_found = False
-        for entry in parsed.entries:
-            if entry.enclosures and entry.enclosures[0].href:
-                enclosure_found = True
+        pool.clear()
 
-        self.assertTrue(enclosure_found)
+        self.assertEquals(
+            fetch_url(self.server.base_url + '/truncated.html'), None
+        )
 
-    def test_nrc_noduplicate_contentenclosures(self):
-        """
-        Test whether there is no double extraction of content and/or
-        enclosures.
-        """
-        feed = Feed(url='http://www.nrc.nl/rss.php')
-        feed.save()
+    def test_update_feed(self):
+        """ Test crawling a feed, with conditional GET and redirects. """
 
-        # Keep the count for comparison
-        enclosure_count = FeedEnclosure.objects.count()
-        content_count = FeedContent.objects.count()
-        self.assertTrue(enclosure_count)
-        self.assertTrue(content_count)
+        feed = Feed.objects.create(url=self.server.base_url + '/old.rss')
 
-        # Update the feed's data - make sure last modified and etag are disabled
-        feed.modified = ''
-        feed.etag = ''
-        feed.updated = None
-        feed.save()
+        self.assertEquals(feed.entries.count(), 3)
+        self.assertEquals(feed.title, 'Local feed')
+        self.assertEquals(feed.etag, '"feed"')
+        self.assertFalse(feed.error_state)
 
-        update_feeds()
+        # Permanent redirect
+        self.assertEquals(feed.url, self.server.base_url + '/feed.rss')
 
-        # Make sure there's still the same number of objects
-        self.assertEquals(enclosure_count, FeedEnclosure.objects.count())
-        self.assertEquals(content_count, FeedContent.objects.count())
+        # Not modified
+        update_feeds(force=True)
 
-    def test_nytimes(self):
-        """ Test feed for NYTimes. """
+        self.assertEquals(self.server.requests[-1][0], '/feed.rss')
+        self.assertEquals(feed.entries.count(), 3)
 
-        # Test one feed
-        feed = Feed(
-            url='http://www.nytimes.com/services/xml/rss/nyt/GlobalHome.xml')
 
-        # Save and fetch
-        feed.save()
+class PageCacheTests(TestCase):
+    """ Test the on-disk cache for fetched pages. """
 
-        # Assert entries are present
-        self.assertTrue(feed.entries.exists())
+    def setUp(self):
+        self.server = LocalFeedServer()
 
-        # Assert some author is present
-        self.assertTrue(feed.entries.exclude(author=None).exists())
+        self.directory = tempfile.mkdtemp()
+        self.cache = PageCache(self.directory, 1024 * 1024)
 
-        # Test requesting the aggregate RSS and Atom feed
-        response = self.client.get(self.rss_url)
-        parsed = feedparser.parse(response.content)
-        self.assertEquals(feed.entries.count(), len(parsed.entries))
+        self.patcher = patch('newspeak.utils.page_cache', self.cache)
+        self.patcher.start()
 
-        response = self.client.get(self.atom_url)
-        parsed = feedparser.parse(response.content)
-        self.assertEquals(feed.entries.count(), len(parsed.entries))
+    def tearDown(self):
+        self.patcher.stop()
+        self.server.stop()
 
-    def test_nos_podcast(self):
-        """ Test podcast NOS Buitenland. """
+        shutil.rmtree(self.directory)
 
-        # Test one feed
-        feed = Feed(url='http://feeds.nos.nl/nospodcastbuitenland')
+    def test_revalidation(self):
+        """ Cached pages are revalidated with a conditional request. """
 
-        # Save and fetch
-        feed.save()
+        url = self.server.base_url + '/entry/1.html'
+        body = fetch_url(url)
 
-        # Assert entries are present
-        self.assertTrue(feed.entries.exists())
+        self.assertEquals(self.server.not_modified, 0)
 
-        # Asssert some enclosures are present
-        self.assertTrue(feed.entries.filter(enclosures__isnull=False).exists())
+        self.assertEquals(fetch_url(url), body)
+        self.assertEquals(self.server.not_modified, 1)
+        self.assertEquals(len(self.server.requests), 2)
 
-        # Test requesting the aggregate RSS and Atom feed
-        response = self.client.get(self.rss_url)
-        parsed = feedparser.parse(response.content)
-        self.assertEquals(feed.entries.count(), len(parsed.entries))
+        # Callers' own validators yield the server's 304
+        response = fetch_response(url, {'If-None-Match': '"page"'})
+        self.assertEquals(response.status, 304)
 
-        response = self.client.get(self.atom_url)
-        parsed = feedparser.parse(response.content)
-        self.assertEquals(feed.entries.count(), len(parsed.entries))
+    def test_cache_control(self):
+        """ Fresh pages are not requested, no-store is honoured. """
 
-    def test_aggregate(self):
-        """ Test multiple feed aggregation. """
+        url = self.server.base_url + '/fresh.html'
 
-        # NRC
-        url1 = 'http://www.nrc.nl/rss.php'
-        feed1 = Feed(url=url1)
-        feed1.save()
+        self.assertEquals(fetch_url(url), fetch_url(url))
+        self.assertEquals(len(self.server.requests), 1)
 
-        # NOS
-        url2 = 'http://feeds.nos.nl/nospodcastbuitenland'
-        feed2 = Feed(url=url2)
-        feed2.save()
+        url = self.server.base_url + '/no-store.html'
+
+        fetch_url(url)
+        fetch_url(url)
+
+        self.assertEquals(len(self.server.requests), 3)
+        self.assertEquals(self.cache.get(url), (None, None))
+
+    def test_eviction(self):
+        """ Least recently used pages are evicted beyond the maximum size. """
+
+        self.cache.max_size = 3000
+
+        for number in range(3):
+            url = 'http://example.com/%d' % number
+
+            self.cache.set(url, Response(
+                url, 200, {'etag': '"%d"' % number}, 'x' * 1000
+            ))
+
+            # Modification times mark use
+            os.utime(self.cache.get_path(url), (number, number))
+
+        self.assertEquals(self.cache.get('http://example.com/0'), (None, None))
+        self.assertTrue(self.cache.get('http://example.com/2')[0])
+        self.assertTrue(self.cache.size <= 3000)
+
+
+class MetricsTests(TestCase):
+    """ Test collecting and exporting crawl metrics. """
+
+    def setUp(self):
+        self.server = LocalFeedServer()
+
+        metrics.reset()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_crawl_metrics(self):
+        """ Crawling a feed updates counters and stage timers. """
+
+        Feed.objects.create(url=self.server.base_url + '/feed.rss')
+
+        self.assertEquals(metrics.counters['feeds_crawled'], 1)
+        self.assertEquals(metrics.counters['entries_created'], 3)
+        self.assertTrue(metrics.counters['bytes_downloaded'] > 0)
+
+        for stage in ('feed', 'feed_fetch', 'feed_parse', 'filter',
+                'db_write'):
+            self.assertIn(stage, metrics.seconds)
+
+    def test_export(self):
+        """ Metrics are written in Prometheus text or JSON format. """
+
+        metrics.increment('feeds_crawled', 2)
+
+        with metrics.timer('feed_fetch'):
+            pass
+
+        # Metrics from other processes are merged
+        metrics.merge(metrics.snapshot())
+
+        directory = tempfile.mkdtemp()
+
+        try:
+            path = os.path.join(directory, 'metrics.prom')
+            metrics.write(path)
+
+            data = open(path).read()
+            self.assertIn('newspeak_feeds_crawled_total 4\n', data)
+            self.assertIn(
+                'newspeak_stage_calls_total{stage="feed_fetch"} 2\n', data
+            )
+
+            path = os.path.join(directory, 'metrics.json')
+            metrics.write(path)
+
+            data = json.load(open(path))
+            self.assertEquals(data['counters']['feeds_crawled'], 4)
+            self.assertEquals(data['stages']['feed_fetch']['count'], 2)
+
+        finally:
+            shutil.rmtree(directory)
+
+
+class FeedCacheTests(TestCase):
+    """ Test caching of rendered feeds and conditional requests. """
+
+    def setUp(self):
+        cache.clear()
+
+        with patch('newspeak.crawler.update_feed'):
+            self.feed = Feed.objects.create(url='http://example.com/feed.rss')
+
+        self.create_entry(u'First entry')
+        invalidate_feeds()
+
+    def create_entry(self, title):
+        return FeedEntry.objects.create(
+            feed=self.feed, title=title, link='http://example.com/',
+            published=now()
+        )
+
+    def test_cache(self):
+        """ Rendered feeds are cached until entries change. """
+
+        # Requested after the second in which the entries changed
+        with patch('time.time', return_value=time.time() + 1):
+            for name in ('rss_all', 'atom_all'):
+                url = reverse(name)
+
+                response = self.client.get(url)
+                self.assertEquals(response.status_code, 200)
+                self.assertIn('First entry', response.content)
+
+                etag = response['ETag']
+                last_modified = response['Last-Modified']
+
+                # Served from cache
+                with self.assertNumQueries(0):
+                    response = self.client.get(url)
+
+                self.assertEquals(response['ETag'], etag)
+                self.assertIn('First entry', response.content)
+
+                # Conditional requests
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEquals(response.status_code, 304)
+                self.assertEquals(response.content, '')
+
+                response = self.client.get(url,
+                    HTTP_IF_MODIFIED_SINCE=last_modified
+                )
+                self.assertEquals(response.status_code, 304)
+
+                response = self.client.get(url, HTTP_IF_NONE_MATCH='"other"')
+                self.assertEquals(response.status_code, 200)
+
+        # Registered changes invalidate cached feeds
+        self.create_entry(u'Second entry')
+        invalidate_feeds()
+
+        response = self.client.get(reverse('rss_all'),
+            HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEquals(response.status_code, 200)
+        self.assertIn('Second entry', response.content)
+
+    def test_last_modified(self):
+        """ Last-Modified is never in the future, nor current too early. """
+
+        url = reverse('rss_all')
+
+        def get_last_modified(**kwargs):
+            response = self.client.get(url, **kwargs)
+
+            return response, parse_http_date(response['Last-Modified'])
+
+        with patch('time.time') as time_mock:
+            time_mock.return_value = 1000000.2
+            invalidate_feeds()
+
+            # Served within the second of the change
+            response, last_modified = get_last_modified()
+            self.assertEquals(last_modified, 999999)
+
+            # Changed again within the same second
+            time_mock.return_value = 1000000.7
+            self.create_entry(u'Second entry')
+            invalidate_feeds()
+
+            response, last_modified = get_last_modified(
+                HTTP_IF_MODIFIED_SINCE=response['Last-Modified']
+            )
+            self.assertEquals(response.status_code, 200)
+
+            # Current once the second has passed
+            time_mock.return_value = 1000001.5
+
+            response, last_modified = get_last_modified()
+            self.assertEquals(last_modified, 1000000)
+
+            response, last_modified = get_last_modified(
+                HTTP_IF_MODIFIED_SINCE=response['Last-Modified']
+            )
+            self.assertEquals(response.status_code, 304)
+
+            # Many changes do not move it into the future
+            for number in range(100):
+                invalidate_feeds()
+
+            response, last_modified = get_last_modified()
+            self.assertTrue(last_modified <= time_mock.return_value)
+
+    def test_query(self):
+        """ Query parameters not read by the feed share the cached feed. """
+
+        url = reverse('rss_all')
+        self.client.get(url)
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url + '?utm_source=1&foo=bar')
+
+        self.assertEquals(response.status_code, 200)
+        self.assertIn('First entry', response.content)
+
+    def test_crawl_invalidates(self):
+        """ Entries created by the crawler invalidate cached feeds. """
+
+        generation = get_feed_generation()
+
+        entries = [feedparser.FeedParserDict(
+            id=u'urn:entry:%d' % number, title=u'Crawled entry',
+            link=u'http://example.com/entry/%d' % number, summary=u'',
+            published_parsed=time.gmtime(1350000000)
+        ) for number in range(10)]
+
+        # Once for all entries
+        with patch('newspeak.crawler.invalidate_feeds') as invalidate:
+            update_entries(self.feed, entries[:5])
+
+        self.assertEquals(invalidate.call_count, 1)
+
+        update_entries(self.feed, entries[5:])
+
+        self.assertEquals(get_feed_generation(), generation + 1)
+
+    def test_queries(self):
+        """ Rendering takes the same number of queries for any entry count. """
+
+        for number in range(10):
+            entry = self.create_entry(u'Entry %d' % number)
+
+            FeedEnclosure.objects.create(entry=entry,
+                href='http://example.com/%d.pdf' % number, length=number,
+                mime_type='application/pdf'
+            )
+            FeedContent.objects.create(entry=entry,
+                value=u'Content %d' % number, mime_type='text/plain'
+            )
+
+        for name in ('rss_all', 'atom_all'):
+            cache.clear()
+            Site.objects.clear_cache()
+
+            # Site, entries with their feeds, enclosures and content
+            with self.assertNumQueries(4):
+                response = self.client.get(reverse(name))
+
+            self.assertIn('http://example.com/9.pdf', response.content)
+            self.assertIn('Content 9', response.content)
+
+
+class FeedPagingTests(TestCase):
+    """ Test scoped feeds and paging with cursors. """
+
+    def setUp(self):
+        cache.clear()
+
+        self.keyword_filter = KeywordFilter.objects.create(
+            name=u'Privacy', keywords=u'privacy'
+        )
+
+        with patch('newspeak.crawler.update_feed'):
+            self.feed = Feed.objects.create(url='http://example.com/feed.rss')
+            self.other_feed = Feed.objects.create(
+                url='http://example.com/other.rss'
+            )
+
+        self.feed.filters.add(self.keyword_filter)
+
+        # Five entries a day apart, the last two published simultaneously
+        published = datetime(2012, 10, 1, tzinfo=utc)
+
+        for number in range(5):
+            FeedEntry.objects.create(
+                feed=self.feed if number % 2 else self.other_feed,
+                title=u'Entry %d' % number,
+                link='http://example.com/%d' % number,
+                published=published + timedelta(days=min(number, 3))
+            )
+
+    def get_titles(self, url, status_code=200):
+        response = self.client.get(url)
+        self.assertEquals(response.status_code, status_code)
+
+        titles = [entry.title for entry in
+            feedparser.parse(response.content).entries
+        ]
+
+        links = dict((rel, url) for (url, rel) in
+            re.findall(r'<([^>]+)>; rel="(\w+)"', response.get('Link', ''))
+        )
+
+        return titles, links
+
+    def test_paging(self):
+        """ Pages follow each other through `next` links. """
+
+        with patch.object(NewspeakFeedMixin, 'page_size', 2):
+            titles, links = self.get_titles(reverse('rss_all'))
+            self.assertEquals(titles, [u'Entry 4', u'Entry 3'])
+
+            pages = [titles]
+
+            while 'next' in links:
+                split = urlsplit(links['next'])
+                titles, links = self.get_titles(
+                    '%s?%s' % (split.path, split.query)
+                )
+                pages.append(titles)
+
+            self.assertEquals(pages, [
+                [u'Entry 4', u'Entry 3'], [u'Entry 2', u'Entry 1'],
+                [u'Entry 0']
+            ])
+
+        # Poll for entries newer than the first page
+        split = urlsplit(links['previous'])
+        since_url = '%s?%s' % (split.path, split.query)
+
+        titles, links = self.get_titles(since_url)
+        self.assertEquals(titles,
+            [u'Entry 4', u'Entry 3', u'Entry 2', u'Entry 1']
+        )
+
+        split = urlsplit(self.get_titles(reverse('rss_all'))[1]['previous'])
+        self.assertEquals(self.get_titles(
+            '%s?%s' % (split.path, split.query)
+        )[0], [])
+
+        FeedEntry.objects.create(feed=self.feed, title=u'Entry 5',
+            link='http://example.com/5', published=now()
+        )
+        invalidate_feeds()
+
+        self.assertEquals(self.get_titles(
+            '%s?%s' % (split.path, split.query)
+        )[0], [u'Entry 5'])
+
+    def test_scopes(self):
+        """ Feeds are limited to a source feed, filter or time window. """
+
+        for name in ('rss', 'atom'):
+            self.assertEquals(self.get_titles(reverse(name + '_feed',
+                kwargs={'feed_id': self.feed.pk}
+            ))[0], [u'Entry 3', u'Entry 1'])
+
+            self.assertEquals(self.get_titles(reverse(name + '_filter',
+                kwargs={'filter_id': self.keyword_filter.pk}
+            ))[0], [u'Entry 3', u'Entry 1'])
+
+            self.assertEquals(self.get_titles(reverse(name + '_archive',
+                kwargs={'year': '2012', 'month': '10', 'day': '2'}
+            ))[0], [u'Entry 1'])
+
+            self.assertEquals(len(self.get_titles(reverse(name + '_archive',
+                kwargs={'year': '2012', 'month': '10'}
+            ))[0]), 5)
+
+            self.assertEquals(self.get_titles(reverse(name + '_archive',
+                kwargs={'year': '2011'}
+            ))[0], [])
+
+    def test_scoped_duplicates(self):
+        """ Duplicates are shown when the original is out of scope. """
+
+        original = self.other_feed.entries.get(title=u'Entry 0')
+        FeedEntry.objects.create(feed=self.feed, title=u'Duplicate',
+            link=original.link, duplicate_of=original,
+            published=original.published + timedelta(days=1)
+        )
+
+        # The original is not in the filtered feed or the archive of a day
+        self.assertEquals(self.get_titles(reverse('rss_filter',
+            kwargs={'filter_id': self.keyword_filter.pk}
+        ))[0], [u'Entry 3', u'Duplicate', u'Entry 1'])
+
+        self.assertEquals(self.get_titles(reverse('rss_archive',
+            kwargs={'year': '2012', 'month': '10', 'day': '2'}
+        ))[0], [u'Duplicate', u'Entry 1'])
+
+        # Hidden when the original is shown as well
+        self.assertNotIn(u'Duplicate', self.get_titles(reverse('rss_archive',
+            kwargs={'year': '2012', 'month': '10'}
+        ))[0])
+        self.assertNotIn(u'Duplicate', self.get_titles(reverse('rss_all'))[0])
+
+        self.other_feed.filters.add(self.keyword_filter)
+        cache.clear()
+
+        self.assertNotIn(u'Duplicate', self.get_titles(reverse('rss_filter',
+            kwargs={'filter_id': self.keyword_filter.pk}
+        ))[0])
+
+    def test_before_epoch(self):
+        """ Entries published before 1970 are paged with negative cursors. """
+
+        for day in (20, 21):
+            FeedEntry.objects.create(feed=self.feed, title=u'Day %d' % day,
+                link='http://example.com/1969/%d' % day,
+                published=datetime(1969, 7, day, tzinfo=utc)
+            )
+
+        with patch.object(NewspeakFeedMixin, 'page_size', 6):
+            titles, links = self.get_titles(reverse('rss_all'))
+            self.assertEquals(titles[-1], u'Day 21')
+
+            split = urlsplit(links['next'])
+            self.assertIn('before=-', split.query)
+
+            self.assertEquals(self.get_titles(
+                '%s?%s' % (split.path, split.query)
+            )[0], [u'Day 20'])
+
+    def test_invalid(self):
+        """ Unknown feeds are not found, invalid cursors are refused. """
+
+        self.get_titles(reverse('rss_feed', kwargs={'feed_id': 0}), 404)
+        self.get_titles(reverse('rss_all') + '?before=invalid', 400)
+        self.get_titles(reverse('atom_archive',
+            kwargs={'year': '2012', 'month': '2', 'day': '31'}
+        ), 400)
+
+        # Cursors are not echoed in error pages
+        response = self.client.get(
+            reverse('rss_all') + '?before=<script>alert(1)</script>'
+        )
+        self.assertEquals(response.status_code, 400)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        self.assertNotIn('<script>', response.content)
+
+        # Cursors beyond the range of dates or ids
+        for cursor in ('999999999999999999999999-1',
+                '-999999999999999999999999-1', '0-99999999999999999999'):
+            self.get_titles(reverse('rss_all') + '?before=' + cursor, 400)
+
+
+class IndexTests(TransactionTestCase):
+    """
+    Test the hot queries use the composite indexes of the migrated schema.
+    Migrating and gathering statistics commit on some backends, hence no
+    TestCase.
+    """
+
+    def setUp(self):
+        # Tests create tables without migrations, recreate them by migrating
+        # such that indexes lost when migrations rebuild tables are noticed
+        for table_name in connection.introspection.table_names():
+            if table_name.startswith('newspeak_'):
+                south_db.delete_table(table_name)
+
+        call_command('migrate', 'newspeak',
+            verbosity=0, no_initial_data=True
+        )
+
+        # Entries of several feeds, as aggregated feeds join them
+        with patch('newspeak.crawler.update_feed'):
+            feeds = [
+                Feed.objects.create(url='http://example.com/%d.rss' % number)
+                for number in range(10)
+            ]
+
+        self.feed = feeds[0]
+
+        FeedEntry.objects.bulk_create([
+            FeedEntry(feed=feeds[number % 10], title=u'Entry %d' % number,
+                link=u'http://example.com/%d' % number,
+                entry_id=u'urn:entry:%d' % number, published=now()
+            ) for number in range(1000)
+        ])
+
+        # Statistics tell the planner entries far outnumber feeds
+        if connection.vendor == 'mysql':
+            connection.cursor().execute('ANALYZE TABLE newspeak_feedentry')
+        else:
+            connection.cursor().execute('ANALYZE')
+
+    def assertUsesIndex(self, queryset, table_name, column_names):
+        """ Assert the query plan for a queryset uses an index. """
+
+        if connection.vendor == 'sqlite':
+            explain = 'EXPLAIN QUERY PLAN '
+        else:
+            explain = 'EXPLAIN '
+
+        sql, params = queryset.query.sql_with_params()
+
+        cursor = connection.cursor()
+        cursor.execute(explain + sql, params)
+
+        plan = repr(cursor.fetchall())
+
+        self.assertIn(south_db.create_index_name(table_name, column_names),
+            plan, 'Index on %s not used: %s' % (column_names, plan)
+        )
+
+        return plan
+
+    def test_indexes(self):
+        """ Rendering, entry matching and content lookup use indexes. """
+
+        plan = self.assertUsesIndex(
+            FeedScope().get_queryset()[:150],
+            u'newspeak_feedentry', ['published', 'id']
+        )
+
+        # Entries are read in order, rather than sorted or made distinct
+        if connection.vendor == 'sqlite':
+            self.assertNotIn('TEMP B-TREE', plan)
+
+        self.assertUsesIndex(
+            FeedScope(feed=self.feed).get_queryset()[:150],
+            u'newspeak_feedentry', ['feed_id', 'published', 'id']
+        )
+
+        self.assertUsesIndex(
+            self.feed.entries.filter(entry_id__in=[u'urn:entry:1']),
+            u'newspeak_feedentry', ['feed_id', 'entry_id']
+        )
+
+        self.assertUsesIndex(
+            self.feed.entries.filter(
+                entry_id=None, link__in=[u'http://example.com/1']
+            ),
+            u'newspeak_feedentry', ['feed_id', 'link']
+        )
+
+        self.assertUsesIndex(
+            FeedContent.objects.filter(
+                entry=1, mime_type=u'text/html', language=u''
+            ),
+            u'newspeak_feedcontent', ['entry_id', 'mime_type', 'language']
+        )
+
+
+class BenchmarkTests(TestCase):
+    """ Test the offline benchmark. """
+
+    def test_benchmark(self):
+        """ Benchmarks run against local fixtures and can be compared. """
+
+        # Feeds are rendered for every request, rather than cached
+        get_feed = SyndicationFeed.get_feed
+
+        with patch.object(SyndicationFeed, 'get_feed', autospec=True,
+                side_effect=get_feed) as get_feed_mock:
+            results = Benchmark([2]).run()
+
+        self.assertEquals(get_feed_mock.call_count, 2 * 3 * 3)
+
+        for name in ('filter_entry', 'get_simhash', 'extract_xpath',
+                'parse_url', 'update_feeds[2]', 'render[rss_all][2]'):
+            self.assertIn(name, results)
+
+        self.assertEquals(Feed.objects.count(), 2)
+        self.assertEquals(Feed.objects.filter(error_state=True).count(), 0)
+        self.assertTrue(FeedEnclosure.objects.exists())
+
+        baseline = get_report({'parse_url': 1.0, 'extract_xpath': 1.0}, [2])
+        comparison = compare(
+            {'parse_url': 1.2, 'extract_xpath': 1.05}, baseline, 0.1
+        )
+
+        self.assertEquals(dict(
+            (name, regression) for (name, b, c, d, regression) in comparison
+        ), {'parse_url': True, 'extract_xpath': False})
+
+
+class ExtractionTests(TestCase):
+    """ Test XPath extraction only fetches new or changed pages. """
+
+    def setUp(self):
+        self.server = LocalFeedServer()
+
+        with patch('newspeak.crawler.update_feed'):
+            self.feed = Feed.objects.create(
+                url=self.server.base_url + '/feed.rss',
+                content_xpath='//div[@id="content"]',
+                content_mime_type='text/html'
+            )
+
+        self.entries = feedparser.parse(
+            fetch_url(self.server.base_url + '/feed.rss')
+        ).entries
+
+    def tearDown(self):
+        self.server.stop()
+
+    def get_page_requests(self):
+        """ Return and reset the page requests to the server. """
+        requests = [
+            path for (path, port) in self.server.requests
+            if path.startswith('/entry/')
+        ]
+
+        self.server.requests = []
+
+        return requests
+
+    def test_incremental_extraction(self):
+        """ Pages are only fetched for new or changed entries. """
+
+        update_entries(self.feed, self.entries)
+
+        self.assertEquals(len(self.get_page_requests()), 3)
+        self.assertEquals(FeedContent.objects.count(), 3)
+
+        db_entry = self.feed.entries.get(entry_id='urn:entry:1')
+        self.assertTrue(db_entry.extracted)
+        self.assertEquals(db_entry.page_etag, '"page"')
+
+        # Unchanged entries are not fetched again
+        update_entries(self.feed, self.entries)
+
+        self.assertEquals(self.get_page_requests(), [])
+
+        # Changed entries are fetched conditionally, keeping content
+        self.entries[1].title = 'Changed entry'
+        update_entries(self.feed, self.entries)
+
+        self.assertEquals(self.get_page_requests(), ['/entry/1.html'])
+        self.assertEquals(FeedContent.objects.count(), 3)
+        self.assertEquals(
+            self.feed.entries.get(entry_id='urn:entry:1').title,
+            'Changed entry'
+        )
+
+        # Changed XPath settings require extraction for all entries
+        self.feed.content_xpath = '//div[@id="content"]/p'
+        update_entries(self.feed, self.entries)
+
+        self.assertEquals(len(self.get_page_requests()), 3)
+        self.assertIn('<p>Content of /entry/1.html</p>',
+            FeedContent.objects.get(entry__entry_id='urn:entry:1').value
+        )
+
+    def test_concurrent_fetches(self):
+        """ Pages for the entries of a feed are fetched concurrently. """
+
+        self.server.page_delay = 0.3
+
+        with patch('newspeak.utils.host_limiter', HostLimiter(10, 0)):
+            start = time.time()
+            update_entries(self.feed, self.entries)
+            duration = time.time() - start
+
+        self.assertEquals(len(self.get_page_requests()), 3)
+        self.assertEquals(FeedContent.objects.count(), 3)
+
+        # Bounded by the slowest page rather than the sum of all pages
+        self.assertTrue(duration < 0.8, duration)
+
+    def test_extraction_order(self):
+        """ Pages are extracted from in the order they are fetched. """
+
+        extracted = []
+
+        def make_extraction(delay):
+            extraction = Mock()
+            extraction.fetch.side_effect = lambda: eventlet.sleep(delay)
+            extraction.extract.side_effect = \
+                lambda response: extracted.append(delay)
+
+            return extraction
+
+        perform_extractions(dict(
+            (key, make_extraction(delay))
+            for (key, delay) in enumerate([0.3, 0.1, 0.2])
+        ))
+
+        self.assertEquals(extracted, [0.1, 0.2, 0.3])
+
+
+class FetchTests(TestCase):
+    """ Tests relating to fetching and parsing of feeds. """
+
+    def setUp(self):
+        self.rss_url = reverse('rss_all')
+        self.atom_url = reverse('atom_all')
+
+    def test_rijksoverheid(self):
+        """ Test feed from Rijksoverheid. """
+
+        # Test one feed
+        feed = Feed(
+            url='http://feeds.rijksoverheid.nl/onderwerpen/telecomgegevens-'
+                'voor-opsporing/documenten-en-publicaties.rss')
+
+        # Save and fetch
+        feed.save()
+
+        # Assert entries are present
+        self.assertTrue(feed.entries.exists())
+
+        # Test requesting the aggregate RSS and Atom feed
+        response = self.client.get(self.rss_url)
+        parsed = feedparser.parse(response.content)
+        self.assertEquals(feed.entries.count(), len(parsed.entries))
+
+        response = self.client.get(self.atom_url)
+        parsed = feedparser.parse(response.content)
+        self.assertEquals(feed.entries.count(), len(parsed.entries))
+
+    def test_nrc(self):
+        """ Test feed for NRC Handelsblad. """
+
+        # Test one feed
+        feed = Feed(url='http://www.nrc.nl/rss.php')
+
+        # Save and fetch
+        feed.save()
+
+        # Assert entries are present
+        self.assertTrue(feed.entries.exists())
+
+        # Assert some author is present
+        self.assertTrue(feed.entries.exclude(author=None).exists())
+
+        # Asssert some content is present
+        self.assertTrue(feed.entries.filter(content__isnull=False).exists())
+
+        # Asssert some enclosures are present
+        self.assertTrue(feed.entries.filter(enclosures__isnull=False).exists())
+
+        # Test requesting the aggregate RSS and Atom feed
+        response = self.client.get(self.rss_url)
+        parsed = feedparser.parse(response.content)
+        self.assertEquals(feed.entries.count(), len(parsed.entries))
+
+        response = self.client.get(self.atom_url)
+        parsed = feedparser.parse(response.content)
+        self.assertEquals(feed.entries.count(), len(parsed.entries))
+
+        # Assert some enclosure is found
+        enclosure_found = False
+        for entry in parsed.entries:
+            if entry.enclosures and entry.enclosures[0].href:
+                enclosure_found = True
+
+        self.assertTrue(enclosure_found)
+
+    def test_nrc_noduplicate_contentenclosures(self):
+        """
+        Test whether there is no double extraction of content and/or
+        enclosures.
+        """
+        feed = Feed(url='http://www.nrc.nl/rss.php')
+        feed.save()
+
+        # Keep the count for comparison
+        enclosure_count = FeedEnclosure.objects.count()
+        content_count = FeedContent.objects.count()
+        self.assertTrue(enclosure_count)
+        self.assertTrue(content_count)
+
+        # Update the feed's data - make sure last modified and etag are disabled
+        feed.modified = ''
+        feed.etag = ''
+        feed.updated = None
+        feed.next_crawl = None
+        feed.save()
+
+        update_feeds()
+
+        # Make sure there's still the same number of objects
+        self.assertEquals(enclosure_count, FeedEnclosure.objects.count())
+        self.assertEquals(content_count, FeedContent.objects.count())
+
+    def test_nytimes(self):
+        """ Test feed for NYTimes. """
+
+        # Test one feed
+        feed = Feed(
+            url='http://www.nytimes.com/services/xml/rss/nyt/GlobalHome.xml')
+
+        # Save and fetch
+        feed.save()
+
+        # Assert entries are present
+        self.assertTrue(feed.entries.exists())
+
+        # Assert some author is present
+        self.assertTrue(feed.entries.exclude(author=None).exists())
+
+        # Test requesting the aggregate RSS and Atom feed
+        response = self.client.get(self.rss_url)
+        parsed = feedparser.parse(response.content)
+        self.assertEquals(feed.entries.count(), len(parsed.entries))
+
+        response = self.client.get(self.atom_url)
+        parsed = feedparser.parse(response.content)
+        self.assertEquals(feed.entries.count(), len(parsed.entries))
+
+    def test_nos_podcast(self):
+        """ Test podcast NOS Buitenland. """
+
+        # Test one feed
+        feed = Feed(url='http://feeds.nos.nl/nospodcastbuitenland')
+
+        # Save and fetch
+        feed.save()
+
+        # Assert entries are present
+        self.assertTrue(feed.entries.exists())
+
+        # Asssert some enclosures are present
+        self.assertTrue(feed.entries.filter(enclosures__isnull=False).exists())
+
+        # Test requesting the aggregate RSS and Atom feed
+        response = self.client.get(self.rss_url)
+        parsed = feedparser.parse(response.content)
+        self.assertEquals(feed.entries.count(), len(parsed.entries))
+
+        response = self.client.get(self.atom_url)
+        parsed = feedparser.parse(response.content)
+        self.assertEquals(feed.entries.count(), len(parsed.entries))
+
+    def test_aggregate(self):
+        """ Test multiple feed aggregation. """
+
+        # NRC
+        url1 = 'http://www.nrc.nl/rss.php'
+        feed1 = Feed(url=url1)
+        feed1.save()
+
+        # NOS
+        url2 = 'http://feeds.nos.nl/nospodcastbuitenland'
+        feed2 = Feed(url=url2)
+        feed2.save()
+
+        # Assert entries are present
+        self.assertTrue(FeedEntry.objects.exists())
+
+        # Assert total entries is both feed's entries combined
+        self.assertEquals(
+            FeedEntry.objects.count(),
+            feed1.entries.count() + feed2.entries.count()
+        )
+
+        # Assert some author is present
+        self.assertTrue(
+            FeedEntry.objects.exclude(author=None).exists())
+
+        # Asssert some content is present
+        self.assertTrue(
+            FeedEntry.objects.filter(content__isnull=False).exists())
+
+        # Asssert some enclosures are present
+        self.assertTrue(
+            FeedEntry.objects.filter(enclosures__isnull=False).exists())
+
+        # Test requesting the aggregate RSS and Atom feed
+        response = self.client.get(self.rss_url)
+        parsed1 = feedparser.parse(response.content)
+        self.assertEquals(FeedEntry.objects.count(), len(parsed1.entries))
+
+        response = self.client.get(self.atom_url)
+        parsed2 = feedparser.parse(response.content)
+        self.assertEquals(FeedEntry.objects.count(), len(parsed2.entries))
+
+        # Make sure at least one entry has an enclosure in both formats
+        # Also, check the source reference for each entry
+        enclosures = False
+        content = False
+        for parsed in [parsed1, parsed2]:
+            for entry in parsed.entries:
+                # Assert for presence of source element
+                self.assertIn('source', entry)
+                self.assertIn('title', entry.source)
+                self.assertTrue(entry.source.title)
+
+                self.assertIn('href', entry.source)
+                self.assertIn(entry.source.href, [url1, url2])
+
+                # At least one should have an enclosure or content (for now)
+                if 'enclosures' in entry and len(entry.enclosures):
+                    enclosures = True
+
+                if 'content' in entry and len(entry.content):
+                    content = True
+
+            self.assertTrue(enclosures)
+            self.assertTrue(content)
+
+
+class BofFeedsTests(TestCase):
+    """ Test fetching all feeds in the Bits of Freedom fixture. """
+
+    fixtures = ['feeds_bof']
+
+    def test_fetch(self):
+        """
+        Update some BOF feeds and make some basic assertions about them.
+
+        This is mostly an integration test to see whether no exceptions are
+        occurring.
+        """
+        update_feeds()
+
+        # Assert entries have been imported
+        self.assertTrue(FeedEntry.objects.exists())
+
+        # At least some feeds should have a title and summary
+        self.assertTrue(FeedEntry.objects.exclude(title=None).exists())
+        self.assertTrue(FeedEntry.objects.exclude(summary=None).exists())
+
+        # Perform checks on feeds for which all entries have updated set
+        updated_feeds = Feed.objects.filter(active=True)
+
+        # Make sure activated feeds exist in the first place
+        self.assertTrue(updated_feeds.exists())
+
+        # Make sure some feeds have updated set
+        self.assertTrue(updated_feeds.filter(updated__isnull=False).exists())
+
+        # Make sure some feeds have received a modified header
+        self.assertTrue(updated_feeds.exclude(modified='').exists())
+
+        # Assert some entries exist for feeds
+        self.assertTrue(
+            FeedEntry.objects.filter(feed__in=updated_feeds).exists())
+
+
+class RegexFilterTests(TestCase):
+    """ Test the text filter logic. """
+
+    # Some real texts to work with
+    text_1 = (
+        'Reactie van het Centraal Informatiepunt Onderzoek Telecommunicatie '
+        '(CIOT) op het auditrapport &apos;Eindrapport audit CIOT 2011&apos; '
+        'van 25 september 2012.'
+    )
+
+    text_2 = 'Antwoorden kamervragen over de privacy van internetters'
+
+    text_3 = (
+        'Getapte telefoongesprekken tussen verdachten en hun advocaten worden '
+        'vanaf volgend jaar automatisch vernietigd. Door een technische '
+        'voorziening bij de politie worden de zogenoemde '
+        'geheimhoudersgesprekken die plaatsvinden tussen een verdachte -die '
+        'in het kader van een strafrechtelijk onderzoek door de politie wordt '
+        'getapt- en zijn/haar advocaat, meteen vernietigd en dus niet '
+        'opgenomen of afgeluisterd. De advocaat moet daarvoor wel gebruik '
+        'maken van vooraf vastgestelde telefoonnummer(s) die bekend zijn bij '
+        'de politie. Deze werkwijze betekent dat het vertrouwelijke karakter '
+        'van deze gesprekken maximaal wordt gewaarborgd. Dat blijkt uit een '
+        'vandaag verschenen brief van minister Hirsch Ballin van Justitie aan '
+        'de Tweede Kamer.'
+    )
+
+    def test_filter_text_single(self):
+        """ Test filter_text with a single keyword. """
+
+        self.assertTrue(keywords_to_regex('kamervragen').search(self.text_2))
+
+        # Matches should be case sensitive, if requested
+        # We check in the tests whether case sensitivity is enabled,
+        # as overriding the settings is broken.
+        if settings.NEWSPEAK_CASE_SENSITIVE:
+            self.assertTrue(keywords_to_regex('Reactie').search(self.text_1))
+            self.assertFalse(keywords_to_regex('reactie').search(self.text_1))
+
+        # Make sure punctuation marks are not counted
+        self.assertTrue(keywords_to_regex('afgeluisterd').search(self.text_3))
+
+    def test_filter_text_three(self):
+        """ Test filter_text with three keywords. """
+        keywords = 'kamervragen, internetters, Reactie'
+        pattern = keywords_to_regex(keywords)
+
+        self.assertTrue(pattern.search(self.text_1))
+        self.assertTrue(pattern.search(self.text_2))
+        self.assertFalse(pattern.search(self.text_3))
+
+    def test_filter_text_single_wildcard(self):
+        """ Test filter_text with single keyword and wildcards. """
+
+        self.assertTrue(keywords_to_regex('kamer*').search(self.text_2))
+
+        self.assertTrue(keywords_to_regex('*eactie').search(self.text_1))
+
+        self.assertFalse(keywords_to_regex('hottentottenhutten*').search(self.text_1))
+        self.assertFalse(keywords_to_regex('priv*').search(self.text_1))
+
+        self.assertTrue(keywords_to_regex('*getapt*').search(self.text_3))
+
+    def test_filter_text_three_wildcard(self):
+        """ Test filter_text with three keywords and wildcards. """
+
+        keywords = '*vragen, inter*etters, ?eactie'
+        pattern = keywords_to_regex(keywords)
+
+        self.assertTrue(pattern.search(self.text_1))
+        self.assertTrue(pattern.search(self.text_2))
+        self.assertFalse(pattern.search(self.text_3))
+
+
+class LRUCacheTests(TestCase):
+    """ Test the bounded cache for compiled regexes. """
+
+    def test_eviction(self):
+        """ The least recently used item is evicted first. """
+
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+
+        # Use a, making b the least recently used
+        self.assertEquals(cache.get('a'), 1)
+
+        cache.set('c', 3)
+
+        self.assertEquals(len(cache), 2)
+        self.assertEquals(cache.get('b'), None)
+        self.assertEquals(cache.get('a'), 1)
+        self.assertEquals(cache.get('c'), 3)
+
+        self.assertEquals(cache.info()['hits'], 3)
+        self.assertEquals(cache.info()['misses'], 1)
+
+    def test_invalidation(self):
+        """ Saving or deleting a filter clears the regex cache. """
+
+        keywords_to_regex('kamervragen')
+        self.assertTrue(len(keywords_to_regex.cache))
+
+        keyword_filter = KeywordFilter.objects.create(
+            name='test_filter', keywords='kamervragen'
+        )
+        self.assertFalse(len(keywords_to_regex.cache))
+
+        keywords_to_regex('kamervragen')
+        self.assertTrue(len(keywords_to_regex.cache))
+
+        keyword_filter.delete()
+        self.assertFalse(len(keywords_to_regex.cache))
+
+
+class EntryFilterTests(TestCase):
+    """ Test the entry filter logic. """
+
+    entry_1 = Mock(**{
+        'title': u'Toezegging CIOT bevragingen',
+        'summary': u''
+    })
+
+    entry_2 = Mock(**{
+        'title': (
+            u'Reactie CIOT op \'Eindrapport audit CIOT 2011\' van '
+            u'25 september 2012'
+        ),
+        'summary': (
+            u'Reactie van het Centraal Informatiepunt Onderzoek '
+            u'Telecommunicatie (CIOT) op het auditrapport \'Eindrapport '
+            u'audit CIOT 2011\' van 25 september 2012.'
+        )
+    })
+
+    entry_3 = Mock(**{
+        'title': (
+            u'Indexering tarieven Regeling kosten aftappen en '
+            u'gegevensverstrekking - 1 juni 2012 tot 1 juni 2013'
+        ),
+        'summary': (
+            u'Regeling omtrent de indicatieve tarieven voor de periode van '
+            u'1 juni 2012 tot 1 juni 2013, genoemd in de bijlage bij de '
+            u'Regeling kosten aftappen en gegevensverstrekking.'
+        )
+    })
+
+    def setUp(self):
+        """ Make sure a single feed is available for adding filters. """
+
+        self.feed = Feed(
+            url='http://feeds.rijksoverheid.nl/onderwerpen/telecomgegevens-'
+                'voor-opsporing/documenten-en-publicaties.rss')
+
+        # Save and fetch
+        self.feed.save()
+
+    def test_single_inclusive(self):
+        """ Test with a single inclusive filter on title and summary. """
+
+        test_filter = KeywordFilter(
+            name='test_filter',
+            keywords='CIOT'
+        )
+        test_filter.save()
+
+        self.feed.filters.add(test_filter)
+
+        self.assertTrue(filter_entry(self.feed, self.entry_1))
+        self.assertTrue(filter_entry(self.feed, self.entry_2))
+        self.assertFalse(filter_entry(self.feed, self.entry_3))
+
+    def test_single_exclusive(self):
+        """ Test with a single exclusive filter on title and summary. """
+
+        test_filter = KeywordFilter(
+            name='test_filter',
+            keywords='CIOT',
+            filter_inclusive=False
+        )
+        test_filter.save()
+
+        self.feed.filters.add(test_filter)
+
+        self.assertFalse(filter_entry(self.feed, self.entry_1))
+        self.assertFalse(filter_entry(self.feed, self.entry_2))
+        self.assertTrue(filter_entry(self.feed, self.entry_3))
+
+    def test_single_title_inclusive(self):
+        """ Test with a single inclusive filter on just the title. """
+
+        test_filter = KeywordFilter(
+            name='test_filter',
+            keywords='Indexering'
+        )
+        test_filter.save()
+
+        self.feed.filters.add(test_filter)
+
+        self.assertFalse(filter_entry(self.feed, self.entry_1))
+        self.assertFalse(filter_entry(self.feed, self.entry_2))
+        self.assertTrue(filter_entry(self.feed, self.entry_3))
+
+    def test_single_summary_inclusive(self):
+        """ Test with a single inclusive filter on just the title. """
+
+        test_filter = KeywordFilter(
+            name='test_filter',
+            keywords='2012'
+        )
+        test_filter.save()
+
+        self.feed.filters.add(test_filter)
+
+        self.assertFalse(filter_entry(self.feed, self.entry_1))
+        self.assertTrue(filter_entry(self.feed, self.entry_2))
+        self.assertTrue(filter_entry(self.feed, self.entry_3))
+
+
+class CrawlQueueTests(TestCase):
+    """ Test queueing new feeds for a background crawl. """
+
+    @override_settings(NEWSPEAK_QUEUE_NEW_FEEDS=True)
+    def test_queue(self):
+        """ New feeds are queued rather than crawled on save. """
+
+        with patch('newspeak.crawler.update_feed') as update_feed:
+            feed = Feed.objects.create(url='http://example.com/feed.rss')
+
+            self.assertFalse(update_feed.called)
+
+            # Saving again does not queue the feed twice
+            feed.save()
+            CrawlRequest.enqueue(feed)
+
+            self.assertEquals(CrawlRequest.objects.count(), 1)
+
+            process_queue()
+
+            self.assertEquals(update_feed.call_count, 1)
+            self.assertEquals(update_feed.call_args[0][0], feed)
+
+        self.assertFalse(CrawlRequest.objects.exists())
+
+    @override_settings(NEWSPEAK_QUEUE_NEW_FEEDS=True)
+    def test_claims(self):
+        """ Queued feeds are claimed, inactive feeds are not crawled. """
+
+        feeds = [
+            Feed.objects.create(url='http://%s.example.com/1.rss' % host)
+            for host in 'abc'
+        ]
+
+        # Claimed by another crawler
+        claim_candidates([feeds[1].pk], 'other')
+
+        feeds[2].active = False
+        feeds[2].save()
+
+        with patch('newspeak.crawler.update_feed') as update_feed:
+            process_queue()
+
+        self.assertEquals(
+            [args[0][0] for args in update_feed.call_args_list], [feeds[0]]
+        )
+
+        # Feeds claimed by others remain queued
+        self.assertEquals(
+            [crawl_request.feed for crawl_request in CrawlRequest.objects.all()],
+            [feeds[1]]
+        )
+
+
+class SchedulingTests(TestCase):
+    """ Test adaptive scheduling of feed crawls. """
+
+    def setUp(self):
+        """ Create a feed without fetching it. """
+
+        with patch('newspeak.crawler.update_feed'):
+            self.feed = Feed.objects.create(url='http://example.com/feed.rss')
+
+    def test_backoff(self):
+        """ Unchanged and failing feeds back off, up to the maximum. """
+
+        schedule_feed(self.feed)
+        interval = self.feed.crawl_interval
+
+        self.assertEquals(interval, settings.NEWSPEAK_CRAWL_INTERVAL_MIN)
+        self.assertTrue(self.feed.next_crawl > self.feed.last_crawl)
+
+        schedule_feed(self.feed)
+        self.assertTrue(self.feed.crawl_interval > interval)
+        interval = self.feed.crawl_interval
+
+        schedule_feed(self.feed, error=True)
+        self.assertTrue(self.feed.crawl_interval > interval)
+
+        for attempt in range(100):
+            schedule_feed(self.feed, error=True)
+
+        self.assertEquals(
+            self.feed.crawl_interval, settings.NEWSPEAK_CRAWL_INTERVAL_MAX
+        )
+
+        # Scheduling is stored
+        self.assertEquals(
+            Feed.objects.get(pk=self.feed.pk).next_crawl, self.feed.next_crawl
+        )
+
+    def test_changes(self):
+        """ The interval moves towards the observed update interval. """
+
+        self.feed.crawl_interval = settings.NEWSPEAK_CRAWL_INTERVAL_MAX
+
+        # A new entry every two hours
+        previous_updated = now() - timedelta(hours=2)
+        self.feed.updated = now()
+
+        schedule_feed(self.feed, 1, previous_updated=previous_updated)
+
+        self.assertEquals(self.feed.crawl_interval,
+            (settings.NEWSPEAK_CRAWL_INTERVAL_MAX + 2 * 3600) / 2
+        )
+
+    def test_due(self):
+        """ Only feeds which are due are crawled. """
+
+        with patch('newspeak.crawler.update_feed') as update_feed:
+            update_feeds()
+            self.assertEquals(update_feed.call_count, 1)
+
+            self.feed.next_crawl = now() + timedelta(hours=1)
+            self.feed.save()
+
+            update_feeds()
+            self.assertEquals(update_feed.call_count, 1)
+
+            update_feeds(force=True)
+            self.assertEquals(update_feed.call_count, 2)
+
+
+class DueFeedsTests(TestCase):
+    """ Test selection and ordering of feeds due for crawling. """
+
+    def test_spread_by_host(self):
+        """ Consecutive feeds are spread over hosts. """
+
+        feeds = [
+            Mock(url='http://a.example.com/1.rss'),
+            Mock(url='http://a.example.com/2.rss'),
+            Mock(url='http://a.example.com/3.rss'),
+            Mock(url='http://b.example.com/1.rss'),
+            Mock(url='https://C.example.com/1.rss'),
+            Mock(url='http://c.example.com/2.rss'),
+        ]
+
+        self.assertEquals(
+            [feed.url for feed in spread_by_host(feeds)], [
+                'http://a.example.com/1.rss',
+                'http://b.example.com/1.rss',
+                'https://C.example.com/1.rss',
+                'http://a.example.com/2.rss',
+                'http://c.example.com/2.rss',
+                'http://a.example.com/3.rss',
+            ]
+        )
+
+    def test_shard_by_host(self):
+        """ Feeds are divided over processes, keeping hosts together. """
+
+        feeds = [
+            Mock(url='http://a.example.com/1.rss'),
+            Mock(url='http://a.example.com/2.rss'),
+            Mock(url='http://a.example.com/3.rss'),
+            Mock(url='http://b.example.com/1.rss'),
+            Mock(url='http://c.example.com/1.rss'),
+            Mock(url='http://c.example.com/2.rss'),
+        ]
+
+        shards = shard_by_host(feeds, 2)
+
+        self.assertEquals(
+            [[feed.url for feed in shard] for shard in shards], [
+                ['http://a.example.com/1.rss', 'http://a.example.com/2.rss',
+                 'http://a.example.com/3.rss'],
+                ['http://c.example.com/1.rss', 'http://b.example.com/1.rss',
+                 'http://c.example.com/2.rss'],
+            ]
+        )
+
+        # No empty shards
+        self.assertEquals(len(shard_by_host(feeds[:1], 4)), 1)
+
+    def test_processes_stopping(self):
+        """ Stopping the parent process stops the crawler processes. """
+
+        def crawl_until_stopped(feeds, feed_total, progress, stopping):
+            deadline = time.time() + 10
+
+            while not stopping() and time.time() < deadline:
+                time.sleep(0.05)
+
+        feeds = [
+            Mock(url='http://a.example.com/1.rss'),
+            Mock(url='http://b.example.com/1.rss'),
+        ]
+
+        # As with a signal received by the parent process only
+        parent = os.getpid()
+
+        with patch('newspeak.crawler.crawl_feeds', crawl_until_stopped), \
+                patch('newspeak.crawler.close_connection'):
+            start = time.time()
+
+            crawl_feeds_processes(feeds, 2,
+                stopping=lambda: os.getpid() == parent
+            )
+            self.assertLess(time.time() - start, 5)
+
+    def test_due_feeds(self):
+        """ Due feeds are selected, most overdue first, in one query. """
+
+        with patch('newspeak.crawler.update_feed'):
+            feed_1 = Feed.objects.create(url='http://a.example.com/1.rss',
+                next_crawl=now() - timedelta(minutes=1))
+            feed_2 = Feed.objects.create(url='http://b.example.com/1.rss',
+                next_crawl=now() - timedelta(minutes=2))
+            Feed.objects.create(url='http://c.example.com/1.rss',
+                next_crawl=now() + timedelta(minutes=1))
+            Feed.objects.create(url='http://d.example.com/1.rss',
+                active=False)
+
+        with self.assertNumQueries(1):
+            self.assertEquals(get_due_feeds(), [feed_2, feed_1])
+
+
+class ClaimTests(TestCase):
+    """ Test concurrent crawlers claiming disjoint batches of feeds. """
+
+    def setUp(self):
+        with patch('newspeak.crawler.update_feed'):
+            self.feeds = [
+                Feed.objects.create(url='http://%s.example.com/1.rss' % host)
+                for host in 'abc'
+            ]
+
+    def test_claim_feeds(self):
+        """ Crawlers claim disjoint batches, expired claims are reclaimed. """
+
+        first = claim_feeds(batch_size=2)
+        second = claim_feeds(batch_size=2)
+
+        self.assertEquals(len(first), 2)
+        self.assertEquals(len(second), 1)
+        self.assertFalse(set(first) & set(second))
+        self.assertEquals(claim_feeds(), [])
+
+        # Claims are per crawler
+        self.assertNotEquals(first[0].claimed_by, second[0].claimed_by)
+
+        # Expired claims are claimed again
+        Feed.objects.filter(pk=second[0].pk).update(
+            claimed_until=now() - timedelta(seconds=1)
+        )
+        self.assertEquals(claim_feeds(), [second[0]])
+
+        # Crawling releases the claim
+        schedule_feed(first[0])
+
+        feed = Feed.objects.get(pk=first[0].pk)
+        self.assertEquals(feed.claimed_by, '')
+        self.assertEquals(feed.claimed_until, None)
+
+    def test_claim_taken_over(self):
+        """ Crawling does not release or overwrite claims of others. """
+
+        feed = claim_feeds(batch_size=1)[0]
+
+        # The claim expired and was taken over during the crawl
+        claimed_until = now() + timedelta(minutes=5)
+        Feed.objects.filter(pk=feed.pk).update(
+            claimed_by='other', claimed_until=claimed_until
+        )
+
+        with patch('newspeak.crawler.fetch_feed', side_effect=IOError):
+            update_feed(feed)
+
+        db_feed = Feed.objects.get(pk=feed.pk)
+        self.assertTrue(db_feed.error_state)
+        self.assertEquals(db_feed.claimed_by, 'other')
+        self.assertEquals(db_feed.claimed_until, claimed_until)
+
+    @override_settings(NEWSPEAK_CLAIM_DURATION=0.2, NEWSPEAK_THREADS=1)
+    def test_renew_claims(self):
+        """ Claims are renewed while a batch is crawled. """
+
+        feeds = claim_feeds()
+        valid = []
+
+        def update_feed(feed, filter_chains=None):
+            eventlet.sleep(0.15)
+
+            valid.append(
+                Feed.objects.get(pk=feed.pk).claimed_until > now()
+            )
+
+            return feed
+
+        with patch('newspeak.crawler.update_feed', update_feed):
+            crawl_feeds(feeds, len(feeds))
+
+        self.assertEquals(valid, [True] * len(feeds))
+
+        # Claims taken over by other crawlers are not renewed
+        Feed.objects.filter(pk=feeds[0].pk).update(
+            claimed_by='other', claimed_until=None
+        )
+        renew_claims(feeds)
+
+        self.assertEquals(Feed.objects.get(pk=feeds[0].pk).claimed_until, None)
+        self.assertTrue(Feed.objects.get(pk=feeds[1].pk).claimed_until > now())
+
+        # Nor released
+        release_claims(feeds)
+
+        self.assertEquals(Feed.objects.get(pk=feeds[0].pk).claimed_by, 'other')
+        self.assertEquals(Feed.objects.get(pk=feeds[1].pk).claimed_by, '')
+
+    @override_settings(NEWSPEAK_CLAIM_BATCH_SIZE=1)
+    def test_update_feeds(self):
+        """ All due feeds are crawled, batch by batch. """
+
+        def update_feed(feed, filter_chains=None):
+            schedule_feed(feed)
+
+            return feed
+
+        with patch('newspeak.crawler.update_feed', update_feed):
+            update_feeds()
+
+        self.assertFalse(Feed.objects.exclude(last_crawl=None).filter(
+            next_crawl__lte=now()
+        ).exists())
+        self.assertEquals(Feed.objects.filter(last_crawl=None).count(), 0)
+
+        # Forced crawls visit every feed once
+        crawled = []
+
+        def update_feed(feed, filter_chains=None):
+            crawled.append(feed)
+            schedule_feed(feed)
+
+            return feed
+
+        with patch('newspeak.crawler.update_feed', update_feed):
+            update_feeds(force=True)
+
+        self.assertEquals(
+            sorted(feed.pk for feed in crawled),
+            sorted(feed.pk for feed in self.feeds)
+        )
+
+
+class RetentionTests(TestCase):
+    """ Test pruning and archiving old entries. """
+
+    def setUp(self):
+        with patch('newspeak.crawler.update_feed'):
+            self.feed = Feed.objects.create(url='http://example.com/feed.rss')
+            self.kept_feed = Feed.objects.create(
+                url='http://example.com/kept.rss', retention_days=0
+            )
+            self.short_feed = Feed.objects.create(
+                url='http://example.com/short.rss', retention_days=1
+            )
+
+        for feed in (self.feed, self.kept_feed, self.short_feed):
+            for days in (0, 10, 100, 200):
+                entry = FeedEntry.objects.create(feed=feed,
+                    title=u'%d days old' % days,
+                    link=u'http://example.com/%d/%d' % (feed.pk, days),
+                    published=now() - timedelta(days=days, minutes=1)
+                )
+
+                FeedContent.objects.create(entry=entry,
+                    value=u'Content', mime_type='text/plain'
+                )
+                FeedEnclosure.objects.create(entry=entry,
+                    href=u'http://example.com/%d.pdf' % days, length=days,
+                    mime_type='application/pdf'
+                )
+
+        # A duplicate of an entry to be pruned
+        self.duplicate = self.kept_feed.entries.get(title=u'0 days old')
+        self.duplicate.duplicate_of = self.feed.entries.get(
+            title=u'200 days old'
+        )
+        self.duplicate.save()
+
+    def get_titles(self, feed):
+        return sorted(feed.entries.values_list('title', flat=True))
+
+    @override_settings(NEWSPEAK_RETENTION_DAYS=50)
+    def test_prune(self):
+        """ Entries older than the retention period are deleted. """
+
+        directory = tempfile.mkdtemp()
+
+        try:
+            path = os.path.join(directory, 'archive.jsonl.gz')
+
+            with patch('newspeak.retention.invalidate_feeds') as invalidate:
+                self.assertEquals(prune_entries(path, batch_size=2), 5)
+
+            self.assertEquals(invalidate.call_count, 1)
+
+            archived = [
+                json.loads(line) for line in gzip.open(path).readlines()
+            ]
+
+        finally:
+            shutil.rmtree(directory)
+
+        self.assertEquals(self.get_titles(self.feed),
+            [u'0 days old', u'10 days old']
+        )
+        self.assertEquals(len(self.get_titles(self.kept_feed)), 4)
+        self.assertEquals(self.get_titles(self.short_feed), [u'0 days old'])
+
+        self.assertEquals(FeedContent.objects.count(), 7)
+        self.assertEquals(FeedEnclosure.objects.count(), 7)
+
+        # Duplicates of deleted entries are shown again
+        self.assertEquals(
+            FeedEntry.objects.get(pk=self.duplicate.pk).duplicate_of, None
+        )
+
+        self.assertEquals(len(archived), 5)
+        self.assertEquals(
+            sorted(entry['title'] for entry in archived if
+                entry['feed'] == self.feed.url),
+            [u'100 days old', u'200 days old']
+        )
+        self.assertEquals(archived[0]['content'][0]['value'], u'Content')
+        self.assertEquals(archived[0]['enclosures'][0]['mime_type'],
+            u'application/pdf'
+        )
+
+    def test_command(self):
+        """ Without global retention period, only some feeds are pruned. """
+
+        call_command('prune_entries', batch_size=1)
+
+        self.assertEquals(len(self.get_titles(self.feed)), 4)
+        self.assertEquals(self.get_titles(self.short_feed), [u'0 days old'])
+
+
+class DaemonTests(TestCase):
+    """ Test continuous crawling and stopping it. """
+
+    def setUp(self):
+        with patch('newspeak.crawler.update_feed'):
+            self.feed = Feed.objects.create(url='http://example.com/1.rss')
+
+        self.crawled = []
+
+    def update_feed(self, feed, filter_chains=None):
+        self.crawled.append(feed)
+        schedule_feed(feed)
+
+        return feed
+
+    def test_stopping(self):
+        """ When stopping, claims on feeds not crawled are released. """
+
+        feeds = claim_feeds()
+
+        with patch('newspeak.crawler.update_feed', self.update_feed):
+            crawl_feeds(feeds, len(feeds), stopping=lambda: True)
+
+        self.assertEquals(self.crawled, [])
+        self.assertEquals(Feed.objects.get().claimed_until, None)
+
+    def test_crawl_continuously(self):
+        """ Queued and due feeds are crawled until stopped. """
+
+        CrawlRequest.enqueue(self.feed)
+
+        # Stop once the feed has been crawled
+        with patch('newspeak.crawler.update_feed', self.update_feed):
+            crawl_continuously(
+                stopping=lambda: bool(self.crawled), interval=0
+            )
+
+        # Crawled from the queue, after which it is no longer due
+        self.assertEquals(self.crawled, [self.feed])
+        self.assertFalse(CrawlRequest.objects.exists())
+
+        # Sleeps until the feed is due again
+        self.assertTrue(get_crawl_delay(3600) >
+            settings.NEWSPEAK_CRAWL_INTERVAL_MIN - 10
+        )
+
+
+class HostLimitTests(TestCase):
+    """ Test per-host concurrency limits and politeness. """
+
+    def test_limiter(self):
+        """ Concurrent requests per host are capped and spaced. """
+
+        limiter = HostLimiter(connections=2, delay=0.02)
+        concurrency = {'current': 0, 'max': 0}
+
+        def request(url):
+            with limiter.limit(url):
+                concurrency['current'] += 1
+                concurrency['max'] = max(
+                    concurrency['max'], concurrency['current']
+                )
+
+                eventlet.sleep(0.05)
+
+                concurrency['current'] -= 1
+
+        start = time.time()
+
+        pool = eventlet.GreenPool(10)
+        for number in range(5):
+            pool.spawn_n(request, 'http://example.com/%d' % number)
+        pool.waitall()
+
+        self.assertEquals(concurrency['max'], 2)
+
+        # The last request should have started at least 4 delays later
+        self.assertTrue(time.time() - start >= 0.08)
+
+    @override_settings(NEWSPEAK_HOST_CONNECTIONS=1, NEWSPEAK_THREADS=4)
+    def test_crawl_fairness(self):
+        """ Feeds of a single host do not occupy all threads. """
+
+        in_progress = {}
+        concurrency = {'max_host': 0, 'max': 0}
+
+        def update_feed(feed, **kwargs):
+            host = feed.url.split('/')[2]
+
+            in_progress[host] = in_progress.get(host, 0) + 1
+            concurrency['max_host'] = max(
+                concurrency['max_host'], in_progress[host]
+            )
+            concurrency['max'] = max(
+                concurrency['max'], sum(in_progress.values())
+            )
+
+            eventlet.sleep(0.01)
+
+            in_progress[host] -= 1
+
+            return feed
+
+        feeds = [
+            Mock(url='http://a.example.com/%d.rss' % number)
+            for number in range(8)
+        ] + [
+            Mock(url='http://%s.example.com/1.rss' % host)
+            for host in 'bcd'
+        ]
+
+        with patch('newspeak.crawler.update_feed', update_feed):
+            crawl_feeds(feeds, len(feeds))
+
+        self.assertEquals(concurrency['max_host'], 1)
+        self.assertEquals(concurrency['max'], 4)
+
+    def test_unlimited(self):
+        """ Hosts are not limited when connections are 0 or None. """
+
+        limiter = HostLimiter(connections=0, delay=0)
+
+        with eventlet.Timeout(1):
+            with limiter.limit('http://example.com/'):
+                pass
+
+        in_progress = {'current': 0, 'max': 0}
+
+        def update_feed(feed, **kwargs):
+            in_progress['current'] += 1
+            in_progress['max'] = max(
+                in_progress['max'], in_progress['current']
+            )
+
+            eventlet.sleep(0.01)
+
+            in_progress['current'] -= 1
+
+            return feed
+
+        feeds = [
+            Mock(url='http://a.example.com/%d.rss' % number)
+            for number in range(4)
+        ]
+
+        for connections in (0, None):
+            with self.settings(NEWSPEAK_HOST_CONNECTIONS=connections):
+                with patch('newspeak.crawler.update_feed', update_feed):
+                    with eventlet.Timeout(5):
+                        crawl_feeds(feeds, len(feeds))
+
+        self.assertEquals(in_progress['max'], 4)
+
+
+class FilterChainTests(TestCase):
+    """ Test precompiled filter chains. """
+
+    entry = Mock(**{
+        'title': u'Antwoorden kamervragen over de privacy van internetters',
+        'summary': u''
+    })
+
+    def setUp(self):
+        """ Create feeds and filters without fetching. """
+
+        with patch('newspeak.crawler.update_feed'):
+            self.feed_1 = Feed.objects.create(url='http://example.com/1.rss')
+            self.feed_2 = Feed.objects.create(url='http://example.com/2.rss')
+            self.feed_3 = Feed.objects.create(url='http://example.com/3.rss')
+
+        self.include_filter = KeywordFilter.objects.create(
+            name='include', keywords='kamer*'
+        )
+        self.exclude_filter = KeywordFilter.objects.create(
+            name='exclude', keywords='privacy', filter_inclusive=False
+        )
+
+        self.feed_1.filters.add(self.exclude_filter, self.include_filter)
+        self.feed_2.filters.add(self.include_filter, self.exclude_filter)
+        self.feed_3.filters.add(self.include_filter)
 
-        # Assert entries are present
-        self.assertTrue(FeedEntry.objects.exists())
+    def test_ordering(self):
+        """ Filters are applied in order of sort_order. """
+
+        chain = FilterChain.for_feed(self.feed_1)
 
-        # Assert total entries is both feed's entries combined
         self.assertEquals(
-            FeedEntry.objects.count(),
-            feed1.entries.count() + feed2.entries.count()
+            chain.filters, [self.include_filter, self.exclude_filter]
         )
 
-        # Assert some author is present
-        self.assertTrue(
-            FeedEntry.objects.exclude(author=None).exists())
+    def test_matcher(self):
+        """ Test matching many filters in a single scan. """
+
+        filters = [
+            KeywordFilter.objects.create(name=str(number), keywords=keywords)
+            for (number, keywords) in enumerate([
+                'kamervragen, internetters',
+                '*vragen',
+                'inter*etters, ?eactie',
+                'hottentottenhutten*',
+                'privacy van',
+                'priv.cy',
+                'kamer?',
+                'Antwoord',
+            ])
+        ]
+
+        matcher = KeywordMatcher(filters, case_sensitive=True)
+        matched = matcher.match(self.entry.title)
+
+        # Result should be equal to that of the regular expressions
+        for feed_filter in filters:
+            self.assertEquals(
+                feed_filter in matched,
+                bool(keywords_to_regex(feed_filter.keywords).search(
+                    self.entry.title
+                )),
+                feed_filter.keywords
+            )
 
-        # Asssert some content is present
-        self.assertTrue(
-            FeedEntry.objects.filter(content__isnull=False).exists())
+        self.assertEquals(
+            set(filter.name for filter in matched),
+            set(['0', '1', '2', '4', '5', '6', '7'])
+        )
 
-        # Asssert some enclosures are present
-        self.assertTrue(
-            FeedEntry.objects.filter(enclosures__isnull=False).exists())
+        # Case insensitive
+        matcher = KeywordMatcher(filters[-1:], case_sensitive=False)
+        self.assertTrue(matcher.match(u'ANTWOORDEN'))
 
-        # Test requesting the aggregate RSS and Atom feed
-        response = self.client.get(self.rss_url)
-        parsed1 = feedparser.parse(response.content)
-        self.assertEquals(FeedEntry.objects.count(), len(parsed1.entries))
+    def test_cache(self):
+        """ Feeds with the same filters share a chain, without queries. """
 
-        response = self.client.get(self.atom_url)
-        parsed2 = feedparser.parse(response.content)
-        self.assertEquals(FeedEntry.objects.count(), len(parsed2.entries))
+        with self.assertNumQueries(2):
+            cache = FilterChainCache()
 
-        # Make sure at least one entry has an enclosure in both formats
-        # Also, check the source reference for each entry
-        enclosures = False
-        content = False
-        for parsed in [parsed1, parsed2]:
-            for entry in parsed.entries:
-                # Assert for presence of source element
-                self.assertIn('source', entry)
-                self.assertIn('title', entry.source)
-                self.assertTrue(entry.source.title)
+        with self.assertNumQueries(0):
+            chain_1 = cache.get(self.feed_1)
+            chain_2 = cache.get(self.feed_2)
+            chain_3 = cache.get(self.feed_3)
 
-                self.assertIn('href', entry.source)
-                self.assertIn(entry.source.href, [url1, url2])
+            # The inclusive filter matches first
+            self.assertTrue(chain_1.filter(self.entry))
+            self.assertTrue(chain_3.filter(self.entry))
 
-                # At least one should have an enclosure or content (for now)
-                if 'enclosures' in entry and len(entry.enclosures):
-                    enclosures = True
+        self.assertIs(chain_1, chain_2)
+        self.assertIsNot(chain_1, chain_3)
+        self.assertEquals(len(chain_3), 1)
 
-                if 'content' in entry and len(entry.content):
-                    content = True
 
-            self.assertTrue(enclosures)
-            self.assertTrue(content)
+class UpdateEntriesTests(TestCase):
+    """ Test matching and batched writing of feed entries. """
 
+    def setUp(self):
+        """ Create a feed without fetching it. """
 
-class BofFeedsTests(TestCase):
-    """ Test fetching all feeds in the Bits of Freedom fixture. """
+        with patch('newspeak.crawler.update_feed'):
+            self.feed = Feed.objects.create(url='http://example.com/feed.rss')
 
-    fixtures = ['feeds_bof']
+    def make_entry(self, number, **kwargs):
+        """ Return a parsed entry as feedparser would. """
 
-    def test_fetch(self):
-        """
-        Update some BOF feeds and make some basic assertions about them.
+        entry = feedparser.FeedParserDict(
+            title=u'Entry %d' % number,
+            link=u'http://example.com/entry/%d' % number,
+            summary=u'Summary of entry %d' % number,
+            published_parsed=time.gmtime(1350000000 + number)
+        )
+        entry.update(kwargs)
 
-        This is mostly an integration test to see whether no exceptions are
-        occurring.
-        """
-        update_feeds()
+        return entry
 
-        # Assert entries have been imported
-        self.assertTrue(FeedEntry.objects.exists())
+    def test_create(self):
+        """ Test creating entries in batch. """
 
-        # At least some feeds should have a title and summary
-        self.assertTrue(FeedEntry.objects.exclude(title=None).exists())
-        self.assertTrue(FeedEntry.objects.exclude(summary=None).exists())
+        entries = [
+            self.make_entry(number, id=u'urn:entry:%d' % number)
+            for number in range(10)
+        ]
+        update_entries(self.feed, entries)
 
-        # Perform checks on feeds for which all entries have updated set
-        updated_feeds = Feed.objects.filter(active=True)
+        self.assertEquals(self.feed.entries.count(), 10)
 
-        # Make sure activated feeds exist in the first place
-        self.assertTrue(updated_feeds.exists())
+        # Updating again should not yield duplicates
+        update_entries(self.feed, entries)
 
-        # Make sure some feeds have updated set
-        self.assertTrue(updated_feeds.filter(updated__isnull=False).exists())
+        self.assertEquals(self.feed.entries.count(), 10)
 
-        # Make sure some feeds have received a modified header
-        self.assertTrue(updated_feeds.exclude(modified='').exists())
+    def test_author(self):
+        """ The author is copied from the feed entry, when available. """
 
-        # Assert some entries exist for feeds
-        self.assertTrue(
-            FeedEntry.objects.filter(feed__in=updated_feeds).exists())
+        update_entries(self.feed, [
+            self.make_entry(1, author=u'Bits of Freedom'), self.make_entry(2)
+        ])
 
+        self.assertEquals(self.feed.entries.get(
+            link=u'http://example.com/entry/1').author, u'Bits of Freedom'
+        )
+        self.assertEquals(self.feed.entries.get(
+            link=u'http://example.com/entry/2').author, u''
+        )
 
-class RegexFilterTests(TestCase):
-    """ Test the text filter logic. """
+        update_entries(self.feed, [self.make_entry(1, author=u'Someone')])
 
-    # Some real texts to work with
-    text_1 = (
-        'Reactie van het Centraal Informatiepunt Onderzoek Telecommunicatie '
-        '(CIOT) op het auditrapport &apos;Eindrapport audit CIOT 2011&apos; '
-        'van 25 september 2012.'
-    )
+        self.assertEquals(self.feed.entries.get(
+            link=u'http://example.com/entry/1').author, u'Someone'
+        )
 
-    text_2 = 'Antwoorden kamervragen over de privacy van internetters'
+    def test_update_by_id(self):
+        """ Test updating existing entries matched by entry ID. """
 
-    text_3 = (
-        'Getapte telefoongesprekken tussen verdachten en hun advocaten worden '
-        'vanaf volgend jaar automatisch vernietigd. Door een technische '
-        'voorziening bij de politie worden de zogenoemde '
-        'geheimhoudersgesprekken die plaatsvinden tussen een verdachte -die '
-        'in het kader van een strafrechtelijk onderzoek door de politie wordt '
-        'getapt- en zijn/haar advocaat, meteen vernietigd en dus niet '
-        'opgenomen of afgeluisterd. De advocaat moet daarvoor wel gebruik '
-        'maken van vooraf vastgestelde telefoonnummer(s) die bekend zijn bij '
-        'de politie. Deze werkwijze betekent dat het vertrouwelijke karakter '
-        'van deze gesprekken maximaal wordt gewaarborgd. Dat blijkt uit een '
-        'vandaag verschenen brief van minister Hirsch Ballin van Justitie aan '
-        'de Tweede Kamer.'
-    )
+        update_entries(self.feed, [
+            self.make_entry(1, id=u'urn:entry:1'),
+            self.make_entry(2, id=u'urn:entry:2')
+        ])
 
-    def test_filter_text_single(self):
-        """ Test filter_text with a single keyword. """
+        update_entries(self.feed, [
+            self.make_entry(1, id=u'urn:entry:1', title=u'Changed'),
+            self.make_entry(3, id=u'urn:entry:3')
+        ])
 
-        self.assertTrue(keywords_to_regex('kamervragen').search(self.text_2))
+        self.assertEquals(self.feed.entries.count(), 3)
+        self.assertEquals(
+            self.feed.entries.get(entry_id=u'urn:entry:1').title, u'Changed'
+        )
 
-        # Matches should be case sensitive, if requested
-        # We check in the tests whether case sensitivity is enabled,
-        # as overriding the settings is broken.
-        if settings.NEWSPEAK_CASE_SENSITIVE:
-            self.assertTrue(keywords_to_regex('Reactie').search(self.text_1))
-            self.assertFalse(keywords_to_regex('reactie').search(self.text_1))
+    def test_update_by_link(self):
+        """ Test updating existing entries matched by link. """
 
-        # Make sure punctuation marks are not counted
-        self.assertTrue(keywords_to_regex('afgeluisterd').search(self.text_3))
+        update_entries(self.feed, [self.make_entry(1), self.make_entry(2)])
+        update_entries(self.feed, [self.make_entry(1, title=u'Changed')])
 
-    def test_filter_text_three(self):
-        """ Test filter_text with three keywords. """
-        keywords = 'kamervragen, internetters, Reactie'
-        pattern = keywords_to_regex(keywords)
+        self.assertEquals(self.feed.entries.count(), 2)
+        self.assertEquals(
+            self.feed.entries.get(link=u'http://example.com/entry/1').title,
+            u'Changed'
+        )
 
-        self.assertTrue(pattern.search(self.text_1))
-        self.assertTrue(pattern.search(self.text_2))
-        self.assertFalse(pattern.search(self.text_3))
+    def test_update_changed(self):
+        """ Changed entries and contents are updated without saving them. """
 
-    def test_filter_text_single_wildcard(self):
-        """ Test filter_text with single keyword and wildcards. """
+        content = [feedparser.FeedParserDict(
+            type=u'text/plain', language=u'', value=u'Content'
+        )]
 
-        self.assertTrue(keywords_to_regex('kamer*').search(self.text_2))
+        update_entries(self.feed, [
+            self.make_entry(1, content=content), self.make_entry(2)
+        ])
 
-        self.assertTrue(keywords_to_regex('*eactie').search(self.text_1))
+        content[0].value = u'Changed content'
+        receiver = Mock()
 
-        self.assertFalse(keywords_to_regex('hottentottenhutten*').search(self.text_1))
-        self.assertFalse(keywords_to_regex('priv*').search(self.text_1))
+        post_save.connect(receiver)
 
-        self.assertTrue(keywords_to_regex('*getapt*').search(self.text_3))
+        try:
+            update_entries(self.feed, [
+                self.make_entry(1, title=u'Changed', content=content),
+                self.make_entry(2)
+            ])
+        finally:
+            post_save.disconnect(receiver)
 
-    def test_filter_text_three_wildcard(self):
-        """ Test filter_text with three keywords and wildcards. """
+        self.assertFalse(receiver.called)
 
-        keywords = '*vragen, inter*etters, ?eactie'
-        pattern = keywords_to_regex(keywords)
+        entry = self.feed.entries.get(link=u'http://example.com/entry/1')
+        self.assertEquals(entry.title, u'Changed')
+        self.assertEquals(entry.summary, u'Summary of entry 1')
+        self.assertEquals(entry.content.get().value, u'Changed content')
 
-        self.assertTrue(pattern.search(self.text_1))
-        self.assertTrue(pattern.search(self.text_2))
-        self.assertFalse(pattern.search(self.text_3))
+    def test_duplicates(self):
+        """ Entries for pages stored before are linked, not shown again. """
 
+        with patch('newspeak.crawler.update_feed'):
+            other_feed = Feed.objects.create(
+                url='http://example.com/other.rss'
+            )
 
-class EntryFilterTests(TestCase):
-    """ Test the entry filter logic. """
+        update_entries(self.feed, [self.make_entry(1), self.make_entry(2)])
+        update_entries(other_feed, [
+            self.make_entry(1, id=u'urn:entry:1',
+                link=u'HTTP://Example.com:80/entry/1?utm_source=rss#top'
+            ),
+            self.make_entry(3)
+        ])
 
-    entry_1 = Mock(**{
-        'title': u'Toezegging CIOT bevragingen',
-        'summary': u''
-    })
+        original = self.feed.entries.get(link=u'http://example.com/entry/1')
+        duplicate = other_feed.entries.get(entry_id=u'urn:entry:1')
 
-    entry_2 = Mock(**{
-        'title': (
-            u'Reactie CIOT op \'Eindrapport audit CIOT 2011\' van '
-            u'25 september 2012'
-        ),
-        'summary': (
-            u'Reactie van het Centraal Informatiepunt Onderzoek '
-            u'Telecommunicatie (CIOT) op het auditrapport \'Eindrapport '
-            u'audit CIOT 2011\' van 25 september 2012.'
+        self.assertEquals(duplicate.duplicate_of, original)
+        self.assertEquals(
+            FeedEntry.objects.filter(duplicate_of=None).count(), 3
         )
-    })
 
-    entry_3 = Mock(**{
-        'title': (
-            u'Indexering tarieven Regeling kosten aftappen en '
-            u'gegevensverstrekking - 1 juni 2012 tot 1 juni 2013'
-        ),
-        'summary': (
-            u'Regeling omtrent de indicatieve tarieven voor de periode van '
-            u'1 juni 2012 tot 1 juni 2013, genoemd in de bijlage bij de '
-            u'Regeling kosten aftappen en gegevensverstrekking.'
+        # Shown once in aggregated feeds, but in the feed it belongs to
+        cache.clear()
+
+        response = self.client.get(reverse('rss_all'))
+        self.assertEquals(response.content.count('<title>Entry 1</title>'), 1)
+
+        response = self.client.get(
+            reverse('rss_feed', kwargs={'feed_id': other_feed.pk})
         )
-    })
+        self.assertIn('<title>Entry 1</title>', response.content)
 
-    def setUp(self):
-        """ Make sure a single feed is available for adding filters. """
+        # Duplicates are shown when the feed of the original is inactive
+        self.feed.active = False
+        self.feed.save()
 
-        self.feed = Feed(
-            url='http://feeds.rijksoverheid.nl/onderwerpen/telecomgegevens-'
-                'voor-opsporing/documenten-en-publicaties.rss')
+        cache.clear()
 
-        # Save and fetch
+        response = self.client.get(reverse('rss_all'))
+        self.assertEquals(response.content.count('<title>Entry 1</title>'), 1)
+
+        self.feed.active = True
         self.feed.save()
 
-    def test_single_inclusive(self):
-        """ Test with a single inclusive filter on title and summary. """
+        # Deleting the original shows the duplicate
+        original.delete()
 
-        test_filter = KeywordFilter(
-            name='test_filter',
-            keywords='CIOT'
+        self.assertEquals(
+            FeedEntry.objects.get(pk=duplicate.pk).duplicate_of, None
         )
-        test_filter.save()
 
-        self.feed.filters.add(test_filter)
+    def test_batch_duplicates(self):
+        """ Entries for the same page within a batch are linked. """
 
-        self.assertTrue(filter_entry(self.feed, self.entry_1))
-        self.assertTrue(filter_entry(self.feed, self.entry_2))
-        self.assertFalse(filter_entry(self.feed, self.entry_3))
+        self.feed.content_xpath = '//div'
+        self.feed.content_mime_type = 'text/html'
 
-    def test_single_exclusive(self):
-        """ Test with a single exclusive filter on title and summary. """
+        with patch('newspeak.crawler.perform_extractions') as extractions:
+            extractions.return_value = {}
 
-        test_filter = KeywordFilter(
-            name='test_filter',
-            keywords='CIOT',
-            filter_inclusive=False
+            self.assertEquals(update_entries(self.feed, [
+                self.make_entry(1, id=u'urn:entry:1'),
+                self.make_entry(1, id=u'urn:entry:2',
+                    link=u'http://example.com/entry/1?utm_source=rss'
+                ),
+                self.make_entry(2, id=u'urn:entry:3')
+            ]), 3)
+
+            self.assertEquals(
+                sorted(extractions.call_args[0][0].keys()),
+                [('id', u'urn:entry:1'), ('id', u'urn:entry:3')]
+            )
+
+        self.assertEquals(
+            self.feed.entries.get(entry_id=u'urn:entry:2').duplicate_of,
+            self.feed.entries.get(entry_id=u'urn:entry:1')
+        )
+        self.assertEquals(
+            self.feed.entries.filter(duplicate_of=None).count(), 2
         )
-        test_filter.save()
 
-        self.feed.filters.add(test_filter)
+    def test_near_duplicates(self):
+        """ Entries with nearly the same text in other feeds are linked. """
 
-        self.assertFalse(filter_entry(self.feed, self.entry_1))
-        self.assertFalse(filter_entry(self.feed, self.entry_2))
-        self.assertTrue(filter_entry(self.feed, self.entry_3))
+        summary = (
+            u'<p>The minister announced today that the retention of '
+            u'telecommunications data will be extended to all internet '
+            u'providers, starting next year. The proposal was sent to '
+            u'parliament on Friday and will be discussed in the coming '
+            u'weeks, according to a spokesperson of the ministry.</p>'
+        )
 
-    def test_single_title_inclusive(self):
-        """ Test with a single inclusive filter on just the title. """
+        with patch('newspeak.crawler.update_feed'):
+            other_feed = Feed.objects.create(
+                url='http://example.com/other.rss',
+                content_xpath='//div', content_mime_type='text/html'
+            )
 
-        test_filter = KeywordFilter(
-            name='test_filter',
-            keywords='Indexering'
+        update_entries(self.feed, [
+            self.make_entry(1, title=u'Data retention', summary=summary),
+            self.make_entry(2)
+        ])
+
+        self.assertEquals(EntryFingerprint.objects.count(), 1)
+
+        # Pages of duplicates are not fetched
+        with patch('newspeak.crawler.perform_extractions') as extractions:
+            extractions.return_value = {}
+
+            update_entries(other_feed, [
+                self.make_entry(11, title=u'Data retention:',
+                    summary=summary.replace(u'Friday', u'Thursday')
+                ),
+                self.make_entry(12, title=u'Something else entirely',
+                    summary=u'Unrelated news about the weather, which was '
+                        u'rather nice for the time of year.'
+                )
+            ])
+
+            self.assertEquals(len(extractions.call_args[0][0]), 1)
+
+        original = self.feed.entries.get(link=u'http://example.com/entry/1')
+
+        self.assertEquals(
+            other_feed.entries.get(link=u'http://example.com/entry/11')
+                .duplicate_of, original
+        )
+        self.assertEquals(
+            other_feed.entries.get(link=u'http://example.com/entry/12')
+                .duplicate_of, None
         )
-        test_filter.save()
 
-        self.feed.filters.add(test_filter)
+        # Only entries which are no duplicates are fingerprinted
+        self.assertEquals(EntryFingerprint.objects.count(), 2)
 
-        self.assertFalse(filter_entry(self.feed, self.entry_1))
-        self.assertFalse(filter_entry(self.feed, self.entry_2))
-        self.assertTrue(filter_entry(self.feed, self.entry_3))
+        # Entries in the same feed are not linked
+        update_entries(self.feed, [
+            self.make_entry(3, title=u'Data retention', summary=summary)
+        ])
 
-    def test_single_summary_inclusive(self):
-        """ Test with a single inclusive filter on just the title. """
+        self.assertEquals(self.feed.entries.get(
+            link=u'http://example.com/entry/3').duplicate_of, None
+        )
 
-        test_filter = KeywordFilter(
-            name='test_filter',
-            keywords='2012'
+        with self.settings(NEWSPEAK_DUPLICATE_DISTANCE=0):
+            with patch('newspeak.crawler.perform_extractions') as extractions:
+                extractions.return_value = {}
+
+                update_entries(other_feed, [self.make_entry(13,
+                    title=u'Data retention', summary=summary
+                )])
+
+        self.assertEquals(other_feed.entries.get(
+            link=u'http://example.com/entry/13').duplicate_of, None
         )
-        test_filter.save()
 
-        self.feed.filters.add(test_filter)
+    def test_related(self):
+        """ Test creating and updating content and enclosures in batch. """
 
-        self.assertFalse(filter_entry(self.feed, self.entry_1))
-        self.assertTrue(filter_entry(self.feed, self.entry_2))
-        self.assertTrue(filter_entry(self.feed, self.entry_3))
+        def make_entries(content_value):
+            return [self.make_entry(number,
+                content=[feedparser.FeedParserDict(
+                    type=u'text/html', language=None, value=content_value
+                )],
+                # Feedparser derives enclosures from links
+                links=[feedparser.FeedParserDict(
+                    rel=u'enclosure', length=u'1024', type=u'audio/mpeg',
+                    href=u'http://example.com/entry/%d.mp3' % number
+                )] * 2
+            ) for number in range(5)]
+
+        update_entries(self.feed, make_entries(u'<p>Content</p>'))
+
+        self.assertEquals(FeedEnclosure.objects.count(), 5)
+        self.assertEquals(FeedContent.objects.count(), 5)
+
+        # Updating again should not duplicate but update content
+        update_entries(self.feed, make_entries(u'<p>Changed</p>'))
+
+        self.assertEquals(FeedEnclosure.objects.count(), 5)
+        self.assertEquals(FeedContent.objects.count(), 5)
+        self.assertEquals(
+            FeedContent.objects.filter(value=u'<p>Changed</p>').count(), 5
+        )
 
 
 class XPathExtractionTests(TestCase):
@@ -610,6 +2624,7 @@ class XPathExtractionTests(TestCase):
         feed.modified = ''
         feed.etag = ''
         feed.updated = None
+        feed.next_crawl = None
         feed.save()
 
         update_feeds()
@@ -670,6 +2685,63 @@ class XPathExtractionTests(TestCase):
 class UtilTests(TestCase):
     """ Test utility functions. """
 
+    def test_simhash(self):
+        """ Similar texts have SimHashes differing in few bits. """
+
+        text = (
+            u'Bits of Freedom defends the freedom of communication and the '
+            u'privacy of internet users in the Netherlands and abroad. It '
+            u'campaigns against data retention, internet filtering and '
+            u'surveillance, and for net neutrality.'
+        )
+
+        simhash = get_simhash(text)
+        similar = get_simhash(
+            u'<p>%s</p>' % text.replace(u'campaigns', u'fights')
+        )
+        different = get_simhash(
+            u'The weather was rather nice for the time of year, with sunny '
+            u'spells in the morning and a few showers later on.'
+        )
+
+        self.assertEquals(simhash, get_simhash(text.upper()))
+        self.assertTrue(get_hamming_distance(simhash, similar) <= 3)
+        self.assertTrue(get_hamming_distance(simhash, different) > 3)
+
+        # Short texts are not fingerprinted
+        self.assertEquals(get_simhash(u'Short title'), None)
+
+        bands = get_simhash_bands(simhash)
+
+        self.assertEquals(len(bands), 4)
+        self.assertEquals(
+            sum(value << (16 * band) for (band, value) in enumerate(bands)),
+            simhash
+        )
+
+    def test_canonicalize_link(self):
+        """ Trivially different links have the same canonical form. """
+
+        for link in (
+            u'http://example.com/page?b=2&a=1',
+            u'HTTP://EXAMPLE.COM:80/page?a=1&b=2#comments',
+            u' http://example.com/page?utm_source=rss&a=1&b=2&utm_medium=x',
+        ):
+            self.assertEquals(canonicalize_link(link),
+                u'http://example.com/page?a=1&b=2'
+            )
+
+        self.assertEquals(canonicalize_link(u'https://example.com:443'),
+            u'https://example.com/'
+        )
+        self.assertEquals(canonicalize_link(u'http://example.com:8080/'),
+            u'http://example.com:8080/'
+        )
+
+        self.assertNotEquals(get_link_hash(u'http://example.com/Page'),
+            get_link_hash(u'http://example.com/page')
+        )
+
     def test_fetch_url(self):
         """ Test fetching a URL. """
         # This should return a 200
@@ -20,4 +20,36 @@ urlpatterns = patterns('',
 
     url(r'^all/rss/$', NewspeakRSSFeed(), name='rss_all'),
     url(r'^all/atom/$', NewspeakAtomFeed(), name='atom_all'),
+
+    # Entries of a single source feed
+    surl(r'^feed/<feed_id:#>/rss/$', NewspeakRSSFeed(), name='rss_feed'),
+    surl(r'^feed/<feed_id:#>/atom/$', NewspeakAtomFeed(), name='atom_feed'),
+
+    # Entries of feeds using a keyword filter
+    surl(r'^filter/<filter_id:#>/rss/$', NewspeakRSSFeed(),
+        name='rss_filter'
+    ),
+    surl(r'^filter/<filter_id:#>/atom/$', NewspeakAtomFeed(),
+        name='atom_filter'
+    ),
+
+    # Entries published in a year, month or day
+    surl(r'^archive/<year:Y>/rss/$', NewspeakRSSFeed(),
+        name='rss_archive'
+    ),
+    surl(r'^archive/<year:Y>/<month:m>/rss/$', NewspeakRSSFeed(),
+        name='rss_archive'
+    ),
+    surl(r'^archive/<year:Y>/<month:m>/<day:d>/rss/$', NewspeakRSSFeed(),
+        name='rss_archive'
+    ),
+    surl(r'^archive/<year:Y>/atom/$', NewspeakAtomFeed(),
+        name='atom_archive'
+    ),
+    surl(r'^archive/<year:Y>/<month:m>/atom/$', NewspeakAtomFeed(),
+        name='atom_archive'
+    ),
+    surl(r'^archive/<year:Y>/<month:m>/<day:d>/atom/$', NewspeakAtomFeed(),
+        name='atom_archive'
+    ),
 )
@@ -1,22 +1,30 @@
 import logging
 logger = logging.getLogger(__name__)
 
+import hashlib
 import re
+import threading
+import time
 
+from functools import wraps
 from time import mktime
 from datetime import datetime
+from urlparse import urlsplit, urlunsplit
 
 from lxml import html
 
-from eventlet.green import urllib2
+from eventlet.green import httplib, socket
 
 from django.utils import timezone
-from django.utils.functional import memoize
 
 from django.conf import settings
+from django.core.cache import cache
 
 from django.db import models
 
+from .metrics import metrics
+from .fetching import connection_pool, host_limiter, page_cache, Response
+
 
 def datetime_from_struct(time):
     """
@@ -31,6 +39,11 @@ def datetime_from_struct(time):
     return dt
 
 
+def total_seconds(delta):
+    """ Return the number of seconds in a timedelta, as in Python 2.7+. """
+    return delta.days * 86400 + delta.seconds + delta.microseconds / 1e6
+
+
 def get_or_create_object(model, **kwargs):
     """
     Get or create feed entry with specified kwargs without saving.
@@ -57,6 +70,24 @@ def get_or_create_object(model, **kwargs):
     return db_entry
 
 
+def chunked(iterable, size):
+    """
+    Yield lists of at most `size` items from iterable, for example to keep
+    `__in` lookups within the query parameter limits of the database.
+    """
+    chunk = []
+
+    for item in iterable:
+        chunk.append(item)
+
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
+
+
 def get_next_ordering(model, field_name='sort_order', increment=10):
     """
     Get the next available value for the sortorder for a model.
@@ -79,15 +110,300 @@ def get_next_ordering(model, field_name='sort_order', increment=10):
         return increment
 
 
+class LRUCache(object):
+    """
+    Size-bounded cache evicting the least recently used items, safe for use
+    from (green) threads and counting hits and misses.
+    """
+
+    # Indexes of links in the circular list; [previous, next, key, value]
+    PREVIOUS, NEXT, KEY, VALUE = 0, 1, 2, 3
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+
+        self.clear()
+
+    def get(self, key, default=None):
+        """ Return the value for key and mark it as most recently used. """
+        with self.lock:
+            link = self.links.get(key)
+
+            if link is None:
+                self.misses += 1
+
+                return default
+
+            self.hits += 1
+
+            # Move the link to the front of the list
+            previous, next = link[self.PREVIOUS], link[self.NEXT]
+            previous[self.NEXT] = next
+            next[self.PREVIOUS] = previous
+
+            self._insert(link)
+
+            return link[self.VALUE]
+
+    def set(self, key, value):
+        """ Store value for key, evicting the least recently used item. """
+        with self.lock:
+            link = self.links.get(key)
+
+            if link is not None:
+                link[self.VALUE] = value
+
+                return
+
+            if len(self.links) >= self.maxsize:
+                # Remove the last link in the list
+                last = self.root[self.PREVIOUS]
+
+                last[self.PREVIOUS][self.NEXT] = self.root
+                self.root[self.PREVIOUS] = last[self.PREVIOUS]
+
+                del self.links[last[self.KEY]]
+
+            link = [None, None, key, value]
+            self._insert(link)
+
+            self.links[key] = link
+
+    def _insert(self, link):
+        """ Insert a link at the front of the list. """
+        first = self.root[self.NEXT]
+
+        link[self.PREVIOUS] = self.root
+        link[self.NEXT] = first
+
+        first[self.PREVIOUS] = link
+        self.root[self.NEXT] = link
+
+    def clear(self):
+        """ Remove all items and reset the counters. """
+        self.links = {}
+
+        self.root = []
+        self.root[:] = [self.root, self.root, None, None]
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.links)
+
+    def info(self):
+        """ Return a dictionary with cache statistics. """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self),
+            'maxsize': self.maxsize
+        }
+
+
+def lru_cache(maxsize):
+    """
+    Decorator caching the results of a function with hashable arguments in
+    an `LRUCache`, available as the `cache` attribute of the function.
+    """
+    def decorator(function):
+        cache = LRUCache(maxsize)
+        missing = object()
+
+        @wraps(function)
+        def wrapper(*args):
+            result = cache.get(args, missing)
+
+            if result is missing:
+                result = function(*args)
+                cache.set(args, result)
+
+            return result
+
+        wrapper.cache = cache
+
+        return wrapper
+
+    return decorator
+
+
+# Cache keys for the generation of the aggregated entries, a counter keying
+# rendered feeds, and for the time at which they last changed
+FEED_GENERATION_KEY = 'newspeak:feeds:generation'
+FEED_MODIFIED_KEY = 'newspeak:feeds:modified'
+
+# Keep the generation for as long as memcached allows, 30 days
+FEED_GENERATION_TIMEOUT = 30 * 24 * 60 * 60
+
+
+def invalidate_feeds():
+    """
+    Register a change to the aggregated entries, such that rendered feeds
+    cached before are no longer used. Returns the new generation.
+
+    Changes are registered once per batch of entries rather than per entry,
+    as every change takes a round trip to the cache.
+    """
+    cache.set(FEED_MODIFIED_KEY, time.time(), FEED_GENERATION_TIMEOUT)
+
+    try:
+        generation = cache.incr(FEED_GENERATION_KEY)
+
+    except ValueError:
+        # Not in the cache, start from the time in milliseconds such that
+        # generations of feeds still cached are not used again
+        generation = int(time.time() * 1000)
+
+        cache.set(FEED_GENERATION_KEY, generation, FEED_GENERATION_TIMEOUT)
+
+    logger.debug(u'Invalidating rendered feeds, generation %d', generation)
+
+    return generation
+
+
+def get_feed_generation():
+    """
+    Return the generation of the aggregated entries, as registered in the
+    cache, used to key rendered feeds.
+    """
+    generation = cache.get(FEED_GENERATION_KEY)
+
+    if generation is None:
+        generation = invalidate_feeds()
+
+    return generation
+
+
+def get_feeds_modified():
+    """
+    Return the time at which the aggregated entries last changed, as
+    seconds since the epoch.
+    """
+    modified = cache.get(FEED_MODIFIED_KEY)
+
+    if modified is None:
+        # Unknown, as if the entries changed just now
+        modified = time.time()
+
+        cache.set(FEED_MODIFIED_KEY, modified, FEED_GENERATION_TIMEOUT)
+
+    return modified
+
+
+# Query parameters only used for tracking, ignored when comparing links
+TRACKING_PARAMETER_REGEX = re.compile(r'^(utm_\w+|fbclid|gclid)$')
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def canonicalize_link(link):
+    """
+    Return the canonical form of a link, such that trivially different links
+    to the same page are equal: without fragment, default port or tracking
+    parameters, with sorted parameters and lower case scheme and host.
+    """
+    scheme, netloc, path, query, fragment = urlsplit(link.strip())
+
+    scheme = scheme.lower()
+    netloc = netloc.lower()
+
+    port = DEFAULT_PORTS.get(scheme)
+    if port and netloc.endswith(':%d' % port):
+        netloc = netloc[:-len(':%d' % port)]
+
+    parameters = [
+        parameter for parameter in query.split('&') if parameter and
+        not TRACKING_PARAMETER_REGEX.match(parameter.split('=', 1)[0])
+    ]
+
+    return urlunsplit(
+        (scheme, netloc, path or '/', '&'.join(sorted(parameters)), '')
+    )
+
+
+def get_link_hash(link):
+    """ Return the hash of the canonical form of a link. """
+    return hashlib.sha1(canonicalize_link(link).encode('utf-8')).hexdigest()
+
+
+# SimHash fingerprints: 64 bits, in four bands of 16 bits
+SIMHASH_BITS = 64
+SIMHASH_BANDS = 4
+
+# Texts with fewer words are not fingerprinted, as fingerprints of short
+# texts are too similar
+SIMHASH_MIN_WORDS = 8
+
+WORD_REGEX = re.compile(r'\w+', re.UNICODE)
+TAG_REGEX = re.compile(r'<[^>]*>')
+
+
+def get_simhash(text):
+    """
+    Return the SimHash of the text, or None for texts too short: a 64 bit
+    integer which differs in few bits for similar texts. Computed over the
+    words of the text weighted by their frequency, ignoring HTML tags and
+    case.
+    """
+    words = WORD_REGEX.findall(TAG_REGEX.sub(u' ', text).lower())
+
+    if len(words) < SIMHASH_MIN_WORDS:
+        return None
+
+    frequencies = {}
+    for word in words:
+        frequencies[word] = frequencies.get(word, 0) + 1
+
+    weights = [0] * SIMHASH_BITS
+
+    for word, frequency in frequencies.items():
+        word_hash = int(
+            hashlib.md5(word.encode('utf-8')).hexdigest()[:16], 16
+        )
+
+        for bit in range(SIMHASH_BITS):
+            if word_hash & (1 << bit):
+                weights[bit] += frequency
+            else:
+                weights[bit] -= frequency
+
+    return sum(
+        1 << bit for bit in range(SIMHASH_BITS) if weights[bit] > 0
+    )
+
+
+def get_simhash_bands(simhash):
+    """
+    Split a SimHash in bands. Hashes differing in less bits than there are
+    bands have at least one band in common.
+    """
+    band_bits = SIMHASH_BITS / SIMHASH_BANDS
+
+    return [
+        (simhash >> (band * band_bits)) & ((1 << band_bits) - 1)
+        for band in range(SIMHASH_BANDS)
+    ]
+
+
+def get_hamming_distance(first, second):
+    """ Return the number of bits in which two integers differ. """
+    return bin(first ^ second).count('1')
+
+
+def split_keywords(keywords):
+    """ Split comma separated keywords, stripping leading/trailing spaces. """
+    return [keyword.strip() for keyword in keywords.split(',')]
+
+
+@lru_cache(settings.NEWSPEAK_REGEX_CACHE_SIZE)
 def keywords_to_regex(keywords):
     """ Take keywords, return compiled regex. """
 
     regex_parts = []
     # Construct regex for keyword filter
-    for keyword in keywords.split(','):
-        # Strip leading or trailing spaces from keyword
-        keyword = keyword.strip()
-
+    for keyword in split_keywords(keywords):
         keyword = keyword.replace('*', '\w*')
         keyword = keyword.replace('?', '\w')
 
@@ -105,51 +421,105 @@ def keywords_to_regex(keywords):
 
     return compiled_regex
 
-# Cache the compiled regular expressions - never compile the same twice
-_regex_cache = {}
-keywords_to_regex = memoize(keywords_to_regex, _regex_cache, 1)
 
+# Response headers updated in the page cache on revalidation
+REVALIDATED_HEADERS = ('etag', 'last-modified', 'cache-control', 'date')
 
-def fetch_url(url):
-    """ Fetches a URL and returns contents - use opener to support HTTPS. """
 
-    # Fetch and parse
-    logger.debug(u'Fetching %s', url)
+def fetch_response(url, headers=None):
+    """
+    Fetches a URL using a pooled keep-alive connection and returns the
+    `Response`, or None when the request failed.
 
-    # Use urllib2 directly for enabled SSL support (LXML doesn't by default)
-    timeout = 30
+    With the page cache enabled, fresh cached responses are returned without
+    making a request and stale ones are revalidated with a conditional
+    request. Callers sending their own validators get a 304 response when
+    these match a fresh cached response.
+    """
 
-    try:
-        opener = urllib2.urlopen(url, None, timeout)
+    headers = dict(headers or {})
+    conditional = 'If-None-Match' in headers or 'If-Modified-Since' in headers
+
+    cached, expires = page_cache.get(url)
+
+    if cached is not None and expires > time.time():
+        logger.debug(u'Using cached response for %s', url)
+        metrics.increment('page_cache_hits')
 
-        # Fetch HTTP data in one batch, as handling the 'file-like' object to
-        # lxml results in thread-locking behaviour.
-        htmldata = opener.read()
+        etag = headers.get('If-None-Match')
+        modified = headers.get('If-Modified-Since')
 
-    except urllib2.URLError, urllib2.HTTPError:
+        if (etag and etag == cached.headers.get('etag')) or \
+                (modified and modified == cached.headers.get('last-modified')):
+            return Response(cached.url, 304, cached.headers, '')
+
+        return cached
+
+    if cached is not None and not conditional:
+        if cached.headers.get('etag'):
+            headers['If-None-Match'] = cached.headers['etag']
+        if cached.headers.get('last-modified'):
+            headers['If-Modified-Since'] = cached.headers['last-modified']
+
+    logger.debug(u'Fetching %s', url)
+
+    try:
+        with host_limiter.limit(url):
+            # Fetch HTTP data in one batch, as handling the 'file-like' object
+            # to lxml results in thread-locking behaviour.
+            response = connection_pool.request(url, headers)
+
+    except (httplib.HTTPException, socket.error):
         # These type of errors are non-fatal - but *should* be logged.
         logger.exception(u'HTTP Error for %s, returning emtpy string.',
             url
         )
+        metrics.increment('page_errors')
 
         return None
 
-    return htmldata
+    if response.status >= 400:
+        logger.error(u'HTTP Error %d for %s, returning empty string.',
+            response.status, url
+        )
+        metrics.increment('page_errors')
 
+        return None
 
-def parse_url(url):
-    """
-    Return lxml-parsed HTML for given URL or None when HTTP request failed.
+    if response.status == 304:
+        metrics.increment('pages_not_modified')
 
-    Uses urllib2 directly and fetches as string before parsing as to prevent
-    thread locking issues.
-    """
-    htmldata = fetch_url(url)
+    if response.status == 304 and cached is not None and not conditional:
+        logger.debug(u'Cached response for %s not modified', url)
 
-    # No data, return None
-    if not htmldata:
+        for header in REVALIDATED_HEADERS:
+            if header in response.headers:
+                cached.headers[header] = response.headers[header]
+
+        page_cache.set(url, cached)
+
+        return cached
+
+    if response.status == 200:
+        page_cache.set(url, response)
+
+    return response
+
+
+def fetch_url(url):
+    """ Fetches a URL and returns contents, or None on errors. """
+
+    response = fetch_response(url)
+
+    if response is None:
         return None
 
+    return response.body
+
+
+def parse_html(htmldata, url):
+    """ Return lxml-parsed HTML with all links made absolute. """
+
     # Parse
     logger.debug(u'Parsing HTML for %s', url)
     parsed = html.fromstring(htmldata, base_url=url)
@@ -158,3 +528,18 @@ def parse_url(url):
     parsed.make_links_absolute(url)
 
     return parsed
+
+
+def parse_url(url):
+    """
+    Return lxml-parsed HTML for given URL or None when HTTP request failed.
+
+    Fetches as string before parsing as to prevent thread locking issues.
+    """
+    htmldata = fetch_url(url)
+
+    # No data, return None
+    if not htmldata:
+        return None
+
+    return parse_html(htmldata, url)